@@ -3,6 +3,10 @@ from importlib import import_module
 
 from quart import Quart
 
+from encoding_pool import EncodingPool
+from enrollment import EnrollmentJobs
+from storage import PickleStorage, UserStorage
+
 
 def create_app(*args, **kwargs):
 
@@ -10,7 +14,26 @@ def create_app(*args, **kwargs):
     app = Quart(__name__, instance_relative_config=True)
     config_mapping = {
         "SECRET_KEY": "239DR)23@293msgkfG#kffgnj",
-        "MAX_CONTENT_LENGTH": 10*1000*1000
+        "MAX_CONTENT_LENGTH": 10*1000*1000,
+        # Threads used by the storage layer for file I/O, crypto and face encoding
+        "STORAGE_IO_WORKERS": 4,
+        # How many of those threads enrollments may occupy at once
+        "MAX_CONCURRENT_ENCODINGS": 2,
+        # Worker processes encoding enrollment images, None means one per core.
+        # Set to 0 to encode on the storage threads instead
+        "ENCODING_WORKERS": None,
+        # Uploads allowed to wait for a worker before the backend answers 503
+        "ENCODING_QUEUE_DEPTH": 32,
+        # Each worker process is replaced after encoding this many images
+        "ENCODING_WORKER_MAX_TASKS": 100,
+        # Enrollment images are shrunk to this longest side before face detection
+        "ENROLLMENT_DETECT_MAX_SIZE": 800,
+        # Background tasks running queued enrollments, None means one per encoding worker
+        "ENROLLMENT_WORKERS": None,
+        # Enrollments allowed to wait in the job queue before uploads get a 503
+        "ENROLLMENT_QUEUE_SIZE": 256,
+        # The precision encodings are stored in is set by the ENCODING_STORAGE_DTYPE
+        # environment variable instead, so every process stores the same one
     }
 
     # if is_test:
@@ -18,6 +41,9 @@ def create_app(*args, **kwargs):
     #     config_mapping["SERVER_NAME"] = "localhost"
 
     app.config.from_mapping(**config_mapping)
+    PickleStorage.configure(max_io_workers=app.config["STORAGE_IO_WORKERS"])
+    UserStorage.max_concurrent_encodings = app.config["MAX_CONCURRENT_ENCODINGS"]
+    UserStorage.max_detect_size = app.config["ENROLLMENT_DETECT_MAX_SIZE"]
 
     # ensure the instance folder exists
     try:
@@ -27,8 +53,48 @@ def create_app(*args, **kwargs):
 
     # Register URL/Websocket Blueprints
     register_blueprints_from_modules(app, "routing")  
+    register_encoding_pool(app)
+    register_user_storage(app)
+    register_enrollment_jobs(app)
     return app
 
+def register_encoding_pool(app: Quart):
+
+    @app.before_serving
+    async def _start_encoding_pool():
+        app.extensions["encoding_pool"] = None
+        if app.config["ENCODING_WORKERS"] == 0:
+            return
+
+        pool = EncodingPool(
+            max_workers=app.config["ENCODING_WORKERS"],
+            max_queue_depth=app.config["ENCODING_QUEUE_DEPTH"],
+            max_tasks_per_child=app.config["ENCODING_WORKER_MAX_TASKS"],
+            max_detect_size=app.config["ENROLLMENT_DETECT_MAX_SIZE"],
+        )
+        pool.start()
+        app.extensions["encoding_pool"] = pool
+
+    @app.after_serving
+    async def _stop_encoding_pool():
+        pool = app.extensions.pop("encoding_pool", None)
+        if pool is not None:
+            pool.shutdown()
+
+def register_user_storage(app: Quart):
+
+    # One storage instance for the whole app, so keys are loaded once and
+    # users/encodings stay warm in memory between requests
+    @app.before_serving
+    async def _start_user_storage():
+        user_storage = UserStorage(encoding_pool=app.extensions.get("encoding_pool"))
+        await user_storage.warm_up()
+        app.extensions["user_storage"] = user_storage
+
+    @app.after_serving
+    async def _stop_user_storage():
+        app.extensions.pop("user_storage", None)
+
 def register_blueprints_from_modules(app: Quart, *src_modules):
 
     blueprints = []
@@ -42,4 +108,26 @@ def register_blueprints_from_modules(app: Quart, *src_modules):
                 blueprints.append(getattr(m_instance, attr))
 
     for b in blueprints:
-        app.register_blueprint(b)
\ No newline at end of file
+        app.register_blueprint(b)
+
+def register_enrollment_jobs(app: Quart):
+
+    @app.before_serving
+    async def _start_enrollment_jobs():
+        encoding_pool = app.extensions.get("encoding_pool")
+        workers = app.config["ENROLLMENT_WORKERS"]
+        if not workers:
+            workers = encoding_pool.max_workers if encoding_pool else UserStorage.max_concurrent_encodings
+        jobs = EnrollmentJobs(
+            app.extensions["user_storage"],
+            workers=workers,
+            max_queue_size=app.config["ENROLLMENT_QUEUE_SIZE"],
+        )
+        jobs.start()
+        app.extensions["enrollment_jobs"] = jobs
+
+    @app.after_serving
+    async def _stop_enrollment_jobs():
+        jobs = app.extensions.pop("enrollment_jobs", None)
+        if jobs is not None:
+            await jobs.stop()
\ No newline at end of file
@@ -0,0 +1,448 @@
+"""
+Benchmarks for the storage and recognition hot paths. Every benchmark runs against
+synthetic data in a temporary directory, so none of them touch the real user storage.
+
+	python benchmark.py startup --sizes 1000 10000 50000
+	python benchmark.py enrollment --megapixels 1 4 12 24 --image face.jpg
+	python benchmark.py fps --workers 1 2 4 8 --source door.mp4
+	python benchmark.py match --sizes 10 1000 100000 --faces 3
+	python benchmark.py ann --size 100000 --probes 1 4 8 16 32
+	python benchmark.py precision --sizes 1000 10000 100000
+	python benchmark.py cameras --cameras 1 2 4 --schedule motion --source door.mp4
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import tracemalloc
+from collections import deque
+from concurrent import futures
+from pathlib import Path
+from time import perf_counter
+
+import cv2 as cv
+import numpy as np
+
+from encoding_pool import DEFAULT_MAX_DETECT_SIZE, encode_image
+from frontend import WebcamReader
+from matching import FaceMatcher, Int8Matcher, IVFIndex, PCAIndex
+from pipeline import RecognitionPool, detect_faces
+from storage import UserStorage
+from video_sources import open_source
+
+
+def _timed(fn, *args, **kwargs):
+	start = perf_counter()
+	result = fn(*args, **kwargs)
+	return result, perf_counter() - start
+
+
+async def _timed_async(coro):
+	start = perf_counter()
+	result = await coro
+	return result, perf_counter() - start
+
+
+async def _populate_user_storage(storage: UserStorage, n_users: int, rng: np.random.Generator):
+	""" Writes `n_users` encrypted encodings the same way `add_user` lays them out on
+	disk, skipping the face detection step. """
+	store = {}
+	for i in range(n_users):
+		username = f"user{i:06d}"
+		user_dir = storage.get_relative_path(f"known_users/{username}")
+		user_dir.mkdir(parents=True, exist_ok=True)
+		encoding_path = user_dir.joinpath("encoding.dat")
+		encoding = rng.normal(0, 0.1, 128)
+		with encoding_path.open("wb") as f:
+			f.write(storage.fernet.encrypt(encoding.tobytes()))
+		store[username] = {
+			'img_path': str(user_dir.joinpath("img.jpg")),
+			'encoding_path': str(encoding_path)
+		}
+	await storage.write(store)
+
+
+async def _legacy_startup(storage: UserStorage):
+	""" The original `get_known_encodings` loop: one full store read per user. `storage` must
+	have its read cache off and not be warmed up, or the reads are answered from memory. """
+	names, encodings = [], []
+	for username, _, _ in await storage.list_users():
+		encoding = await storage.get_user_encoding(username)
+		if encoding is not None:
+			names.append(username)
+			encodings.append(encoding)
+	return names, encodings
+
+
+async def _read_gallery(gallery):
+	# Loading only maps the matrix, so decrypt every row to time reading it in full
+	_, matrix = await gallery.load()
+	return np.asarray(matrix)
+
+
+async def benchmark_startup(sizes, legacy_limit: int, max_workers: int):
+	""" Time to load every known encoding at frontend startup. """
+	rng = np.random.default_rng(0)
+	print(f"{'users':>8} {'legacy (s)':>12} {'bulk (s)':>10} {'gallery (s)':>12}")
+	for n_users in sizes:
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			cwd = os.getcwd()
+			os.chdir(tmp_dir)  # The encryption key files live in the working directory
+			try:
+				storage = UserStorage(base_path=Path(tmp_dir))
+				await _populate_user_storage(storage, n_users, rng)
+
+				if n_users <= legacy_limit:
+					uncached = UserStorage(base_path=Path(tmp_dir), read_cache=False)
+					_, legacy_time = await _timed_async(_legacy_startup(uncached))
+					legacy = f"{legacy_time:12.3f}"
+				else:
+					legacy = f"{'skipped':>12}"
+
+				(names, encodings, _), bulk_time = await _timed_async(
+					storage.get_all_encodings(max_workers=max_workers)
+				)
+				await storage.gallery.extend(names, encodings)
+				_, gallery_time = await _timed_async(_read_gallery(storage.gallery))
+			finally:
+				os.chdir(cwd)
+
+		print(f"{n_users:>8} {legacy} {bulk_time:10.3f} {gallery_time:12.3f}")
+
+
+def _peak_memory(fn, *args, **kwargs):
+	""" Runs `fn` and returns its result, the time taken and the peak memory allocated while it
+	ran. tracemalloc sees numpy buffers but not dlib's own allocations. """
+	tracemalloc.start()
+	try:
+		result, elapsed = _timed(fn, *args, **kwargs)
+		_, peak = tracemalloc.get_traced_memory()
+	finally:
+		tracemalloc.stop()
+	return result, elapsed, peak
+
+
+def _legacy_encode(user_image: np.ndarray):
+	""" The original enrollment path: detect and encode on the full resolution image. """
+	import face_recognition
+	user_image_encoding = face_recognition.face_encodings(user_image)
+	return user_image_encoding[0] if user_image_encoding else None
+
+
+def benchmark_enrollment(megapixels, image_path: str, max_detect_size: int, repeats: int):
+	""" Time and memory to encode one enrollment image at several source resolutions. """
+	if image_path:
+		source = cv.cvtColor(cv.imread(image_path), cv.COLOR_BGR2RGB)
+	else:
+		# No face to find, but detection still has to scan the whole image
+		source = np.random.default_rng(0).integers(0, 255, (480, 640, 3), dtype=np.uint8)
+	aspect = source.shape[1] / source.shape[0]
+
+	print(
+		f"{'MP':>5} {'resolution':>11} {'full (ms)':>10} {'full (MB)':>10} "
+		f"{'bounded (ms)':>13} {'bounded (MB)':>13} {'same face':>10}"
+	)
+	for mp in megapixels:
+		height = int(round((mp * 1e6 / aspect) ** 0.5))
+		width = int(round(height * aspect))
+		user_image = cv.resize(source, (width, height), interpolation=cv.INTER_CUBIC)
+
+		full_times, bounded_times, full_peak, bounded_peak = [], [], 0, 0
+		for _ in range(repeats):
+			full, elapsed, peak = _peak_memory(_legacy_encode, user_image)
+			full_times.append(elapsed)
+			full_peak = max(full_peak, peak)
+			bounded, elapsed, peak = _peak_memory(encode_image, user_image, max_detect_size)
+			bounded_times.append(elapsed)
+			bounded_peak = max(bounded_peak, peak)
+
+		if full is None or bounded is None:
+			same_face = "yes" if full is None and bounded is None else "no"
+		else:
+			same_face = "yes" if np.linalg.norm(full - bounded) < 0.6 else "no"
+		print(
+			f"{mp:>5} {f'{width}x{height}':>11} {1000 * min(full_times):10.1f} {full_peak / 2**20:10.1f} "
+			f"{1000 * min(bounded_times):13.1f} {bounded_peak / 2**20:13.1f} {same_face:>10}"
+		)
+
+
+def _load_frames(source: str, count: int=100):
+	""" Returns up to `count` RGB frames, half size as the frontend uses them, from any
+	source open_source takes or synthetic noise when there isn't one. """
+	if not source:
+		rng = np.random.default_rng(0)
+		return [rng.integers(0, 255, (240, 320, 3), dtype=np.uint8) for _ in range(count)]
+
+	cap = open_source(source, pacing="fast")
+	frames = []
+	while len(frames) < count:
+		ret, frame = cap.read()
+		if not ret:
+			break
+		small_frame = cv.resize(frame, (0, 0), fx=0.5, fy=0.5)
+		frames.append(cv.cvtColor(small_frame, cv.COLOR_BGR2RGB))
+	cap.release()
+	return frames
+
+
+def benchmark_fps(worker_counts, source: str, duration: float):
+	""" Recognition frames per second with detection on 1 to N worker processes, keeping one
+	frame in flight per worker like the frontend does. """
+	frames = _load_frames(source)
+
+	# Baseline: everything on the calling thread
+	done, start = 0, perf_counter()
+	while perf_counter() - start < duration:
+		detect_faces(frames[done % len(frames)])
+		done += 1
+	baseline = done / (perf_counter() - start)
+	print(f"{'workers':>8} {'fps':>8} {'speedup':>8}")
+	print(f"{'inline':>8} {baseline:8.1f} {1.0:8.2f}")
+
+	for workers in worker_counts:
+		pool = RecognitionPool(workers)
+		pool.start()
+		try:
+			# Let every worker finish loading the models before timing
+			futures.wait([pool.submit(frames[0]) for _ in range(workers)])
+
+			in_flight, submitted, done = deque(), 0, 0
+			start = perf_counter()
+			while perf_counter() - start < duration:
+				while len(in_flight) < workers:
+					in_flight.append(pool.submit(frames[submitted % len(frames)]))
+					submitted += 1
+				in_flight.popleft().result()
+				done += 1
+			fps = done / (perf_counter() - start)
+		finally:
+			pool.shutdown()
+		print(f"{workers:>8} {fps:8.1f} {fps / baseline:8.2f}")
+
+
+def _legacy_match(face_encodings, known_face_names, known_face_encodings, threshold: float=0.6):
+	""" The original matching loop: compare_faces and face_distance on every face in turn,
+	from a list of float64 encodings. """
+	import face_recognition
+	names = []
+	for face_encoding in face_encodings:
+		matches = face_recognition.compare_faces(known_face_encodings, face_encoding)
+		face_distances = face_recognition.face_distance(known_face_encodings, face_encoding)
+		best_match_index = np.argmin(face_distances) if matches else -1
+		names.append(
+			known_face_names[best_match_index]
+			if best_match_index != -1 and face_distances[best_match_index] < threshold else "Unknown"
+		)
+	return names
+
+
+def benchmark_match(sizes, faces: int, repeats: int):
+	""" Time to match every face in a frame against galleries of increasing size. """
+	rng = np.random.default_rng(0)
+	print(f"{'gallery':>8} {'faces':>6} {'legacy (ms)':>12} {'matcher (ms)':>13} {'speedup':>8} {'agree':>6}")
+	for size in sizes:
+		known_face_names = [f"user{i:06d}" for i in range(size)]
+		gallery = rng.normal(0, 0.1, (size, 128))
+		known_face_encodings = list(gallery)
+		# Half the faces belong to enrolled users, the other half are strangers
+		probes = rng.normal(0, 0.1, (faces, 128))
+		probes[::2] = gallery[rng.integers(0, size, len(probes[::2]))] + rng.normal(0, 0.02, (len(probes[::2]), 128))
+
+		matcher = FaceMatcher(known_face_names, gallery)
+		legacy_times, matcher_times = [], []
+		for _ in range(repeats):
+			legacy, elapsed = _timed(_legacy_match, probes, known_face_names, known_face_encodings)
+			legacy_times.append(elapsed)
+			matches, elapsed = _timed(matcher.match, probes)
+			matcher_times.append(elapsed)
+
+		agree = sum(match.name == name for match, name in zip(matches, legacy)) / len(legacy)
+		legacy_time, matcher_time = min(legacy_times), min(matcher_times)
+		print(
+			f"{size:>8} {faces:>6} {1000 * legacy_time:12.3f} {1000 * matcher_time:13.3f} "
+			f"{legacy_time / matcher_time:8.1f} {agree:6.0%}"
+		)
+
+
+def benchmark_ann(size: int, n_probes, faces: int, frames: int, noise: float):
+	""" Recall and latency of the IVF index against exact search, over a range of clusters
+	probed per frame. Recall is how often both find the same closest user. The PCA filter
+	is exact, so only its latency is of interest. """
+	rng = np.random.default_rng(0)
+	names = [f"user{i:06d}" for i in range(size)]
+	gallery = rng.normal(0, 0.1, (size, 128))
+	probes = gallery[rng.integers(0, size, (frames, faces))] + rng.normal(0, noise, (frames, faces, 128))
+
+	exact = FaceMatcher(names, gallery)
+	ivf, build_time = _timed(FaceMatcher, names, gallery, index=IVFIndex(), exact_below=0)
+	print(f"{size} users, {len(ivf.index.lists)} clusters, built in {build_time:.2f}s")
+
+	expected, exact_time = _timed(lambda: [exact.match(frame) for frame in probes])
+	print(f"{'probed':>7} {'ms/frame':>9} {'speedup':>8} {'recall':>7} {'agree':>6}")
+	print(f"{'exact':>7} {1000 * exact_time / frames:9.3f} {1.0:8.1f} {1.0:7.1%} {1.0:6.0%}")
+
+	pca = FaceMatcher(names, gallery, index=PCAIndex(), exact_below=0)
+	found, elapsed = _timed(lambda: [pca.match(frame) for frame in probes])
+	pairs = [(a, b) for frame_a, frame_b in zip(found, expected) for a, b in zip(frame_a, frame_b)]
+	agree = sum(a.name == b.name for a, b in pairs) / len(pairs)
+	print(f"{'pca':>7} {1000 * elapsed / frames:9.3f} {exact_time / elapsed:8.1f} {'-':>7} {agree:6.0%}")
+	for n_probe in n_probes:
+		ivf.index.n_probe = n_probe
+		found, elapsed = _timed(lambda: [ivf.match(frame) for frame in probes])
+		pairs = [(a, b) for frame_a, frame_b in zip(found, expected) for a, b in zip(frame_a, frame_b)]
+		recall = sum(a.index == b.index for a, b in pairs) / len(pairs)
+		agree = sum(a.name == b.name for a, b in pairs) / len(pairs)
+		print(f"{n_probe:>7} {1000 * elapsed / frames:9.3f} {exact_time / elapsed:8.1f} {recall:7.1%} {agree:6.0%}")
+
+
+def _float64_match(probes, known_face_names, known_face_encodings, threshold: float=0.6):
+	""" Full float64 precision, one face at a time, as face_distance computes it. """
+	names = []
+	for probe in probes:
+		face_distances = np.linalg.norm(known_face_encodings - probe, axis=1)
+		best_match_index = np.argmin(face_distances)
+		names.append(known_face_names[best_match_index] if face_distances[best_match_index] < threshold else "Unknown")
+	return names
+
+
+def benchmark_precision(sizes, faces: int, frames: int, noise: float):
+	""" Memory, speed and decisions of float32 and int8 matching against float64. The int8
+	matcher re-ranks from the memory-mapped gallery, which is not counted as it stays on
+	disk apart from the few rows read. """
+	rng = np.random.default_rng(0)
+	print(
+		f"{'gallery':>8} {'precision':>9} {'memory (MB)':>12} {'ms/frame':>9} "
+		f"{'speedup':>8} {'agree':>7}"
+	)
+	for size in sizes:
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			names = [f"user{i:06d}" for i in range(size)]
+			matrix_path = Path(tmp_dir, "gallery.dat")
+			gallery = np.memmap(matrix_path, dtype=np.float64, mode='w+', shape=(size, 128))
+			gallery[:] = rng.normal(0, 0.1, (size, 128))
+			gallery.flush()
+			# Half the faces are enrolled users, some of them close to the threshold
+			probes = rng.normal(0, 0.1, (frames, faces, 128))
+			enrolled = probes[:, ::2]
+			enrolled[:] = gallery[rng.integers(0, size, enrolled.shape[:2])]
+			enrolled += rng.normal(0, noise, enrolled.shape)
+
+			in_memory = np.array(gallery)
+			expected, baseline = _timed(lambda: [_float64_match(frame, names, in_memory) for frame in probes])
+			print(f"{size:>8} {'float64':>9} {in_memory.nbytes / 2**20:12.2f} {1000 * baseline / frames:9.3f} {1.0:8.1f} {1.0:7.2%}")
+
+			float32 = FaceMatcher(names, in_memory, capacity=1)
+			int8 = Int8Matcher(names, np.memmap(matrix_path, dtype=np.float64, mode='r', shape=(size, 128)), capacity=1)
+			del in_memory
+			for label, matcher, memory in (
+				('float32', float32, float32._matrix.nbytes + float32._norms.nbytes),
+				('int8', int8, sum(a.nbytes for a in (int8._matrix, int8._norms, int8._errors, int8._full_rows))),
+			):
+				found, elapsed = _timed(lambda: [matcher.match(frame) for frame in probes])
+				decisions = [(match.name for match in frame) for frame in found]
+				agree = np.mean([a == b for frame_a, frame_b in zip(decisions, expected) for a, b in zip(frame_a, frame_b)])
+				print(
+					f"{'':>8} {label:>9} {memory / 2**20:12.2f} {1000 * elapsed / frames:9.3f} "
+					f"{baseline / elapsed:8.1f} {agree:7.2%}"
+				)
+			int8.close()
+
+
+async def benchmark_cameras(camera_counts, source: str, schedule: str, workers: int, duration: float):
+	""" Frame rate and latency of every camera when one headless frontend drives 1 to N
+	copies of the same source, played back in real time. """
+	print(f"{'cameras':>8} {'camera':>8} {'fps':>8} {'p50 (ms)':>9} {'p95 (ms)':>9} {'dropped':>8}")
+	for count in camera_counts:
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			cwd = os.getcwd()
+			os.chdir(tmp_dir)  # Denial images and the encryption key files land in the working directory
+			try:
+				reader = WebcamReader(
+					source=[source] * count, pacing="realtime", headless=True, schedule=schedule,
+					recognition_workers=workers, reload_interval=0, clip_pre_seconds=0, clip_post_seconds=0
+				)
+				reader.user_storage = UserStorage(base_path=Path(tmp_dir))
+				reader.stats_interval = float('inf')
+				stop = asyncio.Event()
+				asyncio.get_running_loop().call_later(duration, stop.set)
+				await reader.read_webcam(stop)
+			finally:
+				os.chdir(cwd)
+
+		for camera in reader.cameras:
+			summary = camera.latency.summary()
+			print(
+				f"{count:>8} {camera.name:>8} {summary['fps']:8.1f} {summary.get('p50_ms', 0):9.1f} "
+				f"{summary.get('p95_ms', 0):9.1f} {camera.recognition_queue.dropped:>8}"
+			)
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Facial recognition benchmarks")
+	subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+	startup = subparsers.add_parser("startup", help="Known encoding load time at frontend startup")
+	startup.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+	startup.add_argument(
+		"--legacy-limit", type=int, default=10000,
+		help="Skip the quadratic per-user path above this many users"
+	)
+	startup.add_argument("--workers", type=int, default=os.cpu_count())
+	startup.set_defaults(
+		run=lambda args: asyncio.run(benchmark_startup(args.sizes, args.legacy_limit, args.workers))
+	)
+
+	enrollment = subparsers.add_parser("enrollment", help="Enrollment encoding time and memory per image")
+	enrollment.add_argument("--megapixels", type=float, nargs="+", default=[1, 4, 12, 24])
+	enrollment.add_argument("--image", help="Photo containing a face, scaled to each resolution")
+	enrollment.add_argument("--max-detect-size", type=int, default=DEFAULT_MAX_DETECT_SIZE)
+	enrollment.add_argument("--repeats", type=int, default=3)
+	enrollment.set_defaults(
+		run=lambda args: benchmark_enrollment(args.megapixels, args.image, args.max_detect_size, args.repeats)
+	)
+
+	fps = subparsers.add_parser("fps", help="Recognition FPS with 1 to N detection processes")
+	fps.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count()])
+	fps.add_argument(
+		"--source", "--video", help="Video, image directory, stream URL or 'synthetic' to take frames from instead of noise"
+	)
+	fps.add_argument("--duration", type=float, default=10.0, help="Seconds to run each worker count for")
+	fps.set_defaults(run=lambda args: benchmark_fps(args.workers, args.source, args.duration))
+
+	match = subparsers.add_parser("match", help="Time to match a frame's faces against the gallery")
+	match.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000, 100000])
+	match.add_argument("--faces", type=int, default=3, help="Faces per frame")
+	match.add_argument("--repeats", type=int, default=5)
+	match.set_defaults(run=lambda args: benchmark_match(args.sizes, args.faces, args.repeats))
+
+	ann = subparsers.add_parser("ann", help="IVF index recall and latency against exact search")
+	ann.add_argument("--size", type=int, default=100000, help="Users in the gallery")
+	ann.add_argument("--probes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32], help="Clusters searched per frame")
+	ann.add_argument("--faces", type=int, default=3, help="Faces per frame")
+	ann.add_argument("--frames", type=int, default=200)
+	ann.add_argument("--noise", type=float, default=0.03, help="Spread of a user's encodings between photos")
+	ann.set_defaults(run=lambda args: benchmark_ann(args.size, args.probes, args.faces, args.frames, args.noise))
+
+	precision = subparsers.add_parser("precision", help="float32 and int8 matching against float64")
+	precision.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+	precision.add_argument("--faces", type=int, default=3, help="Faces per frame")
+	precision.add_argument("--frames", type=int, default=50)
+	precision.add_argument("--noise", type=float, default=0.045, help="Spread of a user's encodings between photos")
+	precision.set_defaults(run=lambda args: benchmark_precision(args.sizes, args.faces, args.frames, args.noise))
+
+	cameras = subparsers.add_parser("cameras", help="Per camera FPS and latency with several sources in one process")
+	cameras.add_argument("--cameras", type=int, nargs="+", default=[1, 2, 4])
+	cameras.add_argument("--source", default="synthetic", help="Video, image directory or stream each camera plays")
+	cameras.add_argument("--schedule", choices=["round-robin", "motion"], default="round-robin")
+	cameras.add_argument("--workers", type=int, default=1, help="Face detection processes shared by every camera")
+	cameras.add_argument("--duration", type=float, default=10.0, help="Seconds to run each camera count for")
+	cameras.set_defaults(run=lambda args: asyncio.run(
+		benchmark_cameras(args.cameras, args.source, args.schedule, args.workers, args.duration)
+	))
+
+	args = parser.parse_args()
+	args.run(args)
+
+
+if __name__ == "__main__":
+	main()
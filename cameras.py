@@ -0,0 +1,86 @@
+import threading
+from time import monotonic
+
+from pipeline import DropOldestQueue, LatencyStats
+
+
+SCHEDULES = ("round-robin", "motion")
+
+
+class Camera:
+	""" One video source and everything the frontend keeps per source: its own tracks, motion
+	gate, recently denied faces and clip ring, the queues between its stages and its latency.
+	The gallery, the detection models and the denial writer are shared by every camera. """
+
+	def __init__(self, name: str, cap, tracker, motion_gate, unknown_faces, clip_recorder=None):
+		self.name = name
+		self.cap = cap
+		self.tracker = tracker
+		self.motion_gate = motion_gate
+		self.unknown_faces = unknown_faces
+		self.clip_recorder = clip_recorder
+		self.recognition_queue = DropOldestQueue(maxsize=1)
+		self.display_queue = DropOldestQueue(maxsize=1)
+		self.results_queue = DropOldestQueue(maxsize=1)
+		self.latency = LatencyStats()
+		self.capture_done = threading.Event()
+		self.last_faces = []
+		self.last_served = monotonic()
+
+	@property
+	def exhausted(self) -> bool:
+		""" The source ran out and recognition has taken its last frame. """
+		return self.capture_done.is_set() and not len(self.recognition_queue)
+
+
+class CameraScheduler:
+	""" Decides which camera the recognition stage serves next, among those with a frame
+	waiting.
+
+	"round-robin" takes turns. "motion" serves the camera whose last frame moved the most
+	first, so a busy door gets more of the detection time than a quiet one, but never leaves a
+	camera waiting more than `max_wait` seconds. Capture calls `notify` after every frame it
+	queues, so recognition sleeps while no camera has anything for it. """
+
+	def __init__(self, cameras: list, schedule: str="round-robin", max_wait: float=1.0):
+		if schedule not in SCHEDULES:
+			raise ValueError(f"Unknown schedule '{schedule}', expected one of {', '.join(SCHEDULES)}")
+		self.cameras = cameras
+		self.schedule = schedule
+		self.max_wait = max_wait
+		self.frame_ready = threading.Event()
+		self._next = 0
+
+	@property
+	def finished(self) -> bool:
+		return all(camera.exhausted for camera in self.cameras)
+
+	def notify(self) -> None:
+		self.frame_ready.set()
+
+	def next_camera(self, timeout: float=None):
+		""" Returns the camera to take a frame from next, or None if no camera had one within
+		`timeout` seconds. """
+		# Cleared before looking, so a frame queued meanwhile is either seen or wakes the wait
+		self.frame_ready.clear()
+		camera = self._pick()
+		if camera is None and self.frame_ready.wait(timeout):
+			camera = self._pick()
+		return camera
+
+	def _pick(self):
+		# Starting after the camera served last, so ties go round in turn
+		order = self.cameras[self._next:] + self.cameras[:self._next]
+		waiting = [camera for camera in order if len(camera.recognition_queue)]
+		if not waiting:
+			return None
+
+		now = monotonic()
+		camera = waiting[0]
+		if self.schedule == "motion":
+			starved = [camera for camera in waiting if now - camera.last_served > self.max_wait]
+			camera = starved[0] if starved else max(waiting, key=lambda camera: camera.motion_gate.motion)
+
+		camera.last_served = now
+		self._next = (self.cameras.index(camera) + 1) % len(self.cameras)
+		return camera
@@ -0,0 +1,162 @@
+import datetime
+import logging
+import queue
+import threading
+from pathlib import Path
+from time import sleep
+
+import cv2 as cv
+import numpy as np
+
+
+logger = logging.getLogger()
+
+
+class FrameRing:
+	""" A fixed number of downscaled frames, preallocated up front and overwritten oldest
+	first. Every slot remembers the sequence number and time of the frame in it, so a
+	reader can tell when a slot was overwritten while it was reading. """
+
+	def __init__(self, capacity: int, size: tuple=(320, 240)):
+		self.size = size
+		self.frames = np.zeros((capacity, size[1], size[0], 3), dtype=np.uint8)
+		self.times = np.full(capacity, -np.inf)
+		self.seqs = np.full(capacity, -1, dtype=np.int64)
+		self.seq = -1  # Sequence number of the newest frame
+
+	@property
+	def capacity(self) -> int:
+		return len(self.frames)
+
+	@property
+	def memory_bytes(self) -> int:
+		return self.frames.nbytes + self.times.nbytes + self.seqs.nbytes
+
+	@property
+	def latest_time(self) -> float:
+		return self.times[self.seq % self.capacity] if self.seq >= 0 else -np.inf
+
+	def push(self, image, captured_at: float) -> None:
+		seq = self.seq + 1
+		slot = seq % self.capacity
+		# Mark the slot as being rewritten before touching its pixels
+		self.seqs[slot] = -1
+		cv.resize(image, self.size, dst=self.frames[slot], interpolation=cv.INTER_AREA)
+		self.times[slot] = captured_at
+		self.seqs[slot] = seq
+		self.seq = seq
+
+	def slots_between(self, start: float, end: float) -> list:
+		""" (seq, slot) of the frames captured from `start` to `end`, oldest first. """
+		slots = np.flatnonzero((self.times >= start) & (self.times <= end) & (self.seqs >= 0))
+		return sorted((int(self.seqs[slot]), int(slot)) for slot in slots)
+
+
+class ClipRecorder:
+	""" Keeps the last few seconds of video in a FrameRing and, when triggered, writes a
+	clip from `pre_seconds` before the event to `post_seconds` after it. Frames are sampled
+	into the ring at most `fps` times a second, so memory use is fixed at construction:
+	see `memory_bytes`. The clip is encoded on a background thread straight out of the ring
+	once its last frame has been captured. The ring holds `slack_seconds` more than a clip
+	needs, giving the writer time to read it out before it is overwritten. A clip the writer
+	fell too far behind on is cut short and counted in `truncated`.
+
+	Triggers while a clip is still being recorded are folded into that clip. At most
+	`max_clips` clips are kept on disk, deleting the oldest first. """
+
+	def __init__(self, directory, pre_seconds: float=5.0, post_seconds: float=5.0, fps: float=10.0,
+			size: tuple=(320, 240), slack_seconds: float=2.0, max_clips: int=200):
+		self.directory = Path(directory)
+		self.pre_seconds = pre_seconds
+		self.post_seconds = post_seconds
+		self.fps = fps
+		self.max_clips = max_clips
+		capacity = int(np.ceil((pre_seconds + post_seconds + slack_seconds) * fps)) + 1
+		self.ring = FrameRing(capacity, size)
+		# The writer copies each frame out of the ring before encoding it, so capture can't
+		# overwrite the frame halfway through
+		self._frame = np.empty_like(self.ring.frames[0])
+		self.pending = queue.Queue()
+		self.last_sample = -np.inf
+		self.recording_until = -np.inf
+		self.written = 0
+		self.truncated = 0
+		self._thread = None
+		self._stopping = threading.Event()
+
+	@property
+	def memory_bytes(self) -> int:
+		return self.ring.memory_bytes + self._frame.nbytes
+
+	def start(self) -> None:
+		self.directory.mkdir(parents=True, exist_ok=True)
+		self._stopping.clear()
+		self._thread = threading.Thread(target=self._run, name="clip-writer", daemon=True)
+		self._thread.start()
+
+	def stop(self) -> None:
+		""" Writes any clip still pending with the frames captured so far, then stops. """
+		if self._thread is None:
+			return
+		self._stopping.set()
+		self.pending.put(None)
+		self._thread.join()
+		self._thread = None
+
+	def add_frame(self, image, captured_at: float) -> None:
+		""" Called for every captured frame, only the ones due at `fps` are kept. """
+		if captured_at - self.last_sample < 1.0 / self.fps:
+			return
+		self.last_sample = captured_at
+		self.ring.push(image, captured_at)
+
+	def trigger(self, event_time: float) -> None:
+		if event_time <= self.recording_until:
+			return
+		self.recording_until = event_time + self.post_seconds
+		self.pending.put((event_time - self.pre_seconds, self.recording_until))
+
+	def _run(self) -> None:
+		while True:
+			clip = self.pending.get()
+			if clip is None:
+				return
+			start, end = clip
+			# Wait for the last frame of the clip to be captured
+			while self.ring.latest_time < end and not self._stopping.is_set():
+				sleep(0.05)
+			try:
+				self._write(start, end)
+			except Exception as e:
+				logger.warning(f"Failed to save denial clip: {e}")
+
+	def _write(self, start: float, end: float) -> None:
+		slots = self.ring.slots_between(start, end)
+		if not slots:
+			return
+		timestamp = datetime.datetime.fromtimestamp(start + self.pre_seconds).strftime("%Y%m%d_%H%M%S_%f")[:-3]
+		path = self.directory.joinpath(f"{timestamp}.mp4")
+		writer = cv.VideoWriter(str(path), cv.VideoWriter_fourcc(*"mp4v"), self.fps, self.ring.size)
+		try:
+			for seq, slot in slots:
+				# Capture marks a slot before rewriting it, so an unchanged seq on both sides
+				# of the copy means the copy is the whole of that frame
+				if self.ring.seqs[slot] == seq:
+					np.copyto(self._frame, self.ring.frames[slot])
+				if self.ring.seqs[slot] != seq:
+					# Overwritten before the writer got to it, so this frame and the rest are gone
+					self.truncated += 1
+					break
+				writer.write(self._frame)
+		finally:
+			writer.release()
+		self.written += 1
+		self._evict()
+
+	def _evict(self) -> None:
+		clips = sorted(self.directory.glob("*.mp4"))
+		for path in clips[:max(0, len(clips) - self.max_clips)]:
+			path.unlink(missing_ok=True)
+
+	def stats(self) -> dict:
+		return {'written': self.written, 'truncated': self.truncated, 'memory_mb': self.memory_bytes / 2**20}
@@ -0,0 +1,96 @@
+import numpy as np
+
+from storage import ENCODING_SIZE
+
+
+class UnknownFaceCache:
+	""" Remembers the encodings of unknown faces seen in the last `ttl` seconds, so a denial
+	is only captured once per person rather than once per time interval for the whole camera.
+	An encoding within `threshold` of a remembered one is the same person, and seeing them
+	again pushes their expiry back, so someone standing at the door is captured once while a
+	second person arriving straight after is captured too.
+
+	Memory is fixed at construction: `capacity` encodings in a preallocated matrix, and a
+	timing wheel of `buckets` slots covering `ttl` that says which entries expire when.
+	Inserting, refreshing and expiring an entry are all O(1); expiry only ever clears the
+	buckets whose time has passed. When every entry is in use, the ones closest to expiring
+	are dropped to make room. """
+
+	def __init__(self, ttl: float=15.0, threshold: float=0.6, capacity: int=64, buckets: int=64):
+		self.ttl = ttl
+		self.threshold = threshold
+		self.tick = ttl / buckets
+		self.encodings = np.zeros((capacity, ENCODING_SIZE), dtype=np.float32)
+		self.active = np.zeros(capacity, dtype=bool)
+		self.bucket_of = np.full(capacity, -1, dtype=np.int64)  # Wheel slot each entry expires in
+		self.wheel = [set() for _ in range(buckets + 1)]
+		self.free = list(range(capacity - 1, -1, -1))
+		self.current_tick = None
+		self.hits = 0
+		self.misses = 0
+
+	def __len__(self) -> int:
+		return len(self.active) - len(self.free)
+
+	def _advance(self, now: float) -> None:
+		""" Expires every entry whose bucket has come round since the last call. """
+		tick = int(now // self.tick)
+		if self.current_tick is None:
+			self.current_tick = tick
+			return
+		steps = min(tick - self.current_tick, len(self.wheel))
+		for step in range(1, steps + 1):
+			self._clear_bucket((self.current_tick + step) % len(self.wheel))
+		self.current_tick = max(self.current_tick, tick)
+
+	def _clear_bucket(self, bucket: int) -> None:
+		for entry in self.wheel[bucket]:
+			self.active[entry] = False
+			self.bucket_of[entry] = -1
+			self.free.append(entry)
+		self.wheel[bucket].clear()
+
+	def _schedule(self, entry: int) -> None:
+		""" (Re)files an entry to expire `ttl` from the current tick. """
+		if self.bucket_of[entry] >= 0:
+			self.wheel[self.bucket_of[entry]].discard(entry)
+		# The wheel has one more bucket than ttl spans, so the one being filed into is never
+		# the one that expires next
+		bucket = (self.current_tick + len(self.wheel) - 1) % len(self.wheel)
+		self.wheel[bucket].add(entry)
+		self.bucket_of[entry] = bucket
+
+	def _evict_soonest(self) -> None:
+		for step in range(1, len(self.wheel) + 1):
+			bucket = (self.current_tick + step) % len(self.wheel)
+			if self.wheel[bucket]:
+				self._clear_bucket(bucket)
+				return
+
+	def seen(self, encoding, now: float) -> bool:
+		""" Returns True when this unknown face was already seen within `ttl` seconds, and
+		remembers it either way. """
+		self._advance(now)
+		encoding = np.asarray(encoding, dtype=np.float32)
+		if self.active.any():
+			differences = self.encodings - encoding
+			distances = np.einsum('ij,ij->i', differences, differences)
+			distances[~self.active] = np.inf
+			nearest = int(np.argmin(distances))
+			if distances[nearest] <= self.threshold ** 2:
+				self._schedule(nearest)
+				self.hits += 1
+				return True
+
+		if not self.free:
+			self._evict_soonest()
+		entry = self.free.pop()
+		self.encodings[entry] = encoding
+		self.active[entry] = True
+		self._schedule(entry)
+		self.misses += 1
+		return False
+
+	def clear(self) -> None:
+		for bucket in range(len(self.wheel)):
+			self._clear_bucket(bucket)
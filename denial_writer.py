@@ -0,0 +1,133 @@
+import datetime
+import logging
+import os
+import queue
+import threading
+from collections import deque
+from pathlib import Path
+
+import cv2 as cv
+
+
+logger = logging.getLogger()
+
+QUALITY_FLAGS = {
+	'jpg': cv.IMWRITE_JPEG_QUALITY,
+	'webp': cv.IMWRITE_WEBP_QUALITY,
+}
+
+
+class DenialWriter:
+	""" Saves denial captures on a background thread, so encoding and writing an image never
+	holds up recognition. Captures wait in a queue of `queue_size`; when it is full, the
+	new capture is dropped and counted rather than making the caller wait.
+
+	Images are saved as JPEG or WebP at `quality`, either whole or, with `crop_faces`, only
+	the face with `crop_margin` of its size around it. The directory is kept within
+	`max_bytes` and `max_files` by deleting the oldest captures first, including any that
+	were already there at startup. """
+
+	def __init__(self, directory, image_format: str="jpg", quality: int=90, crop_faces: bool=False,
+			crop_margin: float=0.5, max_bytes: int=500 * 2**20, max_files: int=10000, queue_size: int=16):
+		if image_format not in QUALITY_FLAGS:
+			raise ValueError(f"Unsupported denial image format '{image_format}'")
+		self.directory = Path(directory)
+		self.image_format = image_format
+		self.quality = quality
+		self.crop_faces = crop_faces
+		self.crop_margin = crop_margin
+		self.max_bytes = max_bytes
+		self.max_files = max_files
+		self.pending = queue.Queue(maxsize=queue_size)
+		self.written = 0
+		self.dropped = 0
+		self.evicted = 0
+		self._files = deque()  # (path, size) of every capture on disk, oldest first
+		self._total_bytes = 0
+		self._thread = None
+
+	def start(self) -> None:
+		self.directory.mkdir(parents=True, exist_ok=True)
+		existing = sorted(
+			(entry.stat().st_mtime_ns, Path(entry.path), entry.stat().st_size)
+			for entry in os.scandir(self.directory) if entry.is_file()
+		)
+		self._files = deque((path, size) for _, path, size in existing)
+		self._total_bytes = sum(size for _, size in self._files)
+		self._enforce_budget()
+
+		self._thread = threading.Thread(target=self._run, name="denial-writer", daemon=True)
+		self._thread.start()
+
+	def stop(self) -> None:
+		""" Writes whatever is still queued, then stops the thread. """
+		if self._thread is None:
+			return
+		self.pending.put(None)
+		self._thread.join()
+		self._thread = None
+
+	def submit(self, image, captured_at: float, box=None, label: str=None) -> bool:
+		""" Queues a capture of `image`, a frame nothing will draw on or modify afterwards.
+		`box` is the (top, right, bottom, left) of the face, used when cropping, and `label`
+		is added to the file name, to tell cameras apart. Returns False when the capture was
+		dropped. """
+		try:
+			self.pending.put_nowait((image, captured_at, box, label))
+			return True
+		except queue.Full:
+			self.dropped += 1
+			return False
+
+	def stats(self) -> dict:
+		return {
+			'written': self.written, 'dropped': self.dropped, 'evicted': self.evicted,
+			'files': len(self._files), 'bytes': self._total_bytes
+		}
+
+	def _run(self) -> None:
+		while True:
+			item = self.pending.get()
+			if item is None:
+				return
+			try:
+				self._write(*item)
+			except Exception as e:
+				logger.warning(f"Failed to save denial image: {e}")
+
+	def _crop(self, image, box):
+		top, right, bottom, left = box
+		margin_y = int((bottom - top) * self.crop_margin)
+		margin_x = int((right - left) * self.crop_margin)
+		return image[
+			max(0, top - margin_y):min(image.shape[0], bottom + margin_y),
+			max(0, left - margin_x):min(image.shape[1], right + margin_x)
+		]
+
+	def _write(self, image, captured_at: float, box, label: str) -> None:
+		if self.crop_faces and box is not None:
+			image = self._crop(image, box)
+		ok, encoded = cv.imencode(f".{self.image_format}", image, [QUALITY_FLAGS[self.image_format], self.quality])
+		if not ok:
+			raise ValueError(f"Could not encode the image as {self.image_format}")
+
+		# Milliseconds and a counter keep captures within the same second apart
+		timestamp = datetime.datetime.fromtimestamp(captured_at).strftime("%Y%m%d_%H%M%S_%f")[:-3]
+		label = f"_{label}" if label else ""
+		path = self.directory.joinpath(f"{timestamp}{label}_{self.written:06d}.{self.image_format}")
+		path.write_bytes(encoded.tobytes())
+
+		self.written += 1
+		self._files.append((path, len(encoded)))
+		self._total_bytes += len(encoded)
+		self._enforce_budget()
+
+	def _enforce_budget(self) -> None:
+		while self._files and (self._total_bytes > self.max_bytes or len(self._files) > self.max_files):
+			path, size = self._files.popleft()
+			try:
+				path.unlink()
+			except FileNotFoundError:
+				pass
+			self._total_bytes -= size
+			self.evicted += 1
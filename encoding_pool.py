@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2 as cv
+import numpy as np
+
+logger = logging.getLogger()
+
+# Longest side, in pixels, of the copy of an enrollment image that face detection runs on
+DEFAULT_MAX_DETECT_SIZE = 800
+# dlib aligns faces to a 150px chip, so a face much bigger than this in the crop handed to
+# the encoder only costs time
+ENCODING_FACE_SIZE = 300
+# Extra room kept around the detected box when cropping, as a fraction of its size, so the
+# landmark predictor sees the whole face
+CROP_MARGIN = 0.5
+
+
+class EncodingQueueFull(Exception):
+	""" Raised when the pool already has as many enrollment images waiting as it allows. """
+
+
+def _warm_up_worker():
+	""" Runs once in every new worker. Importing face_recognition loads the dlib models, and
+	a throwaway detection on a blank image gets the rest of the lazy setup out of the way
+	before a real upload arrives. """
+	import face_recognition
+	blank = np.zeros((64, 64, 3), dtype=np.uint8)
+	face_recognition.face_encodings(blank)
+
+
+def _ping():
+	return os.getpid()
+
+
+def encode_image(user_image: np.ndarray, max_detect_size: int=DEFAULT_MAX_DETECT_SIZE):
+	""" Returns the encoding of the first face in an RGB image, or None when there isn't one.
+
+	Detection runs on a copy no larger than `max_detect_size` on its longest side. The box
+	found is mapped back to the full image, and only a crop around it, scaled so the face is
+	about ENCODING_FACE_SIZE pixels, is passed to the encoder. """
+	import face_recognition
+
+	height, width = user_image.shape[:2]
+	scale = 1.0
+	detect_image = user_image
+	if max_detect_size and max(height, width) > max_detect_size:
+		scale = max_detect_size / max(height, width)
+		detect_image = cv.resize(user_image, (0, 0), fx=scale, fy=scale, interpolation=cv.INTER_AREA)
+
+	face_locations = face_recognition.face_locations(detect_image)
+	if not face_locations:
+		return None
+
+	# Map the first face back to full resolution and crop around it
+	top, right, bottom, left = (int(round(v / scale)) for v in face_locations[0])
+	margin = int(CROP_MARGIN * max(bottom - top, right - left))
+	crop_top, crop_left = max(top - margin, 0), max(left - margin, 0)
+	crop_bottom, crop_right = min(bottom + margin, height), min(right + margin, width)
+	crop = user_image[crop_top:crop_bottom, crop_left:crop_right]
+	box = (top - crop_top, right - crop_left, bottom - crop_top, left - crop_left)
+
+	face_size = max(bottom - top, right - left)
+	if face_size > ENCODING_FACE_SIZE:
+		crop_scale = ENCODING_FACE_SIZE / face_size
+		crop = cv.resize(crop, (0, 0), fx=crop_scale, fy=crop_scale, interpolation=cv.INTER_AREA)
+		box = tuple(int(round(v * crop_scale)) for v in box)
+
+	user_image_encoding = face_recognition.face_encodings(crop, known_face_locations=[box])
+	return user_image_encoding[0] if user_image_encoding else None
+
+
+def encode_image_file(img_path: str, max_detect_size: int=DEFAULT_MAX_DETECT_SIZE):
+	""" Returns the encoding of the first face in the image file, or None when there isn't one. """
+	import face_recognition
+	user_image = face_recognition.load_image_file(img_path)
+	return encode_image(user_image, max_detect_size)
+
+
+class EncodingPool:
+	""" A persistent pool of worker processes with the dlib models already loaded, used to
+	encode enrollment images without tying up the backend's event loop or the GIL.
+
+	At most `max_queue_depth` images may be queued or in progress at a time, beyond which
+	`encode` raises EncodingQueueFull so the caller can push back. Each worker is replaced
+	after `max_tasks_per_child` images to bound any memory growth inside dlib. """
+
+	def __init__(self, max_workers: int=None, max_queue_depth: int=32, max_tasks_per_child: int=100,
+			max_detect_size: int=DEFAULT_MAX_DETECT_SIZE):
+		self.max_workers = max_workers or os.cpu_count()
+		self.max_detect_size = max_detect_size
+		self.max_queue_depth = max_queue_depth
+		self.max_tasks_per_child = max_tasks_per_child
+		self.pending = 0
+		self._executor = None
+
+	def start(self) -> None:
+		# Recycling workers is not supported with the 'fork' start method
+		self._executor = ProcessPoolExecutor(
+			max_workers=self.max_workers,
+			mp_context=multiprocessing.get_context('spawn'),
+			initializer=_warm_up_worker,
+			max_tasks_per_child=self.max_tasks_per_child,
+		)
+		# Workers are spawned lazily, so start them all now rather than on the first uploads
+		for _ in range(self.max_workers):
+			self._executor.submit(_ping)
+		logger.info(f"Started {self.max_workers} face encoding workers")
+
+	def shutdown(self) -> None:
+		if self._executor is not None:
+			self._executor.shutdown(wait=True, cancel_futures=True)
+			self._executor = None
+
+	async def encode(self, img_path) -> np.ndarray:
+		if self._executor is None:
+			raise RuntimeError("EncodingPool.start() has not been called")
+		if self.pending >= self.max_queue_depth:
+			raise EncodingQueueFull(
+				f"{self.pending} enrollment images are already waiting to be encoded"
+			)
+
+		self.pending += 1
+		try:
+			loop = asyncio.get_running_loop()
+			return await loop.run_in_executor(
+				self._executor, encode_image_file, str(img_path), self.max_detect_size
+			)
+		finally:
+			self.pending -= 1
@@ -0,0 +1,269 @@
+import asyncio
+import functools
+import logging
+import uuid
+import zipfile
+from collections import OrderedDict
+from io import BytesIO
+from pathlib import Path, PurePosixPath
+from time import time, perf_counter
+from typing import BinaryIO
+
+from werkzeug.utils import secure_filename
+
+from encoding_pool import EncodingQueueFull
+from storage import UserStorage
+
+logger = logging.getLogger()
+
+
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png')
+
+
+class EnrollmentQueueFull(Exception):
+	""" Raised when the enrollment queue can't take any more jobs. """
+
+
+def _username(name: PurePosixPath):
+	""" The username an image file is enrolled as, or None when its name doesn't make one.
+	The username names the user's folder, so it must not be able to point anywhere else. """
+	username = secure_filename(name.stem)
+	return username if username.strip('.') else None
+
+
+def iter_enrollment_images(source):
+	""" Yields a (name, read) pair for every `<username>.jpg` image in a directory or zip
+	archive. Nothing is read until `read()` is called, so a large archive is never held in
+	memory all at once. `name` is the username, made safe to use as a folder name, except
+	for an image whose name makes no username, for which it is the file name and `read` is
+	None. """
+	source = Path(source)
+	if source.is_dir():
+		for path in sorted(source.iterdir()):
+			if path.is_file() and path.suffix.lower() in IMAGE_SUFFIXES:
+				username = _username(PurePosixPath(path.name))
+				yield (username, path.read_bytes) if username else (path.name, None)
+
+	elif zipfile.is_zipfile(source):
+		with zipfile.ZipFile(source) as archive:
+			for info in archive.infolist():
+				name = PurePosixPath(info.filename)
+				if info.is_dir() or name.suffix.lower() not in IMAGE_SUFFIXES:
+					continue
+				username = _username(name)
+				yield (username, functools.partial(archive.read, info)) if username else (name.name, None)
+
+	else:
+		raise ValueError(f"'{source}' is neither a directory nor a zip archive")
+
+
+async def bulk_enroll(source, user_storage: UserStorage, max_in_flight: int=None,
+		queue_full_delay: float=0.1) -> dict:
+	""" Enrolls every image in a directory or zip archive. Images are encoded in parallel,
+	with at most `max_in_flight` read into memory at a time, and the results are committed
+	with one journal append and one gallery write at the end.
+
+	By default only half of the encoding pool's queue is used, so single uploads still get
+	in while a bulk enrollment runs. When the pool is full anyway, images wait for room
+	rather than fail. An image that can't be read is recorded as a failure for its user.
+
+	Returns a summary with the number of users enrolled, the failures by username, the
+	images skipped because their name makes no username and the overall throughput. """
+	if not max_in_flight:
+		pool = user_storage.encoding_pool
+		max_in_flight = max(1, pool.max_queue_depth // 2) if pool else 2 * UserStorage.max_concurrent_encodings
+
+	start = perf_counter()
+	slots = asyncio.Semaphore(max_in_flight)
+	records, names, encodings, failures = {}, [], [], {}
+
+	async def _enroll_one(username, image):
+		try:
+			img_path = await user_storage.save_user_image(username, BytesIO(image))
+			while True:
+				try:
+					encoding = await user_storage.encode_image(img_path)
+					break
+				except EncodingQueueFull:
+					await asyncio.sleep(queue_full_delay)
+			if encoding is None:
+				records[username] = {'img_path': str(img_path), 'encoding_path': None}
+				failures[username] = "No face found"
+				return
+			encoding_path = await user_storage.save_user_encoding(username, encoding)
+			records[username] = {'img_path': str(img_path), 'encoding_path': encoding_path}
+			names.append(username)
+			encodings.append(encoding)
+		except Exception as e:
+			logger.exception(f"Bulk enrollment of '{username}' failed")
+			failures[username] = str(e)
+		finally:
+			slots.release()
+
+	tasks, images, skipped = [], 0, {}
+	for username, read in iter_enrollment_images(source):
+		if read is None:
+			skipped[username] = "Not a valid username"
+			continue
+		await slots.acquire()
+		images += 1
+		try:
+			image = await user_storage.run_blocking(read)
+		except Exception as e:
+			# A corrupt archive member only costs that one user
+			logger.warning(f"Could not read the image for '{username}': {e}")
+			failures[username] = str(e)
+			slots.release()
+			continue
+		tasks.append(asyncio.create_task(_enroll_one(username, image)))
+	await asyncio.gather(*tasks)
+
+	# Commit everything in one go rather than once per user
+	if names:
+		await user_storage.gallery.extend(names, encodings)
+	no_face = [username for username, record in records.items() if record['encoding_path'] is None]
+	if no_face:
+		await user_storage.gallery.remove_many(no_face)
+	if records:
+		await user_storage.set_items(records)
+
+	elapsed = perf_counter() - start
+	return {
+		'images': images,
+		'enrolled': len(names),
+		'failed': failures,
+		'skipped': skipped,
+		'seconds': elapsed,
+		'images_per_second': images / elapsed if elapsed else 0.0,
+	}
+
+
+class EnrollmentJobs:
+	""" Runs enrollments in the background so an upload request only has to save the image
+	and hand back a job id. Only the saved image's path is queued, never the upload itself. A
+	fixed number of worker tasks take jobs off a bounded queue and run
+	`UserStorage.enroll_image` for them, and each job's status can be looked up by its id.
+
+	A job moves through 'queued' -> 'encoding' -> 'done', or ends as 'no-face' when no face
+	was found in the image, or 'failed' if enrollment raised. A job the encoding pool has no
+	room for yet waits `queue_full_delay` seconds and tries again, as it has already been
+	accepted. Only the last `max_history` jobs are remembered. """
+
+	QUEUED = 'queued'
+	ENCODING = 'encoding'
+	DONE = 'done'
+	NO_FACE = 'no-face'
+	FAILED = 'failed'
+
+	def __init__(self, user_storage: UserStorage, workers: int=2, max_queue_size: int=256, max_history: int=10000,
+			queue_full_delay: float=0.1):
+		self.user_storage = user_storage
+		self.workers = workers
+		self.max_history = max_history
+		self.queue_full_delay = queue_full_delay
+		self.jobs = OrderedDict()
+		self._queue = asyncio.Queue(maxsize=max_queue_size)
+		self._tasks = []
+		self._bulk_tasks = set()
+
+	def start(self) -> None:
+		self._tasks = [
+			asyncio.create_task(self._worker(self.user_storage))
+			for _ in range(self.workers)
+		]
+
+	async def stop(self) -> None:
+		tasks = self._tasks + list(self._bulk_tasks)
+		for task in tasks:
+			task.cancel()
+		await asyncio.gather(*tasks, return_exceptions=True)
+		self._tasks = []
+		self._bulk_tasks.clear()
+
+	async def submit(self, username: str, image: BinaryIO) -> str:
+		""" Saves the user's image, queues its enrollment and returns the job id. """
+		if self._queue.full():
+			raise EnrollmentQueueFull(f"{self._queue.qsize()} enrollments are already queued")
+		img_path = await self.user_storage.save_user_image(username, image)
+
+		job_id = uuid.uuid4().hex
+		try:
+			self._queue.put_nowait((job_id, username, img_path))
+		except asyncio.QueueFull:
+			raise EnrollmentQueueFull(f"{self._queue.qsize()} enrollments are already queued")
+
+		self._add_job(job_id, username=username)
+		return job_id
+
+	def submit_bulk(self, archive_path: Path, filename: str=None, remove_when_done: bool=True) -> str:
+		""" Starts a bulk enrollment of a saved zip archive and returns its job id. The job's
+		summary is filled in once every image has been processed. """
+		job_id = uuid.uuid4().hex
+		self._add_job(job_id, archive=filename or Path(archive_path).name, summary=None)
+		task = asyncio.create_task(self._run_bulk(job_id, Path(archive_path), remove_when_done))
+		self._bulk_tasks.add(task)
+		task.add_done_callback(self._bulk_tasks.discard)
+		return job_id
+
+	def _add_job(self, job_id: str, **details) -> None:
+		self.jobs[job_id] = {
+			'job_id': job_id,
+			'status': self.QUEUED,
+			'error': None,
+			'submitted': time(),
+			'finished': None,
+			**details,
+		}
+		# Forget the oldest jobs once there are too many to keep track of
+		while len(self.jobs) > self.max_history:
+			self.jobs.popitem(last=False)
+
+	def get(self, job_id: str) -> dict:
+		return self.jobs.get(job_id)
+
+	def _set_status(self, job_id: str, status: str, error: str=None) -> None:
+		job = self.jobs.get(job_id)
+		if job is None:
+			return
+		job['status'] = status
+		job['error'] = error
+		if status not in (self.QUEUED, self.ENCODING):
+			job['finished'] = time()
+
+	async def _worker(self, user_storage: UserStorage) -> None:
+		while True:
+			job_id, username, img_path = await self._queue.get()
+			try:
+				self._set_status(job_id, self.ENCODING)
+				while True:
+					try:
+						face_found = await user_storage.enroll_image(username, img_path)
+						break
+					except EncodingQueueFull:
+						# Single uploads or a bulk enrollment have the pool busy for now
+						await asyncio.sleep(self.queue_full_delay)
+				self._set_status(job_id, self.DONE if face_found else self.NO_FACE)
+			except asyncio.CancelledError:
+				raise
+			except Exception as e:
+				logger.exception(f"Enrollment of '{username}' failed")
+				self._set_status(job_id, self.FAILED, str(e))
+			finally:
+				self._queue.task_done()
+
+	async def _run_bulk(self, job_id: str, archive_path: Path, remove_when_done: bool) -> None:
+		try:
+			self._set_status(job_id, self.ENCODING)
+			summary = await bulk_enroll(archive_path, self.user_storage)
+			summary['failed'] = {username: str(error) for username, error in summary['failed'].items()}
+			if job_id in self.jobs:
+				self.jobs[job_id]['summary'] = summary
+			self._set_status(job_id, self.DONE)
+		except asyncio.CancelledError:
+			raise
+		except Exception as e:
+			logger.exception(f"Bulk enrollment from '{archive_path.name}' failed")
+			self._set_status(job_id, self.FAILED, str(e))
+		finally:
+			if remove_when_done:
+				archive_path.unlink(missing_ok=True)
@@ -1,137 +1,617 @@
+import asyncio
 import logging
+import queue
+import threading
+from collections import deque
+from concurrent import futures
 from storage import UserStorage
+from pipeline import Frame, RecognitionPool, detect_faces
+from tracking import FaceTracker
+from motion import MotionGate
+from matching import FaceMatcher, Int8Matcher, IVFIndex, PCAIndex
+from shared_gallery import SharedGallery
+from denial_writer import DenialWriter
+from clip_recorder import ClipRecorder
+from denial_dedup import UnknownFaceCache
+from video_sources import open_source
+from cameras import Camera, CameraScheduler
 import cv2 as cv
-import numpy as np
-import face_recognition
 import os
-import datetime
-from time import time, sleep
+from pathlib import Path
+from time import time, sleep, monotonic
 
 
 logger = logging.getLogger()
 
 class WebcamReader:
 
-	def __init__(self, threshold=0.6, reset_interval=300, denial_interval=15):
-		self.cap = cv.VideoCapture(0)
+	def __init__(self, threshold=0.6, denial_interval=15, recognition_workers=1,
+			track_refresh_interval=2.0, motion_sensitivity=0.01, motion_force_interval=2.0,
+			matcher_index="exact", reload_interval=1.0, shared_gallery=False, precision="float32",
+			denial_format="jpg", denial_quality=90, denial_crop=False, denial_max_bytes=500 * 2**20,
+			denial_max_files=10000, clip_pre_seconds=5.0, clip_post_seconds=5.0, clip_fps=10.0,
+			clip_size=(320, 240), source=0, pacing=None, headless=False, schedule="round-robin"):
 		self.threshold = threshold
-		self.reset_interval = reset_interval  # Reset every 5 minutes
-		self.denial_interval = denial_interval # Only captures one denied image within this interval
+		self.denial_interval = denial_interval # Only captures one denied image of a face within this interval
 		self.access_denied_images_path = "denied_access_images"
-		self.denial_record = {}
-		self.last_reset_time = time()
 		self.user_storage = UserStorage()
-		self.frame_skip = 2
+		self.decrypt_workers = os.cpu_count()
+		self.stats_interval = 30  # Seconds between latency reports in the log
+		# Detection and encoding run on this many worker processes when above 1
+		self.recognition_workers = recognition_workers
+		# Faces are tracked between frames and only re-encoded when new, uncertain, or
+		# not encoded for track_refresh_interval seconds
+		self.track_refresh_interval = track_refresh_interval
+		# Detection is skipped on frames where nothing moved, and the last results are
+		# reused instead. A sensitivity of 0 lets every frame through
+		self.motion_sensitivity = motion_sensitivity
+		self.motion_force_interval = motion_force_interval
+		# Once the gallery is large, "ivf" narrows matching down to its nearest clusters and
+		# "pca" skips users a cheap lower bound rules out
+		self.matcher_index = matcher_index
+		# "int8" scans a quarter size copy of the gallery and re-ranks close matches from the
+		# memory-mapped gallery, instead of holding it all at float32. It always scans in full
+		self.precision = precision
+		self.matcher = FaceMatcher(threshold=threshold)
+		# Seconds between checks for users enrolled or removed through the backend, 0 to
+		# only load the gallery at startup. Changes reach the recognition stage through
+		# gallery_updates and are applied between frames
+		self.reload_interval = reload_interval
+		self.gallery_index = None
+		self.gallery_updates = queue.SimpleQueue()
+		# Set by the recognition stage when the matcher's index has drifted too far from the
+		# gallery, so the gallery stage builds and trains a new one off the recognition thread
+		self.retrain_requested = threading.Event()
+		# With a shared gallery, the decrypted encodings are published once per host and
+		# every frontend process matches against that same copy
+		self.shared_gallery = SharedGallery() if shared_gallery else None
+
+		self.stop_event = threading.Event()
+		# Without a window, 'q' can't be pressed, so a headless frontend runs until it is
+		# stopped or every source runs out
+		self.headless = headless
 
-		if not self.cap.isOpened():
-			print("Failed to open camera.")
 		if not os.path.exists(self.access_denied_images_path):
 			os.makedirs(self.access_denied_images_path)
+		# Denial images are encoded and saved off the recognition thread, and the oldest
+		# are deleted to keep the directory within budget
+		self.denial_writer = DenialWriter(
+			self.access_denied_images_path, image_format=denial_format, quality=denial_quality,
+			crop_faces=denial_crop, max_bytes=denial_max_bytes, max_files=denial_max_files
+		)
+		# Recent frames are kept downscaled in a fixed size ring, so a denial can be saved as a
+		# clip from clip_pre_seconds before it to clip_post_seconds after. 0 for both disables clips
+		self.access_denied_clips_path = "denied_access_clips"
+		self.clip_options = dict(pre_seconds=clip_pre_seconds, post_seconds=clip_post_seconds, fps=clip_fps, size=clip_size)
 
+		# One camera per source: a camera index, video file, image directory, stream URL or
+		# "synthetic", see open_source. Recorded footage paced "fast" is processed frame by
+		# frame as fast as recognition keeps up, and stops once it runs out. Every camera
+		# shares the gallery and the detection models, and the scheduler shares out
+		# recognition between them, either in turn or to the ones with the most motion
+		sources = list(source) if isinstance(source, (list, tuple)) else [source]
+		self.cameras = [
+			self.open_camera(f"camera{number}", spec, pacing, multiple=len(sources) > 1)
+			for number, spec in enumerate(sources)
+		]
+		self.scheduler = CameraScheduler(self.cameras, schedule=schedule)
+		clip_memory = sum(camera.clip_recorder.memory_bytes for camera in self.cameras if camera.clip_recorder)
+		if clip_memory:
+			logger.info(f"Denial clips buffer {clip_memory / 2**20:.1f} MB of recent frames")
+
+	def open_camera(self, name, source, pacing, multiple=False) -> Camera:
+		"""
+		Opens a source along with the tracker, motion gate, recent unknown faces and clip ring
+		kept for it. With several cameras, each saves its clips in its own directory.
+		"""
+		cap = open_source(source, pacing)
+		if not cap.isOpened():
+			print(f"Failed to open camera {name}." if multiple else "Failed to open camera.")
+		clip_recorder = None
+		if self.clip_options['pre_seconds'] or self.clip_options['post_seconds']:
+			clips_path = Path(self.access_denied_clips_path)
+			clip_recorder = ClipRecorder(clips_path.joinpath(name) if multiple else clips_path, **self.clip_options)
+		return Camera(
+			name, cap,
+			FaceTracker(threshold=self.threshold, refresh_interval=self.track_refresh_interval),
+			MotionGate(sensitivity=self.motion_sensitivity, force_interval=self.motion_force_interval),
+			# Unknown faces seen recently, so each person is captured once however long they stay
+			UnknownFaceCache(ttl=self.denial_interval, threshold=self.threshold),
+			clip_recorder
+		)
 
 	async def get_known_encodings(self):
 		"""
 		Retrieves and returns known face encodings and their corresponding user names from the storage.
-		This method queries the user storage for all registered users and fetches their face encodings.
+		Encodings are read from the memory-mapped gallery in one go. Users enrolled before the gallery
+		existed are decrypted in one batch and appended to it, so this only happens once.
 		"""
 		user_list = await self.user_storage.list_users()
-		known_face_encodings = []
-		known_face_names = []
+		gallery_index = await self.user_storage.gallery.read_index()
+		# Users enrolled from an image without a face have no encoding to backfill
+		missing_users = [
+			username for username, _, encoding_path in user_list
+			if encoding_path and username not in gallery_index['rows']
+		]
 
-		for username, _, _ in user_list:
-			face_encoding = await self.user_storage.get_user_encoding(username)
-			if face_encoding is not None:
-				known_face_names.append(username) 
-				known_face_encodings.append(face_encoding) 
-			else:
-				logger.warning(f"Failed to retrieve or decode face encoding for {username}")
+		if missing_users:
+			names, encodings, failures = await self.user_storage.get_all_encodings(
+				missing_users, max_workers=self.decrypt_workers
+			)
+			if names:
+				await self.user_storage.gallery.extend(names, encodings, replace=False)
+			for username, error in failures.items():
+				logger.warning(f"Failed to retrieve or decode face encoding for {username}: {error}")
 
-		return known_face_names, known_face_encodings  # Return the collected names and encodings
+		# Taken before loading, so a change that lands in between is applied again rather than missed
+		self.gallery_index = await self.user_storage.gallery.read_index()
+		return await self.user_storage.gallery.load()  # Return the collected names and encodings
 
-	async def read_webcam(self):
+	async def build_matcher(self, known_face_names, known_face_encodings, shared_view=None) -> FaceMatcher:
 		"""
-		Continuously reads frames from the webcam, detects faces, checks for known faces,
-		and handles access accordingly. It resets denial records based on a predefined interval.
+		Builds the matcher for the known faces, or over a shared gallery without copying it.
+		The PCA projection is saved with the gallery whenever it had to be fitted, so later
+		startups only have to project the encodings.
+		"""
+		if self.precision == "int8":
+			if shared_view is not None:
+				return Int8Matcher(shared_view.names, shared_view.matrix, threshold=self.threshold, source=shared_view)
+			return Int8Matcher(known_face_names, known_face_encodings, threshold=self.threshold)
+
+		index, saved_components = None, None
+		if self.matcher_index == "ivf":
+			index = IVFIndex()
+		elif self.matcher_index == "pca":
+			index = PCAIndex()
+			projection = await self.user_storage.gallery.read_projection()
+			if projection is not None:
+				index.load_projection(projection)
+				saved_components = index.components
+
+		if shared_view is not None:
+			matcher = FaceMatcher.wrap(
+				shared_view.names, shared_view.matrix, shared_view.norms, source=shared_view,
+				threshold=self.threshold, index=index
+			)
+		else:
+			matcher = FaceMatcher(known_face_names, known_face_encodings, threshold=self.threshold, index=index)
+		if isinstance(index, PCAIndex) and index.components is not saved_components:
+			await self.user_storage.gallery.write_projection(index.projection)
+		return matcher
+
+	async def attach_shared_gallery(self, current_version: int=None):
+		"""
+		Returns a matcher over the gallery published in shared memory, or None when the
+		published version is still `current_version`. When the published gallery is missing
+		or was built from a different gallery index than the one on disk, such as one
+		recreated since, this process publishes it first. The others wait on
+		the lock meanwhile and then find it up to date. If there is still nothing to attach
+		to, a matcher over the gallery on disk stands in until the next check.
+		"""
+		index = await self.user_storage.gallery.read_index()
+		published = self.shared_gallery.read_header()
+		if published is None or published[3:5] != (index['generation'], index['compactions']):
+			with self.shared_gallery.lock():
+				index = await self.user_storage.gallery.read_index()
+				published = self.shared_gallery.read_header()
+				if published is None or published[3:5] != (index['generation'], index['compactions']):
+					known_face_names, known_face_encodings = await self.get_known_encodings()
+					version = self.shared_gallery.publish(
+						known_face_names, known_face_encodings,
+						self.gallery_index['generation'], self.gallery_index['compactions']
+					)
+					logger.info(f"Published version {version} of the shared gallery")
+
+		if current_version is not None and self.shared_gallery.version() == current_version:
+			return None
+		shared_view = self.shared_gallery.attach()
+		if shared_view is None:
+			# Unpublished or left mid-change again since, so go without it until the next check
+			logger.warning("Could not attach to the shared gallery, loading it from disk instead")
+			known_face_names, known_face_encodings = await self.get_known_encodings()
+			return await self.build_matcher(known_face_names, known_face_encodings)
+		return await self.build_matcher(None, None, shared_view=shared_view)
+
+	async def read_webcam(self, shutdown_event: asyncio.Event=None):
+		"""
+		Runs the capture, recognition and display stages until 'q' is pressed or every source
+		runs out of frames. Each camera is captured on its own thread and one recognition
+		thread serves them all, so recognition always works on the newest frames and the video
+		keeps playing while it does. Display stays on this thread, as OpenCV windows have to be
+		driven from the main thread on some platforms. A headless frontend has no display and
+		instead runs until `shutdown_event` is set.
 		"""
 		# Load known face encodings and names
-		known_face_names, known_face_encodings = await self.get_known_encodings()
-		frame_count = 0 
+		if self.shared_gallery is not None:
+			self.matcher = await self.attach_shared_gallery()
+		else:
+			known_face_names, known_face_encodings = await self.get_known_encodings()
+			self.matcher = await self.build_matcher(known_face_names, known_face_encodings)
+
+		self.stop_event.clear()
+		self.denial_writer.start()
+		stages = [threading.Thread(target=self.recognise_frames, name="recognition", daemon=True)]
+		for camera in self.cameras:
+			camera.capture_done.clear()
+			if camera.clip_recorder is not None:
+				camera.clip_recorder.start()
+			stages.append(threading.Thread(
+				target=self.capture_frames, args=(camera,), name=f"capture-{camera.name}", daemon=True
+			))
+		if self.reload_interval:
+			stages.append(threading.Thread(
+				target=asyncio.run, args=(self.watch_gallery(),), name="gallery", daemon=True
+			))
+		for stage in stages:
+			stage.start()
+
+		try:
+			if self.headless:
+				while not self.stop_event.is_set() and not (shutdown_event and shutdown_event.is_set()):
+					await asyncio.sleep(0.1)
+			else:
+				self.display_frames()
+		finally:
+			self.stop_event.set()
+			for stage in stages:
+				stage.join()
+			self.denial_writer.stop()
+			for camera in self.cameras:
+				if camera.clip_recorder is not None:
+					camera.clip_recorder.stop()
+				camera.cap.release()
+			if not self.headless:
+				cv.destroyAllWindows()
+
+	async def watch_gallery(self):
+		"""
+		Gallery stage: polls the gallery index for users enrolled, re-enrolled or removed since
+		the last check, reads in only their encodings and hands them to the recognition stage.
+		A compaction moves every row, so then a whole new matcher is built here instead and
+		swapped in, as it is when the recognition stage asks for the index to be retrained.
+		Either way the recognition stage never waits on storage or on training an index.
+
+		With a shared gallery, the whole gallery is swapped for each new version published,
+		and this process publishes it when it is the first to notice the change.
+		"""
+		gallery = self.user_storage.gallery
+		known = self.gallery_index
+		# None while a gallery loaded from disk stands in for the shared one
+		shared_version = self.matcher.source.version if self.matcher.source is not None else None
+		while not self.stop_event.is_set():
+			await asyncio.sleep(self.reload_interval)
+			try:
+				if self.shared_gallery is not None:
+					update = await self.attach_shared_gallery(shared_version)
+					if update is not None:
+						shared_version = update.source.version if update.source is not None else None
+						self.gallery_updates.put(update)
+					continue
+
+				index = await gallery.read_index()
+				version = (index['generation'], index['compactions'])
+				retrain = self.retrain_requested.is_set()
+				if version == (known['generation'], known['compactions']) and not retrain:
+					continue
+
+				if index['compactions'] != known['compactions'] or retrain:
+					names, encodings = await gallery.load()
+					update = await self.build_matcher(names, encodings)
+				else:
+					added = [name for name, row in index['rows'].items() if known['rows'].get(name) != row]
+					removed = [name for name in known['rows'] if name not in index['rows']]
+					update = (dict(zip(added, await gallery.read_encodings(index, added))), removed)
+
+				# A compaction may have replaced the matrix while it was being read
+				latest = await gallery.read_index()
+				if (latest['generation'], latest['compactions']) != version:
+					continue
+			except (OSError, ValueError) as e:
+				logger.warning(f"Failed to reload the gallery, retrying: {e}")
+				continue
+
+			self.gallery_updates.put(update)
+			if isinstance(update, FaceMatcher):
+				self.retrain_requested.clear()
+			known = index
 
+	def apply_gallery_updates(self):
+		"""
+		Applies the changes handed over by the gallery stage. Only ever called by the
+		recognition stage between frames, so every frame is matched against one consistent
+		gallery.
+		"""
 		while True:
-			current_time = time()
-			# Reset denial record after the specified interval
-			# This is to stop the denial record from growing too big 
-            # Probably not needed for demonstration purposes 
-			if current_time - self.last_reset_time > self.reset_interval:
-				self.denial_record.clear()
-				self.last_reset_time = current_time
-
-			# Read a frame from the webcam
-			ret, frame = self.cap.read()
+			try:
+				update = self.gallery_updates.get_nowait()
+			except queue.Empty:
+				return
+
+			if isinstance(update, FaceMatcher):
+				previous, self.matcher = self.matcher, update
+				previous.close()
+				logger.info(f"Reloaded the gallery, {len(update)} users")
+			else:
+				added, removed = update
+				for username in removed:
+					self.matcher.remove(username)
+				if added:
+					self.matcher.extend(list(added), list(added.values()), train=False)
+				logger.info(f"Gallery updated, {len(added)} users added and {len(removed)} removed")
+				if self.matcher.needs_training:
+					self.retrain_requested.set()
+
+			# Faces already in view may be someone who was just enrolled or removed
+			for camera in self.cameras:
+				for track in camera.tracker.tracks:
+					track.encoded_at = None
+
+	def capture_frames(self, camera: Camera):
+		"""
+		Capture stage: reads frames as fast as a camera delivers them and offers each one to
+		recognition and display, replacing whatever frame they haven't picked up yet. Sources
+		paced "fast" instead wait for recognition to take every frame.
+		"""
+		seq = 0
+		while not self.stop_event.is_set():
+			ret, image = camera.cap.read()
 			if not ret:
+				if camera.cap.finished:
+					break
+				sleep(0.01)
 				continue  # Skip the loop if frame is not read correctly
 
-			# Increment frame counter and skip frames based on the specified frame skip value
-			frame_count += 1
-			if frame_count % self.frame_skip != 0:
-				continue  # Skip processing for this frame
+			seq += 1
+			frame = Frame(seq, time(), image)
+			if camera.clip_recorder is not None:
+				camera.clip_recorder.add_frame(image, frame.captured_at)
+			if camera.cap.pacing == "fast":
+				while not camera.recognition_queue.wait_until_empty(timeout=0.1):
+					if self.stop_event.is_set():
+						return
+			camera.recognition_queue.put(frame)
+			self.scheduler.notify()
+			if not self.headless:
+				camera.display_queue.put(frame)
 
-			# Resize the frame to reduce resolution and speed up face processing
-			small_frame = cv.resize(frame, (0, 0), fx=0.5, fy=0.5)
+		# Recognition stops once every camera's last frame has been taken and finished
+		while not camera.recognition_queue.wait_until_empty(timeout=0.1):
+			if self.stop_event.is_set():
+				return
+		camera.capture_done.set()
 
-			# Convert the frame to RGB for face recognition processing
-			rgb_frame = cv.cvtColor(small_frame, cv.COLOR_BGR2RGB)
-			# Detect faces and their encodings in the frame
-			face_locations = face_recognition.face_locations(rgb_frame)
-			face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
+	def recognise_frames(self):
+		"""
+		Recognition stage: identifies the faces in the newest frame of the camera the scheduler
+		picks, handles access and passes the results on for display. It logs how long frames
+		take from capture to decision for every camera.
 
-			# Process each face found
-			for (top, right, bottom, left), face_encoding in zip(face_locations, face_encodings):
-				# Scale face locations back up to the original frame size
-				top *= 2; right *= 2; bottom *= 2; left *= 2
+		With more than one recognition worker, detection and encoding for several frames run
+		in parallel on worker processes, one frame per worker. Their results are still handled
+		strictly in the order the frames were taken, so access decisions and the display never
+		go back in time when a later frame happens to finish first.
 
-				# Compare face encodings against known faces
-				matches = face_recognition.compare_faces(known_face_encodings, face_encoding)
-				face_distances = face_recognition.face_distance(known_face_encodings, face_encoding)
-				# Identify the closest match with the smallest distance
-				best_match_index = np.argmin(face_distances) if matches else -1
-				name = known_face_names[best_match_index] if best_match_index != -1 and face_distances[best_match_index] < self.threshold else "Unknown"
+		A frame that fails is logged and skipped. Anything that stops recognition altogether,
+		such as a worker process dying, stops the whole frontend.
+		"""
+		pool = None
+		if self.recognition_workers > 1:
+			pool = RecognitionPool(self.recognition_workers)
+			pool.start()
 
-				# Handle unrecognized or failed matches
-				if name == "Unknown" or not any(matches):
-					self.handle_denial(frame, top, right, bottom, left, current_time)
+		# (camera, frame, future) for every frame handed to a worker, oldest first
+		in_flight = deque()
+		last_report = monotonic()
+		try:
+			while not self.stop_event.is_set():
+				self.apply_gallery_updates()
+				if pool is None:
+					camera = self.scheduler.next_camera(timeout=0.1)
+					frame = camera.recognition_queue.get_nowait() if camera is not None else None
+					if frame is None:
+						if self.scheduler.finished:
+							self.stop_event.set()
+						continue
+					try:
+						if not camera.motion_gate.check(frame.image, frame.captured_at):
+							self.finish_static_frame(camera, frame)
+							continue
+						face_locations, face_encodings = detect_faces(
+							self.prepare_frame(frame), camera.tracker.skip_boxes(frame.captured_at)
+						)
+						self.finish_frame(camera, frame, face_locations, face_encodings)
+					except Exception:
+						# One bad frame mustn't take recognition down for every camera
+						logger.exception(f"{camera.name}: recognition failed on frame {frame.seq}")
 
-				# Draw a label and bounding box around the face
-				self.draw_label(frame, name, top, right, bottom, left)
+				else:
+					# Keep every worker busy with the newest frames available
+					camera = frame = None
+					if len(in_flight) < pool.workers:
+						camera = self.scheduler.next_camera(timeout=0.005 if in_flight else 0.1)
+						frame = camera.recognition_queue.get_nowait() if camera is not None else None
+					if frame is not None:
+						try:
+							if camera.motion_gate.check(frame.image, frame.captured_at):
+								future = pool.submit(self.prepare_frame(frame), camera.tracker.skip_boxes(frame.captured_at))
+							else:
+								# Static frames still queue up behind the ones in flight to keep the order
+								future = futures.Future()
+								future.set_result(None)
+							in_flight.append((camera, frame, future))
+						except futures.BrokenExecutor:
+							raise
+						except Exception:
+							logger.exception(f"{camera.name}: recognition failed on frame {frame.seq}")
+					elif in_flight:
+						futures.wait([in_flight[0][2]], timeout=0.005)
+					elif self.scheduler.finished:
+						self.stop_event.set()
 
-			cv.imshow('Video', frame)
-			if cv.waitKey(1) & 0xFF == ord('q'):
-				break
+					# Only the oldest frame may be finished, which keeps results in sequence order
+					while in_flight and in_flight[0][2].done():
+						camera, frame, future = in_flight.popleft()
+						try:
+							if future.result() is None:
+								self.finish_static_frame(camera, frame)
+								continue
+							face_locations, face_encodings = future.result()
+							self.finish_frame(camera, frame, face_locations, face_encodings)
+						except futures.BrokenExecutor:
+							# A worker died, so no frame in flight will come back
+							raise
+						except Exception:
+							logger.exception(f"{camera.name}: recognition failed on frame {frame.seq}")
+
+				if monotonic() - last_report > self.stats_interval:
+					last_report = monotonic()
+					self.log_stats()
+		except Exception:
+			logger.exception("Recognition stopped")
+		finally:
+			# Nothing takes frames off the queues any more, so every other stage stops too
+			self.stop_event.set()
+			if pool is not None:
+				pool.shutdown()
+
+	def log_stats(self):
+		"""
+		Logs the frame rate and latency of every camera, and what was skipped along the way.
+		"""
+		for camera in self.cameras:
+			tracker, unknown_faces = camera.tracker, camera.unknown_faces
+			logger.info(
+				f"{camera.name}: recognition latency {camera.latency.summary()}, frames dropped "
+				f"before recognition: {camera.recognition_queue.dropped}, encodings "
+				f"skipped by tracking: {tracker.encodings_skipped}/"
+				f"{tracker.encodings_skipped + tracker.encodings_needed}, frames "
+				f"gated by motion: {camera.motion_gate.gated_fraction:.0%}, repeat denials "
+				f"skipped: {unknown_faces.hits}/{unknown_faces.hits + unknown_faces.misses}, denial clips "
+				f"{camera.clip_recorder.stats() if camera.clip_recorder is not None else 'disabled'}"
+			)
+		logger.info(f"Denial images {self.denial_writer.stats()}")
+
+	def prepare_frame(self, frame: Frame):
+		"""
+		Shrinks a captured frame and converts it to RGB, ready for face detection.
+		"""
+		# Resize the frame to reduce resolution and speed up face processing
+		small_frame = cv.resize(frame.image, (0, 0), fx=0.5, fy=0.5)
+
+		# Convert the frame to RGB for face recognition processing
+		return cv.cvtColor(small_frame, cv.COLOR_BGR2RGB)
+
+	def finish_frame(self, camera: Camera, frame: Frame, face_locations, face_encodings):
+		"""
+		Makes the access decisions for a frame whose faces have been detected and encoded, and
+		passes the results on for display.
+		"""
+		faces = self.identify_faces(camera, frame, face_locations, face_encodings)
+		camera.last_faces = faces
+		camera.latency.record(time() - frame.captured_at)
+		camera.results_queue.put((frame.seq, faces))
+
+	def finish_static_frame(self, camera: Camera, frame: Frame):
+		"""
+		Nothing moved since the last frame detection ran on, so its results still stand.
+		"""
+		camera.latency.record(time() - frame.captured_at)
+		camera.results_queue.put((frame.seq, camera.last_faces))
+
+	def identify_faces(self, camera: Camera, frame: Frame, face_locations, face_encodings):
+		"""
+		Checks the faces found in a frame against the known faces, handling a denial for every
+		face that isn't recognised. Faces are tracked between frames, and a face that came
+		without an encoding keeps the identity its track was last matched to. Returns a list of
+		((top, right, bottom, left), name) in full frame coordinates.
+		"""
+		faces = []
+		tracks = camera.tracker.update(face_locations, frame.captured_at)
+		# Every encoded face in the frame is matched against the gallery in one go
+		matches = iter(self.matcher.match(
+			[face_encoding for face_encoding in face_encodings if face_encoding is not None]
+		))
+		# Process each face found
+		for track, (top, right, bottom, left), face_encoding in zip(tracks, face_locations, face_encodings):
+			# Scale face locations back up to the original frame size
+			top *= 2; right *= 2; bottom *= 2; left *= 2
+
+			if face_encoding is not None:
+				camera.tracker.encodings_needed += 1
+				match = next(matches)
+				track.identify(match.name, match.distance, frame.captured_at)
+			else:
+				camera.tracker.encodings_skipped += 1
+
+			name = track.name
+			if name is None:
+				# Skipped while the track it overlapped was still fresh, but matched to a
+				# brand new track here. It will be encoded on the next frame
+				continue
+
+			# Handle unrecognized or failed matches
+			if name == "Unknown":
+				self.handle_denial(camera, frame.image, top, right, bottom, left, face_encoding, frame.captured_at)
 
-		self.cap.release()
-		cv.destroyAllWindows()
+			faces.append(((top, right, bottom, left), name))
+		return faces
 
-	def handle_denial(self, frame, top, right, bottom, left, current_time):
+	def display_frames(self):
 		"""
-		Handles an access denial by recording the denial once per configured interval in seconds 
-		and capturing an image of the denial if it's the first in the interval.
+		Display stage: shows the newest captured frame of every camera, each in its own window,
+		with the most recent recognition results drawn over it, until 'q' is pressed.
 		"""
-		interval_key = int(current_time // self.denial_interval)  # Use configured intervals as keys
-		if interval_key not in self.denial_record:
-			self.denial_record[interval_key] = True
-			self.capture_denial_image(frame)
+		faces = {camera.name: [] for camera in self.cameras}
+		while not self.stop_event.is_set():
+			shown = False
+			for camera in self.cameras:
+				result = camera.results_queue.get_nowait()
+				if result is not None:
+					_, faces[camera.name] = result
 
-	def capture_denial_image(self, frame):
+				# A single camera can wait for its next frame, several are polled in turn
+				frame = camera.display_queue.get(timeout=0.1 if len(self.cameras) == 1 else 0)
+				if frame is None:
+					continue
+
+				# Recognition may still be reading this image, so draw on a copy
+				image = frame.image.copy()
+				for (top, right, bottom, left), name in faces[camera.name]:
+					# Draw a label and bounding box around the face
+					self.draw_label(image, name, top, right, bottom, left)
+
+				cv.imshow('Video' if len(self.cameras) == 1 else camera.name, image)
+				shown = True
+
+			if not shown:
+				if len(self.cameras) > 1:
+					sleep(0.005)
+				continue
+			if cv.waitKey(1) & 0xFF == ord('q'):
+				break
+
+	def handle_denial(self, camera: Camera, frame, top, right, bottom, left, face_encoding, current_time):
 		"""
-		Captures the entire frame when access is denied and saves it with a timestamp.
+		Handles an access denial by capturing an image and a clip of it, unless the same unknown
+		face was already denied within the configured interval. A face without an encoding kept
+		the identity of its track, which was checked against the recent unknown faces when it
+		was encoded, so it is never captured again.
 		"""
-		# Generate a timestamp for the filename
-		timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-		filename = f"{timestamp}.png" 
+		if face_encoding is None or camera.unknown_faces.seen(face_encoding, current_time):
+			return
+		self.capture_denial_image(camera, frame, (top, right, bottom, left), current_time)
+		if camera.clip_recorder is not None:
+			camera.clip_recorder.trigger(current_time)
 
-		# Save image 
-		denied_image_path = os.path.join(self.access_denied_images_path, filename)
-		cv.imwrite(denied_image_path, frame)
+	def capture_denial_image(self, camera: Camera, frame, box, captured_at):
+		"""
+		Hands the frame a denial happened in to the denial writer, which saves it with a
+		timestamp, and the camera's name when there are several, in the background. Dropped
+		when the writer is too far behind.
+		"""
+		label = camera.name if len(self.cameras) > 1 else None
+		if not self.denial_writer.submit(frame, captured_at, box, label):
+			logger.debug("Denial image dropped, the writer is behind")
 
 	def draw_label(self, frame, name, top, right, bottom, left):
 		"""
@@ -11,12 +11,15 @@ from hypercorn.config import Config
 from quart import Quart, render_template, websocket, request
 
 from backend import create_app
+from encoding_pool import EncodingPool
+from enrollment import bulk_enroll
 from frontend import WebcamReader
+from storage import UserStorage
 
 logger = logging.getLogger()
 
-async def _start_frontend(*args, **kwargs):
-    return await WebcamReader().read_webcam()
+async def _start_frontend(shutdown_event, **reader_options):
+    return await WebcamReader(**reader_options).read_webcam(shutdown_event)
 
 async def _start_backend(shutdown_event:asyncio.Event, *args, **kwargs):
     # We will use this event to gracefully exit our asyncio loop
@@ -26,10 +29,82 @@ async def _start_backend(shutdown_event:asyncio.Event, *args, **kwargs):
 
     return await serve(create_app(), config, shutdown_trigger=shutdown_event.wait)
 
+async def _start_bulk_enroll(source, workers=None, *args, **kwargs):
+
+    encoding_pool = EncodingPool(max_workers=workers)
+    encoding_pool.start()
+    try:
+        summary = await bulk_enroll(source, UserStorage(encoding_pool=encoding_pool))
+    finally:
+        encoding_pool.shutdown()
+
+    print(
+        f"Enrolled {summary['enrolled']} of {summary['images']} images in "
+        f"{summary['seconds']:.1f}s ({summary['images_per_second']:.1f} images/s)"
+    )
+    for username, error in summary['failed'].items():
+        print(f"  {username}: {error}")
+    for filename, reason in summary['skipped'].items():
+        print(f"  {filename} skipped: {reason}")
+
 def main():
 
     parser = argparse.ArgumentParser()
     parser.add_argument("mode")
+    parser.add_argument(
+        "source", nargs="?",
+        help="Directory or zip archive of <username>.jpg images, for 'enroll' mode"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help="Face encoding processes for 'enroll' mode, defaults to one per core"
+    )
+    parser.add_argument(
+        "--recognition-workers", type=int, default=1,
+        help="Face detection processes for 'frontend' mode"
+    )
+    parser.add_argument(
+        "--motion-sensitivity", type=float, default=0.01,
+        help="Fraction of pixels that must change before 'frontend' mode runs detection, 0 disables the gate"
+    )
+    parser.add_argument(
+        "--index", choices=["exact", "ivf", "pca"], default="exact",
+        help="Gallery search for 'frontend' mode on large galleries, 'ivf' is faster but approximate"
+    )
+    parser.add_argument(
+        "--shared-gallery", action="store_true",
+        help="Share one decrypted gallery in shared memory between all 'frontend' processes on the host"
+    )
+    parser.add_argument(
+        "--precision", choices=["float32", "int8"], default="float32",
+        help="Precision 'frontend' mode scans the gallery in, 'int8' uses a quarter of the memory"
+    )
+    parser.add_argument("--denial-format", choices=["jpg", "webp"], default="jpg")
+    parser.add_argument("--denial-quality", type=int, default=90)
+    parser.add_argument(
+        "--denial-crop", action="store_true",
+        help="Save only the face in denial images instead of the whole frame"
+    )
+    parser.add_argument(
+        "--video-source", nargs="+", default=["0"],
+        help="Camera indexes, video files, image directories, RTSP/HTTP URLs or 'synthetic' for 'frontend' mode"
+    )
+    parser.add_argument(
+        "--headless", action="store_true",
+        help="Run 'frontend' mode without a window, until stopped or every source runs out"
+    )
+    parser.add_argument(
+        "--schedule", choices=["round-robin", "motion"], default="round-robin",
+        help="How 'frontend' mode shares recognition between several sources"
+    )
+    parser.add_argument(
+        "--pacing", choices=["realtime", "fast"],
+        help="Play recorded sources at their own frame rate, or process every frame as fast as possible"
+    )
+    parser.add_argument(
+        "--clip-seconds", type=float, default=5.0,
+        help="Seconds of video saved before and after each denial, 0 disables denial clips"
+    )
     args = parser.parse_args()
 
     shutdown_event = asyncio.Event()
@@ -39,10 +114,20 @@ def main():
     if args.mode == 'backend':
         async_fn = _start_backend(shutdown_event)
     elif args.mode == "frontend":
-        async_fn = _start_frontend(shutdown_event)
+        async_fn = _start_frontend(
+            shutdown_event, recognition_workers=args.recognition_workers,
+            motion_sensitivity=args.motion_sensitivity, matcher_index=args.index,
+            shared_gallery=args.shared_gallery, precision=args.precision,
+            denial_format=args.denial_format, denial_quality=args.denial_quality,
+            denial_crop=args.denial_crop, clip_pre_seconds=args.clip_seconds,
+            clip_post_seconds=args.clip_seconds, source=args.video_source, pacing=args.pacing,
+            headless=args.headless, schedule=args.schedule
+        )
+    elif args.mode == "enroll" and args.source:
+        async_fn = _start_bulk_enroll(args.source, args.workers)
     else:
         logger.error(
-            "Please instantiate this library via 'backend' or 'frontend' mode."
+            "Please instantiate this library via 'backend', 'frontend' or 'enroll <source>' mode."
         )
         exit()
 
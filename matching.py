@@ -0,0 +1,611 @@
+from collections import namedtuple
+
+import numpy as np
+
+from storage import ENCODING_SIZE
+
+
+# The closest known face to a probe: its gallery row and name, the distance to it and the
+# distance to the next closest identity (inf when there is none)
+Match = namedtuple('Match', ['index', 'name', 'distance', 'runner_up'])
+
+
+def _squared_distances(vectors: np.ndarray, vector_norms: np.ndarray, points: np.ndarray, point_norms: np.ndarray):
+	""" ||v - p||^2 for every vector/point pair, via one matrix multiplication. """
+	squared = vectors @ points.T
+	squared *= -2
+	squared += point_norms
+	squared += vector_norms[:, None]
+	# Rounding can take distances between identical vectors slightly below zero
+	return np.maximum(squared, 0, out=squared)
+
+
+def _row_norms(matrix: np.ndarray) -> np.ndarray:
+	return np.einsum('ij,ij->i', matrix, matrix)
+
+
+class ExactIndex:
+	""" Scans the whole gallery for every probe. """
+	trained_size = 0
+
+	def needs_training(self, size: int) -> bool:
+		return False
+
+	def train(self, matrix: np.ndarray) -> None:
+		pass
+
+	def add(self, row: int, encoding: np.ndarray) -> None:
+		pass
+
+	def remove(self, row: int, last: int) -> None:
+		pass
+
+	def candidates(self, probes: np.ndarray, radius: float):
+		""" The gallery rows worth checking for these probes, or None for all of them. """
+		return None
+
+
+class IVFIndex:
+	""" Inverted file index: k-means splits the gallery into `n_lists` clusters, and a probe is
+	only compared with the rows of the `n_probe` clusters whose centroids are closest to it.
+	This is approximate, as a probe's nearest neighbour can sit just across a cluster border,
+	so raising `n_probe` trades speed for recall.
+
+	Rows added after training are assigned to their nearest existing centroid without moving
+	any centroids, and the index asks to be retrained once the gallery has doubled since. """
+
+	def __init__(self, n_lists: int=None, n_probe: int=8, iterations: int=10, sample_size: int=256, seed: int=0):
+		self.n_lists = n_lists  # Defaults to the square root of the gallery size
+		self.n_probe = n_probe
+		self.iterations = iterations
+		self.sample_size = sample_size  # Rows per cluster k-means is trained on at most
+		self.seed = seed
+		self.centroids = None
+		self.trained_size = 0
+		self.assignments = []  # The cluster of every gallery row
+		self.lists = []  # The gallery rows in every cluster
+		self._arrays = {}  # Cluster row lists as arrays, until the cluster next changes
+
+	def _nearest(self, vectors: np.ndarray, k: int) -> np.ndarray:
+		squared = _squared_distances(vectors, _row_norms(vectors), self.centroids, self._centroid_norms)
+		if k == 1:
+			# argpartition is much slower than argmin for a single neighbour
+			return squared.argmin(axis=1)[:, None]
+		if k >= len(self.centroids):
+			return np.broadcast_to(np.arange(len(self.centroids)), (len(vectors), len(self.centroids)))
+		return np.argpartition(squared, k - 1, axis=1)[:, :k]
+
+	def needs_training(self, size: int) -> bool:
+		return size >= 2 * self.trained_size
+
+	def train(self, matrix: np.ndarray) -> None:
+		rng = np.random.default_rng(self.seed)
+		n_lists = max(1, min(self.n_lists or int(np.sqrt(len(matrix))), len(matrix)))
+		sample = matrix
+		if len(matrix) > n_lists * self.sample_size:
+			sample = matrix[rng.choice(len(matrix), n_lists * self.sample_size, replace=False)]
+
+		self.centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+		for _ in range(self.iterations):
+			self._centroid_norms = _row_norms(self.centroids)
+			labels = self._nearest(sample, 1)[:, 0]
+			counts = np.bincount(labels, minlength=n_lists)
+			filled = counts > 0
+			# Sum the rows of each cluster by sorting them into contiguous runs
+			order = np.argsort(labels, kind='stable')
+			starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+			sums = np.add.reduceat(sample[order], starts, axis=0)
+			self.centroids[filled] = sums / counts[filled, None]
+			# Clusters that lost all their rows restart from a random row
+			empty = np.flatnonzero(~filled)
+			self.centroids[empty] = sample[rng.choice(len(sample), len(empty))]
+		self._centroid_norms = _row_norms(self.centroids)
+
+		labels = self._nearest(matrix, 1)[:, 0] if len(matrix) else np.empty(0, dtype=np.intp)
+		self.assignments = labels.tolist()
+		self.lists = [[] for _ in range(n_lists)]
+		for row, label in enumerate(self.assignments):
+			self.lists[label].append(row)
+		self._arrays = {}
+		self.trained_size = len(matrix)
+
+	def add(self, row: int, encoding: np.ndarray) -> None:
+		if self.centroids is None:
+			return
+		label = int(self._nearest(encoding[None, :], 1)[0, 0])
+		if row < len(self.assignments):
+			# A user whose encoding was replaced
+			old_label = self.assignments[row]
+			self.lists[old_label].remove(row)
+			self._arrays.pop(old_label, None)
+			self.assignments[row] = label
+		else:
+			self.assignments.append(label)
+		self.lists[label].append(row)
+		self._arrays.pop(label, None)
+
+	def remove(self, row: int, last: int) -> None:
+		""" Forgets `row`, after the matcher moved its `last` row into that slot. """
+		if self.centroids is None:
+			return
+		label = self.assignments[row]
+		self.lists[label].remove(row)
+		self._arrays.pop(label, None)
+		if row != last:
+			last_label = self.assignments[last]
+			rows = self.lists[last_label]
+			rows[rows.index(last)] = row
+			self._arrays.pop(last_label, None)
+			self.assignments[row] = last_label
+		self.assignments.pop()
+
+	def _list_array(self, label: int) -> np.ndarray:
+		rows = self._arrays.get(label)
+		if rows is None:
+			rows = self._arrays[label] = np.array(self.lists[label], dtype=np.intp)
+		return rows
+
+	def candidates(self, probes: np.ndarray, radius: float):
+		if self.centroids is None:
+			return None
+		labels = np.unique(self._nearest(probes, self.n_probe))
+		return np.concatenate([self._list_array(label) for label in labels])
+
+
+class PCAIndex:
+	""" Rules out users that provably can't be within the search radius of a probe, using
+	the first `dimensions` principal components of the gallery. With x centred and split
+	into its projection p and the residual r orthogonal to it,
+
+		||x - y||^2 = ||p_x - p_y||^2 + ||r_x - r_y||^2 >= ||p_x - p_y||^2 + (||r_x|| - ||r_y||)^2
+
+	so only the projected rows and the length of every residual are needed to bound the
+	distance from below. Rows whose bound is within the radius are compared exactly in all
+	128 dimensions, which makes the result exact as well, not an approximation.
+
+	The projection only prunes well while it still describes the gallery. The mean squared
+	residual is tracked as rows come and go, and the index asks to be retrained once it is
+	`drift_tolerance` above what it was when the projection was fitted. `projection` and
+	`load_projection` let the projection be stored with the gallery. """
+
+	def __init__(self, dimensions: int=16, drift_tolerance: float=0.25):
+		self.dimensions = dimensions
+		self.drift_tolerance = drift_tolerance
+		self.mean = None
+		self.components = None  # ENCODING_SIZE x dimensions, orthonormal columns
+		self.trained_size = 0
+		self.trained_residual = 0.0  # Mean squared residual of the rows it was fitted to
+		self._clear()
+
+	def _clear(self) -> None:
+		self._size = 0
+		self._residual_energy = 0.0  # Sum of the squared residuals of every row
+		self._projected = np.empty((0, self.dimensions), dtype=np.float32)
+		self._projected_norms = np.empty(0, dtype=np.float32)
+		self._residuals = np.empty(0, dtype=np.float32)
+
+	@property
+	def projection(self):
+		if self.components is None:
+			return None
+		return {
+			'mean': self.mean, 'components': self.components,
+			'trained_size': self.trained_size, 'trained_residual': self.trained_residual
+		}
+
+	def load_projection(self, projection: dict) -> None:
+		""" Reuses a projection fitted earlier instead of training one. """
+		self.mean = np.asarray(projection['mean'], dtype=np.float32)
+		self.components = np.asarray(projection['components'], dtype=np.float32)
+		self.dimensions = self.components.shape[1]
+		self.trained_size = projection['trained_size']
+		self.trained_residual = projection['trained_residual']
+		self._clear()
+
+	def _project(self, vectors: np.ndarray):
+		centred = vectors - self.mean
+		projected = centred @ self.components
+		projected_norms = _row_norms(projected)
+		squared_residuals = np.maximum(_row_norms(centred) - projected_norms, 0)
+		return projected, projected_norms, squared_residuals
+
+	def needs_training(self, size: int) -> bool:
+		if self.components is None:
+			return True
+		if not self._size:
+			return False
+		return self._residual_energy / self._size > (1 + self.drift_tolerance) * self.trained_residual
+
+	def train(self, matrix: np.ndarray) -> None:
+		self.mean = matrix.mean(axis=0)
+		centred = matrix - self.mean
+		# eigh sorts the eigenvalues in ascending order, so the principal axes come last
+		_, eigenvectors = np.linalg.eigh(centred.T @ centred)
+		self.components = np.ascontiguousarray(eigenvectors[:, ::-1][:, :self.dimensions], dtype=np.float32)
+		self.mean = self.mean.astype(np.float32)
+
+		self._clear()
+		self._reserve(len(matrix))
+		self._store(np.arange(len(matrix)), matrix)
+		self._size = len(matrix)
+		self.trained_size = len(matrix)
+		self.trained_residual = self._residual_energy / max(len(matrix), 1)
+
+	def _reserve(self, size: int) -> None:
+		if size <= len(self._residuals):
+			return
+		capacity = max(size, 2 * len(self._residuals), 1024)
+		for name in ('_projected', '_projected_norms', '_residuals'):
+			old = getattr(self, name)
+			new = np.zeros((capacity,) + old.shape[1:], dtype=np.float32)
+			new[:self._size] = old[:self._size]
+			setattr(self, name, new)
+
+	def _store(self, rows, vectors: np.ndarray) -> None:
+		projected, projected_norms, squared_residuals = self._project(vectors)
+		self._projected[rows] = projected
+		self._projected_norms[rows] = projected_norms
+		self._residuals[rows] = np.sqrt(squared_residuals)
+		self._residual_energy += float(squared_residuals.sum())
+
+	def add(self, row: int, encoding: np.ndarray) -> None:
+		if self.components is None:
+			return
+		if row < self._size:
+			# A user whose encoding was replaced
+			self._residual_energy -= float(self._residuals[row]) ** 2
+		else:
+			self._reserve(row + 1)
+			self._size = row + 1
+		self._store([row], encoding[None, :])
+
+	def remove(self, row: int, last: int) -> None:
+		if self.components is None:
+			return
+		self._residual_energy -= float(self._residuals[row]) ** 2
+		for array in (self._projected, self._projected_norms, self._residuals):
+			array[row] = array[last]
+		self._size = last
+
+	def candidates(self, probes: np.ndarray, radius: float):
+		if self.components is None:
+			return None
+		projected, projected_norms, squared_residuals = self._project(probes)
+		bounds = _squared_distances(
+			projected, projected_norms, self._projected[:self._size], self._projected_norms[:self._size]
+		)
+		bounds += np.square(np.sqrt(squared_residuals)[:, None] - self._residuals[:self._size])
+		# The bound is exact arithmetic; leave float32 rounding some room so it never prunes a
+		# row that is just inside the radius
+		return np.flatnonzero((bounds < radius * radius * (1 + 1e-4) + 1e-6).any(axis=0))
+
+
+class FaceMatcher:
+	""" Matches face encodings against the known faces, held as one preallocated float32
+	matrix alongside the squared norm of every row. All the faces in a frame are matched
+	together: ||p - g||^2 = ||p||^2 + ||g||^2 - 2 p.g, so the whole faces x gallery
+	distance matrix comes out of a single matrix multiplication.
+
+	Rows are added and removed in place. Capacity doubles when it runs out, so adding users
+	one at a time only reallocates a logarithmic number of times.
+
+	An `index` such as IVFIndex or PCAIndex narrows down the rows each frame is compared
+	with on large galleries. Below `exact_below` users every row is still compared, as the
+	scan is cheap enough there. When an index rules out every user for a probe, its match is
+	"Unknown" at an infinite distance. """
+
+	storage_dtype = np.float32
+
+	def __init__(self, names=(), encodings=None, threshold: float=0.6, capacity: int=1024,
+			index=None, exact_below: int=10000):
+		names = list(names)
+		self.threshold = threshold
+		self.index = index if index is not None else ExactIndex()
+		self.exact_below = exact_below
+		self.names = []
+		self.rows = {}
+		self.source = None  # Whatever owns a gallery passed to `wrap`
+		self._size = 0
+		self._matrix = self._norms = None
+		self._reserve(max(capacity, len(names), 1))
+		if names:
+			self.extend(names, encodings)
+
+	@classmethod
+	def wrap(cls, names, matrix: np.ndarray, norms: np.ndarray, source=None, **kwargs):
+		""" A matcher over a float32 gallery and its squared norms that live elsewhere, such
+		as in shared memory, without copying them. The gallery is only copied into a matrix
+		of the matcher's own the first time a user is added or removed. `source` is closed
+		along with the matcher. """
+		matcher = cls(capacity=1, **kwargs)
+		matcher._matrix, matcher._norms = matrix, norms
+		matcher.names = list(names)
+		matcher.rows = {name: row for row, name in enumerate(matcher.names)}
+		matcher._size = len(matcher.names)
+		matcher.source = source
+		for row in range(matcher._size):
+			matcher.index.add(row, matrix[row])
+		matcher._train_index()
+		return matcher
+
+	def close(self) -> None:
+		""" Lets go of the gallery. The matcher can't be used afterwards. """
+		self._matrix = self._norms = None
+		if self.source is not None:
+			self.source.close()
+			self.source = None
+
+	def __len__(self) -> int:
+		return self._size
+
+	@property
+	def matrix(self) -> np.ndarray:
+		""" The live rows of the gallery, in the same order as `names`. """
+		return self._matrix[:self._size]
+
+	def _grow(self, array: np.ndarray, capacity: int) -> np.ndarray:
+		grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+		grown[:self._size] = array[:self._size]
+		return grown
+
+	def _reserve(self, size: int) -> None:
+		if self._matrix is None:
+			self._matrix = np.empty((size, ENCODING_SIZE), dtype=self.storage_dtype)
+			self._norms = np.empty(size, dtype=np.float32)
+			return
+		if size <= self._matrix.shape[0] and self._matrix.flags.writeable:
+			return
+		capacity = max(size, 2 * self._matrix.shape[0])
+		self._matrix, self._norms = self._grow(self._matrix, capacity), self._grow(self._norms, capacity)
+
+	@property
+	def indexed(self) -> bool:
+		""" Whether matches currently go through the index rather than a full scan. """
+		return self._size >= self.exact_below and self.index.trained_size > 0
+
+	@property
+	def needs_training(self) -> bool:
+		""" Whether the index has drifted far enough from the gallery to be relearned. """
+		return self._size >= self.exact_below and self.index.needs_training(self._size)
+
+	def extend(self, names, encodings, train: bool=True) -> None:
+		""" Adds or replaces the encodings of several users at once. With `train` False the
+		index is never relearned here, even once it `needs_training`, which leaves that to
+		whoever can afford the time, such as by building a new matcher elsewhere. Until
+		then, new rows go into the index as it is. """
+		encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+		self._reserve(self._size + len(names))
+		for name, encoding in zip(names, encodings):
+			row = self.rows.get(name)
+			if row is None:
+				row = self._size
+				self.rows[name] = row
+				self.names.append(name)
+				self._size += 1
+			self._matrix[row] = encoding
+			self._norms[row] = encoding @ encoding
+			self.index.add(row, encoding)
+		if train:
+			self._train_index()
+
+	def _train_index(self) -> None:
+		# The index drifts from the gallery as users are added, and is relearned whenever it
+		# says it has drifted too far
+		if self.needs_training:
+			self.index.train(self.matrix)
+
+	def add(self, name: str, encoding: np.ndarray) -> None:
+		self.extend([name], [encoding])
+
+	def remove(self, name: str) -> bool:
+		""" Removes a user by moving the last row into its place. Returns False when the user
+		isn't in the gallery. """
+		row = self.rows.pop(name, None)
+		if row is None:
+			return False
+		self._reserve(self._size)
+		last = self._size - 1
+		self.index.remove(row, last)
+		if row != last:
+			self._matrix[row] = self._matrix[last]
+			self._norms[row] = self._norms[last]
+			self.names[row] = self.names[last]
+			self.rows[self.names[row]] = row
+		self.names.pop()
+		self._size = last
+		return True
+
+	def distances(self, probes) -> np.ndarray:
+		""" Euclidean distance from every probe encoding to every known face, as a
+		probes x gallery matrix. """
+		probes = np.asarray(probes, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+		return np.sqrt(_squared_distances(probes, _row_norms(probes), self.matrix, self._norms[:self._size]))
+
+	def match(self, probes) -> list:
+		""" Finds the closest known face to each probe encoding. The name is "Unknown" when
+		the closest face isn't within the threshold. """
+		probes = np.asarray(probes, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+		if not len(probes):
+			return []
+		if not self._size:
+			return [Match(-1, "Unknown", float("inf"), float("inf")) for _ in probes]
+
+		rows = self.index.candidates(probes, self.threshold) if self.indexed else None
+		if rows is None:
+			squared = _squared_distances(probes, _row_norms(probes), self.matrix, self._norms[:self._size])
+		else:
+			squared = _squared_distances(probes, _row_norms(probes), self._matrix[rows], self._norms[rows])
+		if squared.shape[1] == 0:
+			return [Match(-1, "Unknown", float("inf"), float("inf")) for _ in probes]
+		if squared.shape[1] == 1:
+			best = np.zeros((len(probes), 1), dtype=np.intp)
+		else:
+			# Only the two smallest distances per probe need to be found and ordered
+			best = np.argpartition(squared, 1, axis=1)[:, :2]
+			best_squared = np.take_along_axis(squared, best, axis=1)
+			best = np.take_along_axis(best, np.argsort(best_squared, axis=1), axis=1)
+
+		matches = []
+		for probe_index, columns in enumerate(best):
+			row = int(columns[0] if rows is None else rows[columns[0]])
+			distance = float(np.sqrt(squared[probe_index, columns[0]]))
+			runner_up = float(np.sqrt(squared[probe_index, columns[1]])) if len(columns) > 1 else float("inf")
+			name = self.names[row] if distance < self.threshold else "Unknown"
+			matches.append(Match(row, name, distance, runner_up))
+		return matches
+
+
+class Int8Matcher(FaceMatcher):
+	""" A FaceMatcher that scans an int8 copy of the gallery, a quarter of the size of float32.
+	Dimension d of every encoding is stored as round(x_d / scale_d), with the per dimension
+	scale fitted to the gallery it is built from.
+
+	The distance to the dequantized row is off from the true distance by no more than the
+	row's quantization error, which is kept for every row. Each probe's rows that could be
+	within the threshold by that bound are re-ranked at full precision, so the decisions
+	and matched users are the same as at full precision. Distances of matches that weren't
+	re-ranked are approximate.
+
+	Full precision rows are read from `encodings` as passed in, kept by reference. Passing
+	the gallery straight from GalleryStore.load means only the few rows re-ranked are ever
+	read from disk and decrypted, all of a frame's at once. Users added later are kept at
+	float32 beside their codes. Scanning converts the codes a
+	block of `block_rows` at a time, so the scan never allocates a float copy of the whole
+	gallery. """
+
+	storage_dtype = np.int8
+
+	def __init__(self, names=(), encodings=None, threshold: float=0.6, capacity: int=1024, source=None,
+			block_rows: int=8192):
+		names = list(names)
+		self.block_rows = block_rows
+		self._errors = self._full_rows = None
+		super().__init__(threshold=threshold, capacity=max(capacity, len(names)))
+		self.source = source
+		self._full = encodings if encodings is not None else np.empty((0, ENCODING_SIZE), dtype=np.float32)
+		self._extra = {}  # Full precision encodings of users added after construction
+
+		absmax = np.full(ENCODING_SIZE, 0.5 / 1.25, dtype=np.float32)
+		if len(names):
+			absmax = np.zeros(ENCODING_SIZE, dtype=np.float32)
+			for start in range(0, len(names), self.block_rows):
+				block = np.asarray(self._full[start:start + self.block_rows], dtype=np.float32)
+				absmax = np.maximum(absmax, np.abs(block).max(axis=0))
+		# Leave some room for users enrolled later, whose codes would otherwise clip
+		self.scale = (np.maximum(absmax, 1e-6) * 1.25 / 127).astype(np.float32)
+
+		for start in range(0, len(names), self.block_rows):
+			block = np.asarray(self._full[start:start + self.block_rows], dtype=np.float32)
+			end = start + len(block)
+			self._store(slice(start, end), block)
+			self._full_rows[start:end] = np.arange(start, end)
+		self.names = names
+		self.rows = {name: row for row, name in enumerate(names)}
+		self._size = len(names)
+
+	def _reserve(self, size: int) -> None:
+		super()._reserve(size)
+		if self._errors is None or len(self._errors) < len(self._matrix):
+			capacity = len(self._matrix)
+			if self._errors is None:
+				self._errors = np.empty(capacity, dtype=np.float32)
+				self._full_rows = np.empty(capacity, dtype=np.int64)
+			else:
+				self._errors, self._full_rows = self._grow(self._errors, capacity), self._grow(self._full_rows, capacity)
+
+	def _store(self, rows, encodings: np.ndarray) -> None:
+		codes = np.clip(np.rint(encodings / self.scale), -127, 127).astype(np.int8)
+		dequantized = codes * self.scale
+		self._matrix[rows] = codes
+		self._norms[rows] = _row_norms(dequantized)
+		self._errors[rows] = np.sqrt(_row_norms(encodings - dequantized))
+
+	def _full_precision(self, rows: np.ndarray) -> np.ndarray:
+		""" The full precision encodings of `rows`, with a single read of the gallery. """
+		full_rows = self._full_rows[rows]
+		on_disk = full_rows >= 0
+		encodings = np.empty((len(rows), ENCODING_SIZE), dtype=np.float32)
+		if on_disk.any():
+			encodings[on_disk] = self._full[full_rows[on_disk]]
+		for position in np.flatnonzero(~on_disk):
+			encodings[position] = self._extra[self.names[rows[position]]]
+		return encodings
+
+	def extend(self, names, encodings, train: bool=True) -> None:
+		# Always a full scan, so there is no index to train
+		encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+		self._reserve(self._size + len(names))
+		for name, encoding in zip(names, encodings):
+			row = self.rows.get(name)
+			if row is None:
+				row = self._size
+				self.rows[name] = row
+				self.names.append(name)
+				self._size += 1
+			self._store([row], encoding[None, :])
+			self._full_rows[row] = -1
+			self._extra[name] = encoding
+
+	def remove(self, name: str) -> bool:
+		row = self.rows.get(name)
+		if row is None:
+			return False
+		last = self._size - 1
+		self._errors[row] = self._errors[last]
+		self._full_rows[row] = self._full_rows[last]
+		self._extra.pop(name, None)
+		return super().remove(name)
+
+	def close(self) -> None:
+		self._full = None
+		self._extra = {}
+		super().close()
+
+	def _approximate_squared(self, probes: np.ndarray) -> np.ndarray:
+		""" Squared distances from the probes to every dequantized row. """
+		scaled = probes * self.scale
+		dots = np.empty((len(probes), self._size), dtype=np.float32)
+		for start in range(0, self._size, self.block_rows):
+			end = min(start + self.block_rows, self._size)
+			dots[:, start:end] = scaled @ self._matrix[start:end].astype(np.float32).T
+		dots *= -2
+		dots += self._norms[:self._size]
+		dots += _row_norms(probes)[:, None]
+		return np.maximum(dots, 0, out=dots)
+
+	def distances(self, probes) -> np.ndarray:
+		""" Approximate distance from every probe encoding to every known face. """
+		probes = np.asarray(probes, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+		return np.sqrt(self._approximate_squared(probes))
+
+	def match(self, probes) -> list:
+		probes = np.asarray(probes, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+		if not len(probes):
+			return []
+		if not self._size:
+			return [Match(-1, "Unknown", float("inf"), float("inf")) for _ in probes]
+
+		distances = np.sqrt(self._approximate_squared(probes))
+		# Every row that might really be within the threshold of a probe gets its exact
+		# distance, with a little room for float32 rounding in the approximate one
+		close = distances - self._errors[:self._size] < self.threshold + 1e-5
+		rerank = np.flatnonzero(close.any(axis=0))
+		if len(rerank):
+			full = self._full_precision(rerank)
+			for probe, row_distances, probe_close in zip(probes, distances, close[:, rerank]):
+				row_distances[rerank[probe_close]] = np.linalg.norm(probe - full[probe_close], axis=1)
+
+		matches = []
+		for row_distances in distances:
+
+			if self._size == 1:
+				best = [0]
+			else:
+				best = np.argpartition(row_distances, 1)[:2]
+				best = best[np.argsort(row_distances[best])]
+			row = int(best[0])
+			distance = float(row_distances[row])
+			runner_up = float(row_distances[best[1]]) if len(best) > 1 else float("inf")
+			name = self.names[row] if distance < self.threshold else "Unknown"
+			matches.append(Match(row, name, distance, runner_up))
+		return matches
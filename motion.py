@@ -0,0 +1,56 @@
+import cv2 as cv
+import numpy as np
+
+
+class MotionGate:
+	""" Decides whether a frame is worth running face detection on, by comparing a small
+	blurred greyscale copy of it against a slowly updated background. When too few pixels
+	have changed the scene is treated as static and detection can be skipped.
+
+	`sensitivity` is the fraction of pixels that must change for a frame to count as motion,
+	and `pixel_threshold` how much (0-255) a pixel must differ to count as changed. A frame is
+	let through regardless at least every `force_interval` seconds, so a face that arrived
+	without enough motion to trip the gate is still found. """
+
+	def __init__(self, sensitivity: float=0.01, pixel_threshold: int=25, force_interval: float=2.0,
+			width: int=160, background_rate: float=0.05):
+		self.sensitivity = sensitivity
+		self.pixel_threshold = pixel_threshold
+		self.force_interval = force_interval
+		self.width = width
+		self.background_rate = background_rate
+		self.background = None
+		self.last_passed = None
+		self.motion = 1.0  # Fraction of pixels that changed in the last frame checked
+		self.frames_seen = 0
+		self.frames_gated = 0
+
+	@property
+	def gated_fraction(self) -> float:
+		return self.frames_gated / self.frames_seen if self.frames_seen else 0.0
+
+	def _prepare(self, image: np.ndarray) -> np.ndarray:
+		scale = self.width / image.shape[1]
+		small = cv.resize(image, (0, 0), fx=scale, fy=scale, interpolation=cv.INTER_AREA)
+		gray = cv.cvtColor(small, cv.COLOR_BGR2GRAY)
+		return cv.GaussianBlur(gray, (5, 5), 0).astype(np.float32)
+
+	def check(self, image: np.ndarray, now: float) -> bool:
+		""" Returns True when detection should run on this BGR frame. """
+		self.frames_seen += 1
+		gray = self._prepare(image)
+		if self.background is None or self.background.shape != gray.shape:
+			self.background = gray
+			self.last_passed = now
+			return True
+
+		changed = np.count_nonzero(cv.absdiff(gray, self.background) > self.pixel_threshold)
+		self.motion = changed / gray.size
+		cv.accumulateWeighted(gray, self.background, self.background_rate)
+
+		if changed >= self.sensitivity * gray.size or now - self.last_passed >= self.force_interval:
+			self.last_passed = now
+			return True
+
+		self.frames_gated += 1
+		return False
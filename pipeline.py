@@ -0,0 +1,129 @@
+import multiprocessing
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from time import monotonic
+
+import numpy as np
+
+from encoding_pool import _warm_up_worker
+from tracking import box_iou
+
+# A frame as it leaves the capture stage. `seq` increases by one per captured frame and
+# `captured_at` is the time.time() it was read, so later stages can tell how stale it is
+Frame = namedtuple('Frame', ['seq', 'captured_at', 'image'])
+
+
+class DropOldestQueue:
+	""" A bounded, thread safe queue that never blocks the producer. When it is full the
+	oldest item is thrown away to make room, so a slow consumer always gets the most recent
+	items rather than a growing backlog. With maxsize=1 it holds just the latest item. """
+
+	def __init__(self, maxsize: int=1):
+		self._items = deque(maxlen=maxsize)
+		self._not_empty = threading.Condition()
+		self._empty = threading.Condition(self._not_empty)
+		self.dropped = 0
+
+	def put(self, item) -> None:
+		with self._not_empty:
+			if len(self._items) == self._items.maxlen:
+				self.dropped += 1
+			self._items.append(item)
+			self._not_empty.notify()
+
+	def get(self, timeout: float=None):
+		""" Returns the oldest item, or None if nothing arrived within `timeout` seconds. """
+		with self._not_empty:
+			if not self._items and not self._not_empty.wait_for(lambda: self._items, timeout):
+				return None
+			item = self._items.popleft()
+			self._empty.notify_all()
+			return item
+
+	def get_nowait(self):
+		with self._not_empty:
+			if not self._items:
+				return None
+			item = self._items.popleft()
+			self._empty.notify_all()
+			return item
+
+	def wait_until_empty(self, timeout: float=None) -> bool:
+		""" Lets a producer that must not lose items wait for the consumer to take the last
+		one. Returns False if it is still there after `timeout` seconds. """
+		with self._empty:
+			return self._empty.wait_for(lambda: not self._items, timeout)
+
+	def __len__(self):
+		return len(self._items)
+
+
+class LatencyStats:
+	""" Keeps the last `window` latency samples, in seconds, and summarises them. """
+
+	def __init__(self, window: int=300):
+		self._samples = deque(maxlen=window)
+		self._lock = threading.Lock()
+		self.count = 0
+		self.started = monotonic()
+
+	def record(self, seconds: float) -> None:
+		with self._lock:
+			self._samples.append(seconds)
+			self.count += 1
+
+	def summary(self) -> dict:
+		with self._lock:
+			samples = np.array(self._samples)
+			count = self.count
+		elapsed = monotonic() - self.started
+		if not len(samples):
+			return {'count': count, 'fps': 0.0}
+		return {
+			'count': count,
+			'fps': count / elapsed if elapsed else 0.0,
+			'mean_ms': 1000 * float(samples.mean()),
+			'p50_ms': 1000 * float(np.percentile(samples, 50)),
+			'p95_ms': 1000 * float(np.percentile(samples, 95)),
+			'max_ms': 1000 * float(samples.max()),
+		}
+
+
+def detect_faces(rgb_frame: np.ndarray, skip_boxes=(), skip_iou: float=0.5):
+	""" Finds every face in an RGB frame and encodes it. Returns the face locations and their
+	encodings, in the same order. Faces overlapping one of `skip_boxes` by at least `skip_iou`
+	are already known, so they aren't encoded and get None instead. """
+	import face_recognition
+	face_locations = face_recognition.face_locations(rgb_frame)
+	to_encode = [
+		location for location in face_locations
+		if not any(box_iou(location, box) >= skip_iou for box in skip_boxes)
+	]
+	encoded = dict(zip(to_encode, face_recognition.face_encodings(rgb_frame, to_encode)))
+	return face_locations, [encoded.get(location) for location in face_locations]
+
+
+class RecognitionPool:
+	""" Worker processes running face detection and encoding on frames, so recognition can
+	use more than one core. Results come back through futures in whatever order the workers
+	finish, so callers have to put them back in frame order themselves. """
+
+	def __init__(self, workers: int):
+		self.workers = workers
+		self._executor = None
+
+	def start(self) -> None:
+		self._executor = ProcessPoolExecutor(
+			max_workers=self.workers,
+			mp_context=multiprocessing.get_context('spawn'),
+			initializer=_warm_up_worker,
+		)
+
+	def shutdown(self) -> None:
+		if self._executor is not None:
+			self._executor.shutdown(wait=True, cancel_futures=True)
+			self._executor = None
+
+	def submit(self, rgb_frame: np.ndarray, skip_boxes=()):
+		return self._executor.submit(detect_faces, rgb_frame, skip_boxes)
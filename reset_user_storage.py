@@ -1,11 +1,17 @@
 import shutil
 from pathlib import Path
 
+from shared_gallery import SharedGallery
+
 def reset_user_storage():
     # Define paths
     base_path = Path(__file__).parent
     user_storage_directory = base_path / 'known_users'
     storage_data_file = base_path / 'user_storage.dat'
+    storage_journal_file = base_path / 'user_storage.dat.journal'
+    gallery_index_file = base_path / 'gallery_index.dat'
+    gallery_matrix_file = base_path / 'gallery_matrix.dat'
+    gallery_projection_file = base_path / 'gallery_projection.dat'
     key_file = base_path / 'encryption.key'
     iv_file = base_path / 'encryption.iv'
 
@@ -14,12 +20,18 @@ def reset_user_storage():
         shutil.rmtree(user_storage_directory)
         print(f"Deleted directory: {user_storage_directory}")
 
-    # Remove data files
-    for file in [storage_data_file, key_file, iv_file]:
+    # Remove data files, and anything left half written, which would otherwise be renamed
+    # over the fresh files or replayed on top of them
+    temp_files = list(base_path.glob('*.tmp'))
+    for file in [storage_data_file, storage_journal_file, gallery_index_file, gallery_matrix_file,
+                 gallery_projection_file, key_file, iv_file] + temp_files:
         if file.exists():
             file.unlink()
             print(f"Deleted file: {file}")
 
+    # Remove the decrypted gallery frontends share in memory
+    SharedGallery().unlink()
+
 if __name__ == '__main__':
     reset_user_storage()
     print("User storage has been reset.")
@@ -1,12 +1,14 @@
 from pathlib import Path
 import pickle
 import logging
+import os
+import tempfile
 
-from quart import Blueprint, render_template, flash, redirect, request, url_for, current_app
+from quart import Blueprint, render_template, flash, redirect, request, url_for, current_app, jsonify
 from werkzeug.utils import secure_filename
 import face_recognition
 
-from storage import UserStorage
+from enrollment import EnrollmentQueueFull
 
 logger = logging.getLogger()
 
@@ -21,7 +23,7 @@ front_end_blueprint = HTMLBluePrint('front_end', __name__)
 @front_end_blueprint.route("/", methods=["POST", "GET"])
 async def manage_users():
 
-    user_storage = UserStorage()
+    user_storage = current_app.extensions["user_storage"]
 
     # When handling a simple GET request, simply render the blank
     # form ready for authentication
@@ -38,9 +40,55 @@ async def manage_users():
         # find it
         form_data = await request.form
         username = form_data['username']
-        await user_storage.add_user(
-            username, (await request.files)['image']
-        )
-        await flash(f"User '{username}' added successfully")
+        image = (await request.files)['image']
+        wants_json = request.accept_mimetypes.best == "application/json"
+
+        # Encoding happens in the background, so just save the upload, queue
+        # it and hand back the id of the job
+        try:
+            job_id = await current_app.extensions["enrollment_jobs"].submit(username, image.stream)
+        except EnrollmentQueueFull:
+            # Too many uploads are already waiting, ask the client to come back later
+            if wants_json:
+                return jsonify(error="Enrollment queue is full"), 503, {"Retry-After": "5"}
+            await flash(f"Too many users are being added right now, please try '{username}' again shortly")
+            return await render_template(
+                'backend.html', user_list=await user_storage.list_users()
+            ), 503, {"Retry-After": "5"}
+
+        status_url = url_for("front_end.enrollment_status", job_id=job_id)
+        if wants_json:
+            return jsonify(job_id=job_id, status_url=status_url), 202, {"Location": status_url}
+
+        await flash(f"User '{username}' queued for enrollment (job {job_id})")
+        return redirect(url_for("front_end.manage_users"))
+
+
+@front_end_blueprint.route("/enrollments/<job_id>", methods=["GET"])
+async def enrollment_status(job_id):
+
+    job = current_app.extensions["enrollment_jobs"].get(job_id)
+    if job is None:
+        return jsonify(error=f"Unknown enrollment job '{job_id}'"), 404
+    return jsonify(job)
+
+
+@front_end_blueprint.route("/bulk", methods=["POST"])
+async def bulk_enroll_users():
+
+    # Save the archive to disk so the job can stream entries out of it
+    # instead of holding the whole upload in memory
+    archive = (await request.files)['archive']
+    fd, archive_path = tempfile.mkstemp(suffix=".zip")
+    os.close(fd)
+    await archive.save(archive_path)
+
+    job_id = current_app.extensions["enrollment_jobs"].submit_bulk(
+        Path(archive_path), filename=archive.filename
+    )
+    status_url = url_for("front_end.enrollment_status", job_id=job_id)
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify(job_id=job_id, status_url=status_url), 202, {"Location": status_url}
 
-        return redirect(url_for("front_end.manage_users"))
\ No newline at end of file
+    await flash(f"Bulk enrollment of '{archive.filename}' started (job {job_id})")
+    return redirect(url_for("front_end.manage_users"))
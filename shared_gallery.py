@@ -0,0 +1,209 @@
+import fcntl
+import pickle
+import struct
+import time
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+from pathlib import Path
+
+import numpy as np
+
+from storage import ENCODING_SIZE
+
+
+def _untrack(segment: shared_memory.SharedMemory) -> None:
+	# The resource tracker unlinks every segment a process created or attached to when the
+	# process exits, which would pull the gallery out from under every other frontend. POSIX
+	# segments are registered under their name with the leading slash `name` leaves off
+	resource_tracker.unregister(f"/{segment.name}", "shared_memory")
+
+
+class SharedGalleryView:
+	""" One published version of the gallery, attached without copying. `matrix` and `norms`
+	are read only views straight into the shared segment. """
+
+	def __init__(self, segment: shared_memory.SharedMemory, version: int, rows: int, names_size: int,
+			generation: int, compactions: int):
+		self.segment = segment
+		self.version = version
+		self.generation = generation
+		self.compactions = compactions
+		matrix_size = rows * ENCODING_SIZE * 4
+		self.matrix = np.ndarray((rows, ENCODING_SIZE), dtype=np.float32, buffer=segment.buf)
+		self.norms = np.ndarray((rows,), dtype=np.float32, buffer=segment.buf, offset=matrix_size)
+		self.matrix.flags.writeable = False
+		self.norms.flags.writeable = False
+		names_start = matrix_size + rows * 4
+		self.names = pickle.loads(segment.buf[names_start:names_start + names_size])
+
+	def close(self) -> None:
+		""" Detaches from the segment. The arrays must not be used afterwards. """
+		self.matrix = self.norms = None
+		self.segment.close()
+
+
+class SharedGallery:
+	""" Publishes the decrypted gallery once per host in shared memory, so every frontend
+	process attaches to the same float32 matrix instead of decrypting and holding its own
+	copy.
+
+	A small header segment, `name`, says which version is current. Each version lives in
+	its own segment, `<name>_<version>`, holding the matrix, the squared norm of every row
+	and the pickled user names. A new version is written in full before the header is
+	switched over to it, and the header is written under a sequence counter that is odd
+	while it changes, so readers never attach to a half published gallery. The previous
+	version is unlinked straight away: processes still attached to it keep their mapping
+	until they let go of it.
+
+	The header records the gallery index generation and compaction count the version was
+	built from, which is how a process tells the published gallery is out of date. Only one
+	process should republish at a time, which `lock` arranges through a lock file.
+
+	A header that stays mid-change for `header_retries` attempts was left that way by a
+	publisher that died, and reads as if nothing were published, so the next process to
+	check republishes it. """
+
+	# magic, sequence, version, rows, names size, generation, compactions, segment name
+	header_format = '<4sQQQQQQ64s'
+	header_size = struct.calcsize(header_format)
+	magic = b'FRG1'
+	header_retries = 40
+	max_retry_delay = 0.05
+
+	def __init__(self, name: str="facial_recognition_gallery", lock_path: Path=None):
+		self.name = name
+		self.lock_path = Path(lock_path) if lock_path else Path("/tmp", f"{name}.lock")
+
+	@contextmanager
+	def lock(self):
+		with self.lock_path.open('a') as lock_file:
+			fcntl.flock(lock_file, fcntl.LOCK_EX)
+			try:
+				yield
+			finally:
+				fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+	def _open_header(self, create: bool=False):
+		try:
+			header = shared_memory.SharedMemory(self.name)
+		except FileNotFoundError:
+			if not create:
+				return None
+			header = shared_memory.SharedMemory(self.name, create=True, size=self.header_size)
+			header.buf[:self.header_size] = bytes(self.header_size)
+		_untrack(header)
+		return header
+
+	def read_header(self):
+		""" Returns (version, rows, names size, generation, compactions, segment name) of the
+		current version, or None when nothing has been published. """
+		header = self._open_header()
+		if header is None:
+			return None
+		try:
+			delay = 0.001
+			for _ in range(self.header_retries):
+				fields = struct.unpack_from(self.header_format, header.buf)
+				if fields[1] % 2 == 0 and struct.unpack_from('<Q', header.buf, 4)[0] == fields[1]:
+					break
+				time.sleep(delay)
+				delay = min(2 * delay, self.max_retry_delay)
+			else:
+				return None
+			return self._header_fields(fields)
+		finally:
+			header.close()
+
+	def _header_fields(self, fields):
+		if fields[0] != self.magic:
+			return None
+		return fields[2:7] + (fields[7].rstrip(b'\0').decode(errors='replace'),)
+
+	def version(self):
+		header = self.read_header()
+		return header[0] if header else None
+
+	def publish(self, names: list, encodings, generation: int, compactions: int) -> int:
+		""" Writes the gallery into a new segment and makes it the current version. Returns
+		the new version. """
+		names = list(names)
+		matrix = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+		names_blob = pickle.dumps(names)
+		header = self._open_header(create=True)
+		try:
+			# Whatever the header holds, even if a publisher died while writing it
+			previous = self._header_fields(struct.unpack_from(self.header_format, header.buf))
+		finally:
+			header.close()
+		version = previous[0] + 1 if previous else 1
+
+		matrix_size = matrix.nbytes
+		size = matrix_size + len(matrix) * 4 + len(names_blob)
+		while True:
+			segment_name = f"{self.name}_{version}"
+			try:
+				segment = shared_memory.SharedMemory(segment_name, create=True, size=max(size, 1))
+				break
+			except FileExistsError:
+				# Left behind by a publisher that died before switching the header over
+				version += 1
+		_untrack(segment)
+		try:
+			target = np.ndarray(matrix.shape, dtype=np.float32, buffer=segment.buf)
+			target[:] = matrix
+			norms = np.ndarray((len(matrix),), dtype=np.float32, buffer=segment.buf, offset=matrix_size)
+			np.einsum('ij,ij->i', matrix, matrix, out=norms)
+			segment.buf[matrix_size + len(matrix) * 4:size] = names_blob
+			del target, norms
+		finally:
+			segment.close()
+
+		header = self._open_header(create=True)
+		try:
+			sequence = struct.unpack_from('<Q', header.buf, 4)[0]
+			# Odd when a previous publisher died mid-change, in which case it stays odd
+			sequence += 1 - sequence % 2
+			struct.pack_into('<Q', header.buf, 4, sequence)
+			struct.pack_into(
+				self.header_format, header.buf, 0, self.magic, sequence, version, len(matrix),
+				len(names_blob), generation, compactions, segment_name.encode()
+			)
+			struct.pack_into('<Q', header.buf, 4, sequence + 1)
+		finally:
+			header.close()
+
+		if previous and previous[5] != segment_name:
+			self._unlink_segment(previous[5])
+		return version
+
+	def attach(self):
+		""" Attaches to the current version, or returns None when nothing is published. """
+		while True:
+			header = self.read_header()
+			if header is None:
+				return None
+			version, rows, names_size, generation, compactions, segment_name = header
+			try:
+				segment = shared_memory.SharedMemory(segment_name)
+			except FileNotFoundError:
+				# Replaced by a newer version between reading the header and attaching
+				continue
+			_untrack(segment)
+			return SharedGalleryView(segment, version, rows, names_size, generation, compactions)
+
+	@staticmethod
+	def _unlink_segment(segment_name: str) -> None:
+		try:
+			segment = shared_memory.SharedMemory(segment_name)
+		except (FileNotFoundError, ValueError):
+			return
+		segment.close()
+		# Left tracked, as unlinking unregisters the segment from the tracker again
+		segment.unlink()
+
+	def unlink(self) -> None:
+		""" Removes the published gallery from the host. """
+		header = self.read_header()
+		if header:
+			self._unlink_segment(header[5])
+		self._unlink_segment(self.name)
@@ -1,26 +1,73 @@
 from pathlib import Path
+import base64
 import pickle
 import asyncio
-import face_recognition
+import contextlib
+import fcntl
+import functools
+import uuid
+import aiofiles
 from io import BytesIO
 from typing import Any
 import os
+import shutil
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from cryptography.exceptions import InvalidTag
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from werkzeug.datastructures import FileStorage
 import numpy as np
 
+from encoding_pool import DEFAULT_MAX_DETECT_SIZE, encode_image_file
+
+# Length of a face encoding, as face_recognition computes them
+ENCODING_SIZE = 128
+
+# Precision new encodings are stored in, "float32" halves their size on disk. Read from the
+# environment here, so the backend, command line enrollment and the frontend's backfill all
+# write the same one. An existing gallery matrix keeps its precision until it is emptied
+ENCODING_STORAGE_DTYPE = np.dtype(os.environ.get("ENCODING_STORAGE_DTYPE", "float64"))
+
 class PickleStorage():
 	""" Caches data to disk as a pickle for quickly reading/writing/storing small chunks of
-	information. """
+	information.
+
+	With `read_cache` enabled the unpickled object is kept in memory and only reloaded
+	when the file's mtime/size changes or this process writes to it, so repeated reads
+	cost a single stat. Objects returned from a cached read are shared between callers
+	and must be copied before being modified.
+
+	File I/O goes through aiofiles and CPU heavy work (pickling, crypto, face encoding)
+	runs on a shared thread pool of `max_io_workers` threads, so none of it blocks the
+	event loop. Call `configure()` before first use to change the pool size. """
 	default_value=None
 	default_id = None
+	base_path = Path(__file__).parent
+	read_cache = False
+	max_io_workers = 4
+	_executor = None
+	# asyncio locks guarding read-modify-write sequences, keyed by file path
+	_path_locks = {}
 
-	def __init__(self, *args,  on_create: callable=None, **kwargs):
+	# Shared by every instance so storage objects created per request still hit
+	# the cache. Maps a file path to ((mtime_ns, size), unpickled object)
+	_read_cache_entries = {}
+
+	def __init__(self, *args,  on_create: callable=None, base_path: Path=None, read_cache: bool=None, **kwargs):
 		if self.default_id:
 			self.cache_id = self.default_id
 		else:
 			self.cache_id = args[0]
 		self.on_create = on_create
+		if base_path:
+			self.base_path = Path(base_path)
+		if read_cache is not None:
+			self.read_cache = read_cache
+		self.cache_hits = 0
+		self.cache_misses = 0
 
 
 	@property
@@ -58,9 +105,9 @@ class PickleStorage():
 				if self.on_create:
 					self.on_create(cache=self)
 				else:
-					asyncio.create_task(
-						self.write(self.default_value)
-					)
+					# Written there and then, as a task could still be pending when the event
+					# loop closes. The default is small enough not to hold up the loop
+					self._write_default_if_missing(path_obj)
 				return False
 			else:
 				return True
@@ -76,48 +123,429 @@ class PickleStorage():
 
 
 	def get_relative_path(self, path: str):
-		return Path(Path(__file__).parent, path)
+		return Path(self.base_path, path)
 
 
 	async def cache_reset(self, *args, **kwargs):
 		await self.write(self.default_value)
 
 
+	@classmethod
+	def configure(cls, max_io_workers: int=None) -> None:
+		if max_io_workers:
+			PickleStorage.max_io_workers = max_io_workers
+		if PickleStorage._executor is not None:
+			PickleStorage._executor.shutdown(wait=False)
+			PickleStorage._executor = None
+
+
+	@classmethod
+	def get_executor(cls) -> ThreadPoolExecutor:
+		if PickleStorage._executor is None:
+			PickleStorage._executor = ThreadPoolExecutor(
+				max_workers=PickleStorage.max_io_workers, thread_name_prefix="storage"
+			)
+		return PickleStorage._executor
+
+
+	async def run_blocking(self, fn: callable, *args, **kwargs):
+		""" Runs a blocking function on the storage thread pool. """
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(
+			self.get_executor(), functools.partial(fn, *args, **kwargs)
+		)
+
+
+	def path_lock(self, path: Path) -> asyncio.Lock:
+		return self._path_locks.setdefault(path, asyncio.Lock())
+
+
+	@contextlib.asynccontextmanager
+	async def process_lock(self, lock_path: Path):
+		""" Holds `lock_path` against every other task in this process and, through an
+		fcntl lock on the file, against every other process. """
+		async with self.path_lock(lock_path):
+			lock_path.parent.mkdir(parents=True, exist_ok=True)
+			with lock_path.open('a') as lock_file:
+				await self.run_blocking(fcntl.flock, lock_file, fcntl.LOCK_EX)
+				try:
+					yield
+				finally:
+					fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+	def cache_info(self) -> dict:
+		return {'hits': self.cache_hits, 'misses': self.cache_misses}
+
+
+	@staticmethod
+	def _file_signature(cache_path: Path):
+		try:
+			stat = cache_path.stat()
+		except FileNotFoundError:
+			return None
+		return (stat.st_mtime_ns, stat.st_size)
+
+
+	def _write_default_if_missing(self, cache_path: Path) -> None:
+		# Another process may write real data at the same time, which must not be
+		# clobbered, so the default is linked into place only if nothing is there yet
+		tmp_path = cache_path.with_name(f"{cache_path.name}.{uuid.uuid4().hex}.tmp")
+		try:
+			tmp_path.write_bytes(pickle.dumps(self.default_value))
+			os.link(tmp_path, cache_path)
+		except FileExistsError:
+			pass
+		finally:
+			tmp_path.unlink(missing_ok=True)
+
+
 	async def read(self, *args, filename: str =None, **kwargs):
 
 		cache_path = self.get_path_to_cache(filename)
+		signature = None
+		if self.read_cache:
+			signature = self._file_signature(cache_path)
+			cached = self._read_cache_entries.get(cache_path)
+			if signature is not None and cached is not None and cached[0] == signature:
+				self.cache_hits += 1
+				return cached[1]
+			self.cache_misses += 1
+
 		self._ensure_path_exists(cache_path)
 
 		try:
-			with Path(cache_path).open('rb') as f:
-				d = f.read()
-			return pickle.loads(d)
+			async with aiofiles.open(cache_path, 'rb', executor=self.get_executor()) as f:
+				d = await f.read()
+			data = await self.run_blocking(pickle.loads, d)
 
 		# Probably means that the file hasn't been written to
 		# disc yet
 		except (FileNotFoundError, EOFError):
 			return self.default_value
 
+		# The signature is taken before reading, so a write racing with this read
+		# can only make the entry look stale, never fresh
+		if signature is not None:
+			self._read_cache_entries[cache_path] = (signature, data)
+		return data
+
 
 	async def write(self, data:Any, *args, filename: str = None, **kwargs):
 
 		cache_path = self.get_path_to_cache(filename)
-		self._ensure_path_exists(cache_path)
-		with Path(cache_path).open('wb') as f:
-			f.write(pickle.dumps(data))
+		cache_path.parent.mkdir(parents=True, exist_ok=True)
+		d = await self.run_blocking(pickle.dumps, data)
+
+		# Write beside the target and rename over it, so a concurrent read never
+		# sees a half written pickle
+		tmp_path = cache_path.with_name(f"{cache_path.name}.{uuid.uuid4().hex}.tmp")
+		try:
+			async with aiofiles.open(tmp_path, 'wb', executor=self.get_executor()) as f:
+				await f.write(d)
+			os.replace(tmp_path, cache_path)
+		except BaseException:
+			tmp_path.unlink(missing_ok=True)
+			raise
+		self._read_cache_entries.pop(cache_path, None)
+
+
+class JournaledStorage(PickleStorage):
+	""" A PickleStorage holding a dict, where each change is appended to a journal file
+	next to the pickle instead of rewriting the whole dict. Reads replay the journal on
+	top of the last snapshot, and once the journal grows past `compact_threshold` bytes
+	it is folded into a new snapshot that atomically replaces the old one.
+
+	Replaying a journal over a snapshot that already contains it gives the same result,
+	so a crash between replacing the snapshot and removing the journal loses nothing.
+	Several processes may write to the same store: appends, compactions and rewrites all
+	hold `lock`, so none of them can fold the journal away under another's append. """
+
+	default_value = {}
+	journaled = True
+	compact_threshold = 1 << 20
+	_record_header = struct.Struct('>I')
+
+	# Maps a journal path to (snapshot, journal signature, replayed offset, state)
+	_replay_cache_entries = {}
+	# Maps a journal path to the (inode, size) this process last left it at
+	_journal_ends = {}
+
+	def get_journal_path(self) -> Path:
+		cache_path = self.get_path_to_cache()
+		return cache_path.with_name(cache_path.name + '.journal')
 
+	def lock(self):
+		cache_path = self.get_path_to_cache()
+		return self.process_lock(cache_path.with_name(cache_path.name + '.lock'))
 
-class UserStorage(PickleStorage):
+	def _replay_journal(self, journal_path: Path, state: dict, offset: int=0) -> int:
+		""" Applies every complete record after `offset` to `state` and returns the
+		offset just past the last one. A torn record at the end is ignored. """
+		try:
+			with journal_path.open('rb') as f:
+				f.seek(offset)
+				data = f.read()
+		except FileNotFoundError:
+			return 0
+
+		position = 0
+		for start, position in self._record_spans(data):
+			op, key, value = pickle.loads(data[start:position])
+			if op == 'set':
+				state[key] = value
+			else:
+				state.pop(key, None)
+		return offset + position
+
+	@classmethod
+	def _record_spans(cls, data: bytes):
+		""" Yields the (start, end) of the pickle in every complete record in `data`,
+		stopping at a torn record. """
+		position = 0
+		header_size = cls._record_header.size
+		while position + header_size <= len(data):
+			(length,) = cls._record_header.unpack_from(data, position)
+			record_end = position + header_size + length
+			if record_end > len(data):
+				return
+			yield position + header_size, record_end
+			position = record_end
+
+	def _truncate_torn_record(self, f) -> None:
+		""" Cuts a record left half-written by a crash off the end of the open journal,
+		so the next append starts on a record boundary. Called with `lock` held. """
+		stat = os.fstat(f.fileno())
+		if self._journal_ends.get(f.name) == (stat.st_ino, stat.st_size):
+			# Nothing was appended since our own last complete write
+			return
+		f.seek(0)
+		data = f.read()
+		end = 0
+		for _, end in self._record_spans(data):
+			pass
+		if end < len(data):
+			f.truncate(end)
+
+	async def read(self, *args, filename: str =None, **kwargs):
+		snapshot = await super().read(*args, filename=filename, **kwargs)
+		if filename or not self.journaled:
+			return snapshot
+
+		journal_path = self.get_journal_path()
+		signature = self._file_signature(journal_path)
+		if signature is None:
+			return snapshot
+
+		cached = self._replay_cache_entries.get(journal_path)
+		if cached and cached[0] is snapshot and signature[1] >= cached[2]:
+			if cached[1] == signature:
+				return cached[3]
+			# Same snapshot and the journal only grew, so just replay the tail
+			state = dict(cached[3])
+			offset = await self.run_blocking(self._replay_journal, journal_path, state, cached[2])
+		else:
+			state = dict(snapshot)
+			offset = await self.run_blocking(self._replay_journal, journal_path, state)
+
+		# Only worth caching when the snapshot itself is cached and so keeps its identity
+		if self.read_cache:
+			self._replay_cache_entries[journal_path] = (snapshot, signature, offset, state)
+		return state
+
+	async def write(self, data:Any, *args, filename: str = None, **kwargs):
+		if filename or not self.journaled:
+			return await super().write(data, *args, filename=filename, **kwargs)
+
+		journal_path = self.get_journal_path()
+		async with self.lock():
+			await super().write(data, *args, **kwargs)
+			journal_path.unlink(missing_ok=True)
+			self._replay_cache_entries.pop(journal_path, None)
+
+	def _write_records(self, journal_path: Path, records: list) -> int:
+		data = bytearray()
+		for op, key, value in records:
+			record = pickle.dumps((op, key, value))
+			data += self._record_header.pack(len(record)) + record
+		with journal_path.open('a+b') as f:
+			self._truncate_torn_record(f)
+			f.write(data)
+			f.flush()
+			os.fsync(f.fileno())
+			self._journal_ends[f.name] = (os.fstat(f.fileno()).st_ino, f.tell())
+			return f.tell()
+
+	async def _append_records(self, records: list) -> None:
+		journal_path = self.get_journal_path()
+		journal_path.parent.mkdir(parents=True, exist_ok=True)
+		async with self.lock():
+			journal_size = await self.run_blocking(self._write_records, journal_path, records)
+
+		if journal_size > self.compact_threshold:
+			await self.compact()
+
+	async def set_item(self, key, value) -> None:
+		if not self.journaled:
+			async with self.path_lock(self.get_path_to_cache()):
+				store = dict(await self.read())
+				store[key] = value
+				return await self.write(store)
+		await self._append_records([('set', key, value)])
+
+	async def set_items(self, items: dict) -> None:
+		""" Sets many keys with a single journal append (or a single rewrite). """
+		if not self.journaled:
+			async with self.path_lock(self.get_path_to_cache()):
+				store = dict(await self.read())
+				store.update(items)
+				return await self.write(store)
+		await self._append_records([('set', key, value) for key, value in items.items()])
+
+	async def delete_item(self, key) -> None:
+		if not self.journaled:
+			async with self.path_lock(self.get_path_to_cache()):
+				store = dict(await self.read())
+				store.pop(key, None)
+				return await self.write(store)
+		await self._append_records([('delete', key, None)])
+
+	def _write_snapshot(self, cache_path: Path, state: dict) -> None:
+		tmp_path = cache_path.with_name(cache_path.name + '.tmp')
+		try:
+			with tmp_path.open('wb') as f:
+				f.write(pickle.dumps(state))
+				f.flush()
+				os.fsync(f.fileno())
+			os.replace(tmp_path, cache_path)
+		except BaseException:
+			tmp_path.unlink(missing_ok=True)
+			raise
+
+	async def compact(self) -> None:
+		""" Folds the journal into a new snapshot, written beside the old one and renamed
+		over it, then removes the journal. """
+		cache_path = self.get_path_to_cache()
+		journal_path = self.get_journal_path()
+		async with self.lock():
+			# Another process may have changed either file within their timestamp resolution
+			self._read_cache_entries.pop(cache_path, None)
+			self._replay_cache_entries.pop(journal_path, None)
+			state = dict(await self.read())
+			await self.run_blocking(self._write_snapshot, cache_path, state)
+			self._read_cache_entries.pop(cache_path, None)
+			journal_path.unlink(missing_ok=True)
+			self._replay_cache_entries.pop(journal_path, None)
+
+
+class UserStorage(JournaledStorage):
 	""" Used to store and retrieve information related to users on the system. """
 
 	default_id = "user_storage.dat"
 	default_value = {}
+	read_cache = True
 	key_file = 'encryption.key'
 	iv_file = 'encryption.iv'
+	# Face encoding can take seconds per image, so cap how many enrollments may hold
+	# storage threads at once and keep the rest of the pool free for reads
+	max_concurrent_encodings = 2
+	_encoding_semaphore = None
+	# Longest side of the copy face detection runs on when there is no encoding pool
+	max_detect_size = DEFAULT_MAX_DETECT_SIZE
+	# Precision new encodings are saved in. Either can be read back, as the two differ in size
+	encoding_dtype = ENCODING_STORAGE_DTYPE
 	
-	def __init__(self, *args, **kwargs):
+	def __init__(self, *args, encoding_pool=None, **kwargs):
 		super().__init__(*args, **kwargs)
+		self.encoding_pool = encoding_pool
 		self.load_keys()
+		self.gallery = GalleryStore(base_path=self.base_path, key=self.encryption_key)
+		self.gallery.listeners.append(self._on_gallery_change)
+
+		# In memory copies of the store and the gallery, filled by `warm_up`, and the store
+		# files' signatures and gallery index they were last brought up to date with
+		self.users = None
+		self.encodings = None
+		self._store_seen = None
+		self._gallery_seen = None
+
+	def _store_signature(self) -> tuple:
+		return self._file_signature(self.get_path_to_cache()), self._file_signature(self.get_journal_path())
+
+	async def warm_up(self) -> None:
+		""" Loads every user and encoding into memory. From then on lookups are answered from
+		memory, and every change made through this instance is applied to it as well, so a
+		long lived instance never has to unpickle the store again. Changes made by other
+		processes, such as a bulk enrollment from the command line, are picked up by
+		`refresh`, which every lookup calls first. """
+		# Signatures are taken before reading, so a change racing with the read is read again
+		self._store_seen = self._store_signature()
+		users = dict(await self.read())
+		await self._load_encodings()
+		self.users = users
+
+	async def _load_encodings(self) -> None:
+		self._gallery_seen = await self.gallery.read_index()
+		names, matrix = await self.gallery.load()
+		self.encodings = dict(zip(names, await self.run_blocking(np.asarray, matrix)))
+
+	async def refresh(self) -> None:
+		""" Brings the in-memory copies up to date with changes made by other processes. Costs
+		a couple of stats when nothing changed, and only decrypts the encodings that did. """
+		if self.users is None:
+			return
+		signature = self._store_signature()
+		if signature != self._store_seen:
+			self._store_seen = signature
+			self.users = dict(await self.read())
+
+		known = self._gallery_seen
+		index = await self.gallery.read()
+		if (index.get('generation', 0), index.get('compactions', 0)) == (known['generation'], known['compactions']):
+			return
+		index = await self.gallery.read_index()
+		if index['compactions'] != known['compactions']:
+			return await self._load_encodings()
+
+		added = [name for name, row in index['rows'].items() if known['rows'].get(name) != row]
+		try:
+			encodings = await self.gallery.read_encodings(index, added)
+		except ValueError:
+			# Compacted while being read, so every row has moved
+			return await self._load_encodings()
+		for username in known['rows']:
+			if username not in index['rows']:
+				self.encodings.pop(username, None)
+		self.encodings.update(zip(added, encodings))
+		self._gallery_seen = index
+
+	def _on_gallery_change(self, added: dict, removed: list) -> None:
+		if self.encodings is None:
+			return
+		for username in removed:
+			self.encodings.pop(username, None)
+		self.encodings.update(added)
+
+	async def _get_users(self) -> dict:
+		if self.users is None:
+			return await self.read()
+		await self.refresh()
+		return self.users
+
+	async def set_item(self, key, value) -> None:
+		await super().set_item(key, value)
+		if self.users is not None:
+			self.users[key] = value
+
+	async def set_items(self, items: dict) -> None:
+		await super().set_items(items)
+		if self.users is not None:
+			self.users.update(items)
+
+	async def delete_item(self, key) -> None:
+		await super().delete_item(key)
+		if self.users is not None:
+			self.users.pop(key, None)
 	
 	def load_keys(self):
 		# Check if key and IV exist
@@ -135,71 +563,487 @@ class UserStorage(PickleStorage):
 			with open(self.iv_file, 'wb') as ivfile:
 				ivfile.write(self.iv)
 		
+		self.encryption_key = encryption_key
 		self.fernet = Fernet(encryption_key)
 
-	async def add_user(self, username: str, io_stream: BytesIO, *args, **kwargs) -> None:
-			user_dir = self.get_relative_path(f"known_users/{username}")
-			user_dir.mkdir(exist_ok=True, parents=True)
-			img_path = user_dir.joinpath("img.jpg")
+	@classmethod
+	def get_encoding_semaphore(cls) -> asyncio.Semaphore:
+		if UserStorage._encoding_semaphore is None:
+			UserStorage._encoding_semaphore = asyncio.Semaphore(cls.max_concurrent_encodings)
+		return UserStorage._encoding_semaphore
 
+	async def encode_image(self, img_path: Path):
+		""" Encodes on the process pool when one was given, otherwise on a storage thread.
+		Assumes one face per image for simplicity. """
+		if self.encoding_pool is not None:
+			return await self.encoding_pool.encode(img_path)
+		async with self.get_encoding_semaphore():
+			return await self.run_blocking(encode_image_file, str(img_path), self.max_detect_size)
+
+	async def save_user_image(self, username: str, io_stream: BytesIO) -> Path:
+		user_dir = self.get_relative_path(f"known_users/{username}")
+		user_dir.mkdir(exist_ok=True, parents=True)
+		img_path = user_dir.joinpath("img.jpg")
+
+		io_stream.seek(0)
+		async with aiofiles.open(img_path, "wb", executor=self.get_executor()) as write_file:
+			await write_file.write(io_stream.read())
+		return img_path
+
+	async def save_user_encoding(self, username: str, user_image_encoding: np.ndarray) -> str:
+		""" Encrypts the encoding into the user's folder and returns the path to it. """
+		encrypted_encoding = await self.run_blocking(
+			self.fernet.encrypt, np.asarray(user_image_encoding, dtype=self.encoding_dtype).tobytes()
+		)
+		encoding_path = self.get_relative_path(f"known_users/{username}/encoding.dat")
+		async with aiofiles.open(encoding_path, "wb", executor=self.get_executor()) as encoding_file:
+			await encoding_file.write(encrypted_encoding)
+		return str(encoding_path)
+
+	async def add_user(self, username: str, io_stream: BytesIO, *args, **kwargs) -> bool:
+			""" Saves the user's image and encoding. Returns whether a face was found. """
 			# Write the image file
-			with img_path.open("wb") as write_file:
-				io_stream.seek(0)
-				write_file.write(io_stream.read())
-			
+			img_path = await self.save_user_image(username, io_stream)
+			return await self.enroll_image(username, img_path)
+
+	async def enroll_image(self, username: str, img_path: Path) -> bool:
+			""" Encodes an image already saved for the user and stores the encoding. Returns
+			whether a face was found. """
 			# Load image to create encoding
-			user_image = face_recognition.load_image_file(str(img_path))
-			user_image_encoding = face_recognition.face_encodings(user_image)
-			if user_image_encoding:
-				user_image_encoding = user_image_encoding[0]  # assuming one face per image for simplicity
+			user_image_encoding = await self.encode_image(img_path)
+
+			if user_image_encoding is not None:
 				# Encrypt the face encoding
-				encrypted_encoding = self.fernet.encrypt(user_image_encoding.tobytes())
-				encoding_path = user_dir.joinpath("encoding.dat")
-				with encoding_path.open("wb") as encoding_file:
-					encoding_file.write(encrypted_encoding)
-				encoding_path_str = str(encoding_path)
+				encoding_path_str = await self.save_user_encoding(username, user_image_encoding)
+				await self.gallery.append(username, user_image_encoding)
 			else:
 				encoding_path_str = None
+				await self.gallery.remove(username)
 
-			# Store details in pickle
-			store = await self.read()
-			store[username] = {
+			# Store details in the journal
+			await self.set_item(username, {
 				'img_path': str(img_path),
 				'encoding_path': encoding_path_str
-			}
-			await self.write(store)
+			})
+			return encoding_path_str is not None
+
+	async def remove_user(self, username: str, *args, **kwargs) -> None:
+		await self.delete_item(username)
+		await self.gallery.remove(username)
+		await self.run_blocking(
+			shutil.rmtree, self.get_relative_path(f"known_users/{username}"), ignore_errors=True
+		)
+
+	def _decrypt_encoding_file(self, encoding_path: Path) -> np.ndarray:
+		with Path(encoding_path).open('rb') as file:
+			encrypted_encoding = file.read()
+
+		decrypted_encoding = self.fernet.decrypt(encrypted_encoding)
+		dtype = np.float32 if len(decrypted_encoding) == ENCODING_SIZE * 4 else np.float64
+		return np.frombuffer(decrypted_encoding, dtype=dtype)
 
 	async def get_user_encoding(self, username: str) -> np.ndarray:
+		if self.encodings is not None:
+			await self.refresh()
+			return self.encodings.get(username)
+
 		store = await self.read()
 		user_info = store.get(username)
-		if not user_info or 'encoding_path' not in user_info:
+		if not user_info or not user_info.get('encoding_path'):
 			return None
 		
 		encoding_path = Path(user_info['encoding_path'])
 		if not encoding_path.exists():
 			return None
 		
-		with encoding_path.open('rb') as file:
-			encrypted_encoding = file.read()
-		
-		decrypted_encoding = self.fernet.decrypt(encrypted_encoding)
-		face_encoding = np.frombuffer(decrypted_encoding, dtype=np.float64)
-		return face_encoding
+		return await self.run_blocking(self._decrypt_encoding_file, encoding_path)
 
+	async def get_all_encodings(self, usernames: list=None, max_workers: int=None):
+		""" Reads the user store once and decrypts the encodings of every user (or only
+		`usernames`), optionally spread across a thread pool.
 
-	async def get_user_image(self, username: str, *args, **kwargs) -> bytes:
+		Returns the names that were loaded, their encodings stacked into an (N x 128) array
+		and a dict mapping each user that could not be loaded to the reason why. """
 		store = await self.read()
-		img_path_str = store.get(username, None)
-		if not img_path_str:
+		if usernames is None:
+			usernames = [k for k, v in store.items() if 'encoding_path' in v]
+
+		def _load(username):
+			user_info = store.get(username)
+			try:
+				if not user_info or not user_info.get('encoding_path'):
+					raise LookupError(f"No face encoding stored for '{username}'")
+				return username, self._decrypt_encoding_file(user_info['encoding_path']), None
+			except Exception as e:
+				return username, None, e
+
+		def _load_all():
+			if max_workers and max_workers > 1:
+				with ThreadPoolExecutor(max_workers=max_workers) as pool:
+					return list(pool.map(_load, usernames))
+			return [_load(username) for username in usernames]
+
+		results = await self.run_blocking(_load_all)
+
+		names, encodings, failures = [], [], {}
+		for username, encoding, error in results:
+			if error is not None:
+				failures[username] = error
+			else:
+				names.append(username)
+				encodings.append(encoding)
+
+		if encodings:
+			stacked = np.stack(encodings)
+		else:
+			stacked = np.empty((0, ENCODING_SIZE), dtype=np.float64)
+		return names, stacked, failures
+
+
+	async def get_user_image(self, username: str, *args, **kwargs) -> bytes:
+		store = await self._get_users()
+		user_info = store.get(username, None)
+		if not user_info:
 			return None
 
-		img_path = Path(img_path_str)
-		with img_path.open("rb") as f:
-			data = f.read()
+		img_path = Path(user_info['img_path'])
+		async with aiofiles.open(img_path, "rb", executor=self.get_executor()) as f:
+			data = await f.read()
 		return data
 
 
 	async def list_users(self, *args, **kwargs):
-		store = await self.read()
+		store = await self._get_users()
 		return [(k, v['img_path'], v['encoding_path']) for k, v in store.items() if 'encoding_path' in v]
 
+
+
+class GalleryMatrix:
+	""" The live rows of the encrypted gallery matrix, in the same order as the names they
+	were loaded with. Indexing it decrypts only the rows asked for, straight out of the
+	memory-mapped file, and converting it to an array decrypts all of them. Reading a row
+	that fails to authenticate raises ValueError. """
+
+	def __init__(self, records: np.ndarray, rows: np.ndarray, names: list, dtype, aead: AESGCM):
+		self.records = records
+		self.rows = rows
+		self.names = names
+		self.dtype = np.dtype(dtype)
+		self.aead = aead
+
+	def __len__(self) -> int:
+		return len(self.rows)
+
+	@property
+	def shape(self) -> tuple:
+		return (len(self.rows), ENCODING_SIZE)
+
+	def decrypt_rows(self, rows) -> np.ndarray:
+		""" Decrypts the given rows of the matrix file into an (N x 128) array. """
+		rows = np.atleast_1d(rows)
+		decrypted = np.empty((len(rows), ENCODING_SIZE), dtype=self.dtype)
+		for position, row in enumerate(rows):
+			record = self.records[row]
+			try:
+				plaintext = self.aead.decrypt(
+					record[:GalleryStore.nonce_size].tobytes(), record[GalleryStore.nonce_size:],
+					GalleryStore.row_aad(int(row), self.names[row])
+				)
+			except InvalidTag:
+				raise ValueError(f"Gallery row {row} failed to decrypt") from None
+			decrypted[position] = np.frombuffer(plaintext, dtype=self.dtype)
+		return decrypted
+
+	def __getitem__(self, key):
+		columns = ()
+		if isinstance(key, tuple):
+			key, columns = key[0], key[1:]
+		if isinstance(key, (int, np.integer)):
+			decrypted = self.decrypt_rows([self.rows[key]])[0]
+		else:
+			decrypted = self.decrypt_rows(self.rows[key])
+		return decrypted[columns] if columns else decrypted
+
+	def __array__(self, dtype=None, copy=None):
+		decrypted = self.decrypt_rows(self.rows)
+		return decrypted if dtype is None else decrypted.astype(dtype, copy=False)
+
+	def close(self) -> None:
+		self.records = None
+
+
+class GalleryStore(PickleStorage):
+	""" Keeps every known face encoding in one contiguous matrix file, with a small pickled
+	index mapping each row to its user name. The matrix is only ever appended to, and
+	readers memory-map it instead of opening a file per user.
+
+	Every row is encrypted on its own with AES-GCM, under a key derived from the user
+	store's key, and authenticated together with its row number and user name so rows
+	can't be swapped between users. Readers decrypt only the rows they use. A gallery
+	written in plaintext before rows were encrypted is encrypted the first time its index
+	is read.
+
+	The index also counts changes in `generation` and compactions in `compactions`, so
+	other processes can tell the gallery changed from the index alone. Its `dtype` is the
+	precision the matrix is stored in, which is `dtype` when the gallery is created and
+	float64 for galleries from before it was recorded.
+
+	The backend, the CLI and frontends backfilling the gallery may all write to it, so
+	every change is made under `lock`, which also holds off other processes, and starts by
+	reading the index afresh. Once dead rows, left behind by re-enrolled and removed users,
+	make up `compact_dead_fraction` of the matrix, the change that got it there compacts it
+	before letting go of the lock. """
+
+	default_id = "gallery_index.dat"
+	default_value = {
+		'names': [], 'rows': {}, 'generation': 0, 'compactions': 0, 'dtype': 'float64', 'encrypted': True
+	}
+	read_cache = True
+	matrix_file = "gallery_matrix.dat"
+	projection_file = "gallery_projection.dat"
+	lock_file = "gallery.lock"
+	dtype = ENCODING_STORAGE_DTYPE
+	nonce_size = 12
+	tag_size = 16
+	compact_dead_fraction = 0.25
+	# Small galleries are cheap to read with their dead rows, and compacting makes every
+	# frontend rebuild its matcher
+	compact_min_dead_rows = 64
+
+	def __init__(self, *args, key: bytes, **kwargs):
+		super().__init__(*args, **kwargs)
+		# Derived rather than reused, so the user store's key only ever serves Fernet
+		matrix_key = HKDF(
+			algorithm=hashes.SHA256(), length=32, salt=None, info=b"gallery matrix"
+		).derive(base64.urlsafe_b64decode(key))
+		self.aead = AESGCM(matrix_key)
+		# Called as listener(added, removed) after every change this instance makes, where
+		# `added` maps user names to their new encodings and `removed` lists user names
+		self.listeners = []
+
+	def _notify(self, added: dict, removed: list) -> None:
+		for listener in self.listeners:
+			listener(added, removed)
+
+	def row_bytes(self, index: dict):
+		return ENCODING_SIZE * np.dtype(index['dtype']).itemsize
+
+	def record_bytes(self, index: dict):
+		""" Size of one encrypted row in the matrix file: nonce, ciphertext and tag. """
+		return self.nonce_size + self.row_bytes(index) + self.tag_size
+
+	@staticmethod
+	def row_aad(row: int, username: str) -> bytes:
+		return struct.pack('>Q', row) + username.encode()
+
+	def get_matrix_path(self) -> Path:
+		return self.get_relative_path(self.matrix_file)
+
+	def lock(self):
+		""" Holds the gallery against every other writer, in this process and others. """
+		return self.process_lock(self.get_relative_path(self.lock_file))
+
+	@staticmethod
+	def _copy_index(index: dict) -> dict:
+		# Callers mutate the index, so never hand out the cached or default object
+		return {
+			'names': list(index['names']), 'rows': dict(index['rows']),
+			'generation': index.get('generation', 0), 'compactions': index.get('compactions', 0),
+			'dtype': index.get('dtype', 'float64'),
+			# An empty gallery has nothing in plaintext, whatever its index says
+			'encrypted': index.get('encrypted', False) or not index['names']
+		}
+
+	async def read_index(self) -> dict:
+		index = self._copy_index(await self.read())
+		if not index['encrypted']:
+			async with self.lock():
+				index = await self._read_index_locked()
+		return index
+
+	async def _read_index_locked(self) -> dict:
+		""" Reads the index while holding `lock`, encrypting a plaintext matrix first if it
+		is still one. The cached index is skipped, as another process may have written a new
+		one within the file's timestamp resolution. """
+		self._read_cache_entries.pop(self.get_path_to_cache(), None)
+		index = self._copy_index(await self.read())
+		if not index['encrypted']:
+			index = await self._encrypt_plaintext(index)
+		return index
+
+	async def _encrypt_plaintext(self, index: dict) -> dict:
+		""" Replaces a plaintext matrix with an encrypted one, leaving out its dead rows. """
+		matrix_path = self.get_matrix_path()
+		live_names, records = [], b''
+		if matrix_path.exists():
+			plaintext = np.memmap(
+				matrix_path, dtype=index['dtype'], mode='r', shape=(len(index['names']), ENCODING_SIZE)
+			)
+			live_names = [name for name in index['names'] if name is not None]
+			live_rows = [index['rows'][name] for name in live_names]
+			records = await self.run_blocking(self._encrypt_rows, 0, live_names, np.array(plaintext[live_rows]))
+			del plaintext
+		await self.run_blocking(self._replace_matrix, matrix_path, records)
+		index = {
+			'names': live_names,
+			'rows': {name: row for row, name in enumerate(live_names)},
+			'generation': index['generation'],
+			'compactions': index['compactions'] + 1,
+			'dtype': index['dtype'],
+			'encrypted': True
+		}
+		await self.write(index)
+		return index
+
+	async def read_projection(self):
+		""" Returns the matching projection last saved with the gallery, or None. """
+		if not self.get_relative_path(self.projection_file).exists():
+			return None
+		return await self.read(filename=self.projection_file)
+
+	async def write_projection(self, projection: dict) -> None:
+		await self.write(projection, filename=self.projection_file)
+
+	async def append(self, username: str, encoding: np.ndarray) -> int:
+		""" Appends a single encoding to the end of the matrix and points the user's
+		index entry at it. Any previous row for the user is left behind as a dead row. """
+		return (await self.extend([username], [encoding]))[0]
+
+	async def extend(self, usernames: list, encodings, replace: bool=True) -> list:
+		""" Appends a batch of encodings with a single matrix write and a single index
+		write. Returns the row assigned to each user. With `replace` False, users already
+		in the gallery keep the encoding they have, and the row returned is that one. """
+		requested = usernames = list(usernames)
+		encodings = np.asarray(encodings).reshape(-1, ENCODING_SIZE)
+		if len(usernames) != len(encodings):
+			raise ValueError("Each username needs exactly one encoding")
+
+		matrix_path = self.get_matrix_path()
+		async with self.lock():
+			index = await self._read_index_locked()
+			if not replace:
+				new = [position for position, username in enumerate(usernames) if username not in index['rows']]
+				usernames, encodings = [usernames[position] for position in new], encodings[new]
+				if not usernames:
+					return [index['rows'][username] for username in requested]
+			first_row = len(index['names'])
+			if not first_row:
+				# An empty matrix can start over in whatever precision is configured now
+				index['dtype'] = np.dtype(self.dtype).name
+			encodings = np.ascontiguousarray(encodings, dtype=index['dtype'])
+			records = await self.run_blocking(self._encrypt_rows, first_row, usernames, encodings)
+			await self.run_blocking(self._write_rows, matrix_path, first_row * self.record_bytes(index), records)
+
+			for row, username in enumerate(usernames, start=first_row):
+				old_row = index['rows'].get(username)
+				if old_row is not None:
+					index['names'][old_row] = None
+				index['names'].append(username)
+				index['rows'][username] = row
+			index['generation'] += 1
+			await self.write(index)
+			# Compacting moves every row, so the rows handed back come from the index after it
+			index = await self._compact_if_needed(index)
+		self._notify(dict(zip(usernames, encodings)), [])
+		return [index['rows'][username] for username in requested]
+
+	def _encrypt_rows(self, first_row: int, usernames: list, encodings: np.ndarray) -> bytes:
+		""" Encrypts consecutive rows of the matrix starting at `first_row`, each under a
+		fresh random nonce. """
+		nonces = os.urandom(self.nonce_size * len(usernames))
+		records = bytearray()
+		for position, (username, encoding) in enumerate(zip(usernames, encodings)):
+			nonce = nonces[position * self.nonce_size:(position + 1) * self.nonce_size]
+			records += nonce
+			records += self.aead.encrypt(nonce, encoding.tobytes(), self.row_aad(first_row + position, username))
+		return bytes(records)
+
+	def _write_rows(self, matrix_path: Path, offset: int, records: bytes) -> None:
+		with matrix_path.open('ab') as f:
+			# Rows past the end of the index are left over from an interrupted append,
+			# so always write at the row the index expects
+			f.truncate(offset)
+			f.write(records)
+		os.chmod(matrix_path, 0o600)
+
+	async def remove(self, username: str) -> None:
+		await self.remove_many([username])
+
+	async def remove_many(self, usernames: list) -> None:
+		async with self.lock():
+			index = await self._read_index_locked()
+			rows = [index['rows'].pop(username, None) for username in usernames]
+			rows = [row for row in rows if row is not None]
+			if not rows:
+				return
+			for row in rows:
+				index['names'][row] = None
+			index['generation'] += 1
+			await self.write(index)
+			await self._compact_if_needed(index)
+		self._notify({}, list(usernames))
+
+	def _view(self, index: dict, rows) -> GalleryMatrix:
+		records = np.memmap(
+			self.get_matrix_path(), dtype=np.uint8, mode='r',
+			shape=(len(index['names']), self.record_bytes(index))
+		)
+		return GalleryMatrix(records, np.asarray(rows, dtype=np.int64), index['names'], index['dtype'], self.aead)
+
+	async def load(self):
+		""" Returns the live user names and a read only (N x 128) GalleryMatrix over their
+		encodings, which decrypts rows as they are read. """
+		index = await self.read_index()
+		names = index['names']
+		if not names or not self.get_matrix_path().exists():
+			return [], np.empty((0, ENCODING_SIZE), dtype=index['dtype'])
+
+		live_rows = [row for row, name in enumerate(names) if name is not None]
+		return [names[row] for row in live_rows], self._view(index, live_rows)
+
+	async def read_encodings(self, index: dict, usernames: list) -> np.ndarray:
+		""" Decrypts the encodings of a few users out of the matrix, at their rows in `index`. """
+		if not usernames:
+			return np.empty((0, ENCODING_SIZE), dtype=index['dtype'])
+		view = self._view(index, [index['rows'][username] for username in usernames])
+		return await self.run_blocking(np.asarray, view)
+
+	async def compact(self) -> None:
+		""" Rewrites the matrix without dead rows. The new matrix is written beside the
+		old one and renamed over it, so readers never see a half written file. """
+		async with self.lock():
+			await self._compact_locked(await self._read_index_locked())
+
+	async def _compact_if_needed(self, index: dict) -> dict:
+		""" Compacts when enough of the matrix is dead rows. Returns the index as it now is. """
+		dead_rows = len(index['names']) - len(index['rows'])
+		if dead_rows >= max(self.compact_min_dead_rows, self.compact_dead_fraction * len(index['names'])):
+			return await self._compact_locked(index)
+		return index
+
+	async def _compact_locked(self, index: dict) -> dict:
+		live_names = [name for name in index['names'] if name is not None]
+		if len(live_names) == len(index['names']):
+			return index
+
+		view = self._view(index, [index['rows'][name] for name in live_names])
+		live_matrix = await self.run_blocking(np.asarray, view)
+		records = await self.run_blocking(self._encrypt_rows, 0, live_names, live_matrix)
+		await self.run_blocking(self._replace_matrix, self.get_matrix_path(), records)
+		compacted = {
+			'names': live_names,
+			'rows': {name: row for row, name in enumerate(live_names)},
+			'generation': index['generation'],
+			'compactions': index['compactions'] + 1,
+			'dtype': index['dtype'],
+			'encrypted': True
+		}
+		await self.write(compacted)
+		return compacted
+
+	def _replace_matrix(self, matrix_path: Path, records: bytes) -> None:
+		tmp_path = matrix_path.with_suffix('.tmp')
+		with tmp_path.open('wb') as f:
+			f.write(records)
+		os.chmod(tmp_path, 0o600)
+		os.replace(tmp_path, matrix_path)
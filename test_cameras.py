@@ -0,0 +1,87 @@
+import threading
+import unittest
+from time import monotonic
+from types import SimpleNamespace
+
+from cameras import Camera, CameraScheduler
+
+
+def camera(name, motion=0.0):
+    return Camera(name, cap=None, tracker=None, motion_gate=SimpleNamespace(motion=motion), unknown_faces=None)
+
+
+class TestCameraScheduler(unittest.TestCase):
+    """
+    Tests which camera recognition is given a frame from next.
+    """
+    def setUp(self):
+        self.cameras = [camera('a', motion=0.1), camera('b', motion=0.5), camera('c', motion=0.0)]
+
+    def queue_frames(self, *names):
+        for cam in self.cameras:
+            if cam.name in names:
+                cam.recognition_queue.put(f'{cam.name} frame')
+
+    def serve(self, scheduler, count):
+        """ The names of the next `count` cameras served, with every camera always having a frame. """
+        served = []
+        for _ in range(count):
+            self.queue_frames('a', 'b', 'c')
+            cam = scheduler.next_camera(timeout=0)
+            cam.recognition_queue.get_nowait()
+            served.append(cam.name)
+        return served
+
+    def test_round_robin(self):
+        scheduler = CameraScheduler(self.cameras)
+        self.assertEqual(self.serve(scheduler, 5), ['a', 'b', 'c', 'a', 'b'])
+
+    def test_only_waiting(self):
+        """ Cameras without a frame waiting are passed over. """
+        scheduler = CameraScheduler(self.cameras)
+        self.queue_frames('c')
+        self.assertEqual(scheduler.next_camera(timeout=0).name, 'c')
+        self.assertIsNone(CameraScheduler([camera('d')]).next_camera(timeout=0))
+
+    def test_motion(self):
+        """ The camera with the most motion goes first, unless another has waited too long. """
+        scheduler = CameraScheduler(self.cameras, schedule="motion", max_wait=1.0)
+        self.assertEqual(self.serve(scheduler, 3), ['b', 'b', 'b'])
+
+        self.cameras[2].last_served = monotonic() - 2.0
+        self.assertEqual(self.serve(scheduler, 2), ['c', 'b'])
+
+    def test_wakes_on_notify(self):
+        """ Waiting for a frame ends as soon as capture queues one. """
+        scheduler = CameraScheduler(self.cameras)
+
+        def capture():
+            self.queue_frames('b')
+            scheduler.notify()
+        threading.Timer(0.05, capture).start()
+        started = monotonic()
+        self.assertEqual(scheduler.next_camera(timeout=5).name, 'b')
+        self.assertLess(monotonic() - started, 4)
+
+        started = monotonic()
+        self.cameras[1].recognition_queue.get_nowait()
+        self.assertIsNone(scheduler.next_camera(timeout=0.05))
+        self.assertGreaterEqual(monotonic() - started, 0.04)
+
+    def test_finished(self):
+        """ Done once every source ran out and its last frame was taken. """
+        scheduler = CameraScheduler(self.cameras)
+        for cam in self.cameras:
+            cam.capture_done.set()
+        self.queue_frames('a')
+        self.assertFalse(scheduler.finished)
+        self.cameras[0].recognition_queue.get_nowait()
+        self.assertTrue(scheduler.finished)
+
+    def test_unknown_schedule(self):
+        with self.assertRaises(ValueError):
+            CameraScheduler(self.cameras, schedule="random")
+
+
+if __name__ == '__main__':
+    unittest.main()
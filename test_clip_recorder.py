@@ -0,0 +1,123 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import cv2 as cv
+import numpy as np
+
+from clip_recorder import ClipRecorder, FrameRing
+
+
+def frame(value, size=(64, 48)):
+    """ A flat grey frame, so which frame ended up where can be told from a single pixel. """
+    return np.full((size[1], size[0], 3), value, dtype=np.uint8)
+
+
+class TestFrameRing(unittest.TestCase):
+
+    def test_push(self):
+        """ Frames are downscaled into the ring and overwrite the oldest once it is full. """
+        ring = FrameRing(3, size=(32, 24))
+        self.assertEqual(ring.latest_time, -np.inf)
+        for i in range(5):
+            ring.push(frame(i * 10, (64, 48)), captured_at=float(i))
+
+        self.assertEqual(ring.seq, 4)
+        self.assertEqual(ring.latest_time, 4.0)
+        self.assertEqual(ring.frames.shape, (3, 24, 32, 3))
+        self.assertEqual(ring.slots_between(0.0, 10.0), [(2, 2), (3, 0), (4, 1)])
+        self.assertEqual(ring.slots_between(3.0, 3.5), [(3, 0)])
+        self.assertEqual(ring.frames[1, 0, 0, 0], 40)
+        self.assertEqual(ring.memory_bytes, 3 * 24 * 32 * 3 + 3 * 8 + 3 * 8)
+
+
+class TestClipRecorder(unittest.TestCase):
+    """
+    Tests recording clips from before to after an event out of the frame ring.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name, "clips")
+        self.recorder = ClipRecorder(self.path, pre_seconds=1.0, post_seconds=1.0, fps=10, size=(64, 48), slack_seconds=1.0)
+
+    def tearDown(self):
+        self.recorder.stop()
+        self.directory.cleanup()
+
+    def capture(self, start, end, fps=32):
+        """ Feeds the recorder frames at `fps` from `start` to `end`, each as bright as its time.
+        At 32 fps every fourth frame is due, so 8 frames a second are kept. """
+        for i in range(int(round((end - start) * fps))):
+            now = start + i / fps
+            self.recorder.add_frame(frame(int(now * 10) % 256), now)
+
+    def read_clip(self, path):
+        video = cv.VideoCapture(str(path))
+        frames = []
+        while True:
+            ok, image = video.read()
+            if not ok:
+                break
+            frames.append(image)
+        video.release()
+        return frames
+
+    def test_sampling(self):
+        """ Frames are kept at most `fps` times a second, and the ring never grows. """
+        self.assertEqual(self.recorder.ring.capacity, 31)
+        memory = self.recorder.memory_bytes
+        self.capture(1000.0, 1010.0)
+        self.assertEqual(self.recorder.ring.seq + 1, 80)
+        self.assertEqual(self.recorder.memory_bytes, memory)
+
+    def test_clip(self):
+        """ A clip covers `pre_seconds` before the event to `post_seconds` after it. """
+        self.recorder.start()
+        self.capture(1000.0, 1002.0)
+        self.recorder.trigger(1001.5)
+        # Folded into the clip already being recorded
+        self.recorder.trigger(1002.0)
+        self.capture(1002.0, 1004.0)
+        self.recorder.stop()
+
+        clips = sorted(self.path.glob("*.mp4"))
+        self.assertEqual(len(clips), 1)
+        frames = self.read_clip(clips[0])
+        self.assertEqual(len(frames), 17)
+        self.assertEqual(frames[0].shape, (48, 64, 3))
+        self.assertEqual(self.recorder.stats()['written'], 1)
+        self.assertEqual(self.recorder.stats()['truncated'], 0)
+
+    def test_stop_writes_pending(self):
+        """ A clip still waiting for its last frames is written with what was captured. """
+        self.recorder.start()
+        self.capture(1000.0, 1001.0)
+        self.recorder.trigger(1000.8)
+        self.recorder.stop()
+        self.assertEqual(len(list(self.path.glob("*.mp4"))), 1)
+
+    def test_overwritten(self):
+        """ Frames overwritten before the writer got to them cut the clip short. """
+        self.path.mkdir()
+        self.capture(1000.0, 1002.0)
+        stale = self.recorder.ring.slots_between(1000.0, 1002.0)
+        self.capture(1002.0, 1005.0)
+        with mock.patch.object(self.recorder.ring, 'slots_between', return_value=stale):
+            self.recorder._write(1000.0, 1002.0)
+        self.assertEqual(self.recorder.truncated, 1)
+        self.assertEqual(self.recorder.written, 1)
+
+    def test_max_clips(self):
+        self.recorder.max_clips = 2
+        self.path.mkdir()
+        for event in (1001.5, 1004.5, 1007.5):
+            self.capture(event - 1.5, event + 1.5)
+            self.recorder._write(event - 1.0, event + 1.0)
+        clips = sorted(path.name for path in self.path.glob("*.mp4"))
+        self.assertEqual(len(clips), 2)
+        self.assertEqual(self.recorder.written, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+
+import numpy as np
+
+from denial_dedup import UnknownFaceCache
+
+
+class TestUnknownFaceCache(unittest.TestCase):
+    """
+    Tests that each unknown face is only reported once while it stays in view.
+    """
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        # Far enough apart that no two of them are within the threshold
+        self.faces = rng.normal(0, 0.5, (8, 128))
+
+    def test_same_face(self):
+        """ A face seen again, even slightly changed, is remembered; a different one is not. """
+        cache = UnknownFaceCache(ttl=10)
+        self.assertFalse(cache.seen(self.faces[0], now=0.0))
+        self.assertTrue(cache.seen(self.faces[0] + 0.01, now=1.0))
+        self.assertFalse(cache.seen(self.faces[1], now=1.0))
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        self.assertEqual(len(cache), 2)
+
+    def test_expiry(self):
+        """ A face not seen for `ttl` seconds is forgotten. """
+        cache = UnknownFaceCache(ttl=10, buckets=10)
+        cache.seen(self.faces[0], now=0.0)
+        self.assertTrue(cache.seen(self.faces[0], now=9.0))
+        # Seeing it at 9 pushed its expiry back, so it is still there at 15
+        self.assertTrue(cache.seen(self.faces[0], now=15.0))
+        self.assertFalse(cache.seen(self.faces[0], now=30.0))
+        self.assertEqual(len(cache), 1)
+
+    def test_long_gap(self):
+        """ Every entry expires when far more than `ttl` passes between calls. """
+        cache = UnknownFaceCache(ttl=10, buckets=10)
+        for face in self.faces[:4]:
+            cache.seen(face, now=0.0)
+        self.assertFalse(cache.seen(self.faces[4], now=1000.0))
+        self.assertEqual(len(cache), 1)
+
+    def test_eviction(self):
+        """ When full, the faces closest to expiring make room for new ones. """
+        cache = UnknownFaceCache(ttl=10, capacity=3, buckets=10)
+        for now, face in enumerate(self.faces[:3]):
+            cache.seen(face, now=float(now))
+        self.assertFalse(cache.seen(self.faces[3], now=3.0))
+
+        self.assertEqual(len(cache), 3)
+        self.assertTrue(cache.seen(self.faces[3], now=3.5))
+        self.assertTrue(cache.seen(self.faces[2], now=3.5))
+        self.assertFalse(cache.seen(self.faces[0], now=3.5))
+
+    def test_clear(self):
+        cache = UnknownFaceCache()
+        cache.seen(self.faces[0], now=0.0)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertFalse(cache.seen(self.faces[0], now=0.1))
+
+
+if __name__ == '__main__':
+    unittest.main()
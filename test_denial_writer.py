@@ -0,0 +1,92 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+import cv2 as cv
+import numpy as np
+
+from denial_writer import DenialWriter
+
+
+class TestDenialWriter(unittest.TestCase):
+    """
+    Tests that denial captures are written in the background and kept within the disk budget.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name, "denials")
+        self.image = np.random.default_rng(0).integers(0, 256, (120, 160, 3), dtype=np.uint8)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, writer, count, **kwargs):
+        writer.start()
+        try:
+            for i in range(count):
+                self.assertTrue(writer.submit(self.image, captured_at=1700000000.0 + i, **kwargs))
+        finally:
+            writer.stop()
+
+    def files(self):
+        return sorted(os.listdir(self.path))
+
+    def test_write(self):
+        """ Every capture is saved, named after when it was captured and its label. """
+        writer = DenialWriter(self.path, image_format="webp", quality=80)
+        self.write(writer, 3, label="cam1")
+        files = self.files()
+        self.assertEqual(len(files), 3)
+        self.assertTrue(all(name.endswith("_cam1_%06d.webp" % i) for i, name in enumerate(files)))
+        saved = cv.imread(str(self.path / files[0]))
+        self.assertEqual(saved.shape, self.image.shape)
+        self.assertEqual(writer.stats()['written'], 3)
+
+    def test_crop(self):
+        """ With `crop_faces` only the face and its margin are saved. """
+        writer = DenialWriter(self.path, crop_faces=True, crop_margin=0.5)
+        self.write(writer, 1, box=(40, 100, 80, 60))
+        saved = cv.imread(str(self.path / self.files()[0]))
+        self.assertEqual(saved.shape, (80, 80, 3))
+
+    def test_file_budget(self):
+        """ The oldest captures are deleted to stay within `max_files`. """
+        writer = DenialWriter(self.path, max_files=3)
+        self.write(writer, 5)
+        files = self.files()
+        self.assertEqual(len(files), 3)
+        self.assertTrue(files[0].endswith("_000002.jpg"))
+        stats = writer.stats()
+        self.assertEqual((stats['written'], stats['evicted'], stats['files']), (5, 2, 3))
+
+    def test_byte_budget(self):
+        """ Captures already on disk at startup count towards `max_bytes` and go first. """
+        self.path.mkdir()
+        old = self.path / "old.jpg"
+        old.write_bytes(bytes(50000))
+        os.utime(old, (0, 0))
+        writer = DenialWriter(self.path, max_bytes=60000)
+        self.write(writer, 4)
+
+        self.assertFalse(old.exists())
+        stats = writer.stats()
+        self.assertLessEqual(stats['bytes'], 60000)
+        self.assertEqual(stats['bytes'], sum(path.stat().st_size for path in self.path.iterdir()))
+        self.assertEqual(stats['files'], len(self.files()))
+
+    def test_queue_full(self):
+        """ Captures are dropped rather than waited on when the queue is full. """
+        writer = DenialWriter(self.path, queue_size=2)
+        # Not started, so nothing takes captures off the queue
+        results = [writer.submit(self.image, captured_at=0.0) for _ in range(4)]
+        self.assertEqual(results, [True, True, False, False])
+        self.assertEqual(writer.stats()['dropped'], 2)
+
+    def test_unsupported_format(self):
+        with self.assertRaises(ValueError):
+            DenialWriter(self.path, image_format="bmp")
+
+
+if __name__ == '__main__':
+    unittest.main()
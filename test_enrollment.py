@@ -0,0 +1,199 @@
+import asyncio
+import os
+import tempfile
+import unittest
+import zipfile
+from io import BytesIO
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+from encoding_pool import EncodingQueueFull
+from enrollment import EnrollmentJobs, EnrollmentQueueFull, bulk_enroll, iter_enrollment_images
+from storage import UserStorage
+
+
+class EnrollmentTestCase(unittest.IsolatedAsyncioTestCase):
+    """
+    A UserStorage in a temporary directory whose "images" are the bytes b'face <seed>',
+    encoded to a random encoding from that seed, or b'nobody', which has no face in it.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.base_path = Path(self.directory.name)
+        for attribute in ('key_file', 'iv_file'):
+            patcher = mock.patch.object(UserStorage, attribute, str(self.base_path / attribute))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.storage = UserStorage(base_path=self.base_path)
+        self.storage.encode_image = self.encode_image
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    @staticmethod
+    def encoding(seed):
+        return np.random.default_rng(seed).normal(0, 0.1, 128)
+
+    async def encode_image(self, img_path):
+        image = Path(img_path).read_bytes()
+        await asyncio.sleep(0)
+        if image == b'nobody':
+            return None
+        if image == b'broken':
+            raise RuntimeError("Corrupt image")
+        return self.encoding(int(image.split()[1]))
+
+    async def assertEnrolled(self, expected):
+        """ The gallery holds exactly the users in `expected`, a dict of username to seed. """
+        names, matrix = await self.storage.gallery.load()
+        self.assertEqual(sorted(names), sorted(expected))
+        for name, encoding in zip(names, np.asarray(matrix)):
+            np.testing.assert_array_equal(encoding, self.encoding(expected[name]))
+
+
+class TestEnrollmentJobs(EnrollmentTestCase):
+    """
+    Tests that queued enrollments run in the background and report how they went.
+    """
+    async def asyncSetUp(self):
+        self.jobs = EnrollmentJobs(self.storage, workers=2, max_queue_size=4)
+
+    async def asyncTearDown(self):
+        await self.jobs.stop()
+
+    async def submit(self, username, image):
+        return await self.jobs.submit(username, BytesIO(image))
+
+    async def test_lifecycle(self):
+        """ Jobs wait as queued until a worker runs them, then end up done, no-face or failed. """
+        done = await self.submit('alice', b'face 1')
+        no_face = await self.submit('bob', b'nobody')
+        failed = await self.submit('carol', b'broken')
+        self.assertEqual([self.jobs.get(job_id)['status'] for job_id in (done, no_face, failed)], [EnrollmentJobs.QUEUED] * 3)
+        self.assertIsNone(self.jobs.get(done)['finished'])
+
+        self.jobs.start()
+        await asyncio.wait_for(self.jobs._queue.join(), timeout=5)
+        self.assertEqual(self.jobs.get(done)['status'], EnrollmentJobs.DONE)
+        self.assertEqual(self.jobs.get(no_face)['status'], EnrollmentJobs.NO_FACE)
+        self.assertEqual(self.jobs.get(failed)['status'], EnrollmentJobs.FAILED)
+        self.assertEqual(self.jobs.get(failed)['error'], "Corrupt image")
+        self.assertIsNotNone(self.jobs.get(done)['finished'])
+
+        await self.assertEnrolled({'alice': 1})
+        users = await self.storage.read()
+        self.assertIsNone(users['bob']['encoding_path'])
+        self.assertNotIn('carol', users)
+
+    async def test_encoding_pool_full(self):
+        """ A job waits for room in the encoding pool instead of failing. """
+        self.jobs.queue_full_delay = 0
+        busy = [EncodingQueueFull(), EncodingQueueFull()]
+
+        async def encode_image(img_path):
+            if busy:
+                raise busy.pop()
+            return await self.encode_image(img_path)
+        self.storage.encode_image = encode_image
+
+        job_id = await self.submit('alice', b'face 1')
+        self.jobs.start()
+        await asyncio.wait_for(self.jobs._queue.join(), timeout=5)
+        self.assertEqual(self.jobs.get(job_id)['status'], EnrollmentJobs.DONE)
+        self.assertEqual(busy, [])
+        await self.assertEnrolled({'alice': 1})
+
+    async def test_queue_full(self):
+        """ Submitting to a full queue is refused without saving the image. """
+        for i in range(4):
+            await self.submit(f'user{i}', b'face %d' % i)
+        with self.assertRaises(EnrollmentQueueFull):
+            await self.submit('late', b'face 9')
+        self.assertFalse((self.base_path / 'known_users' / 'late').exists())
+
+    async def test_history(self):
+        """ Only the most recent jobs are remembered. """
+        self.jobs.max_history = 2
+        job_ids = [await self.submit(f'user{i}', b'face %d' % i) for i in range(3)]
+        self.assertIsNone(self.jobs.get(job_ids[0]))
+        self.assertEqual(self.jobs.get(job_ids[2])['username'], 'user2')
+
+
+class TestBulkEnroll(EnrollmentTestCase):
+    """
+    Tests enrolling every image in a directory or zip archive.
+    """
+    images = {'alice.jpg': b'face 1', 'bob.PNG': b'face 2', 'carol.jpeg': b'nobody', 'notes.txt': b'face 3'}
+
+    def write_directory(self):
+        source = self.base_path / 'upload'
+        source.mkdir()
+        for filename, image in self.images.items():
+            (source / filename).write_bytes(image)
+        (source / 'nested.jpg').mkdir()
+        return source
+
+    def write_archive(self):
+        source = self.base_path / 'upload.zip'
+        with zipfile.ZipFile(source, 'w') as archive:
+            for filename, image in self.images.items():
+                archive.writestr(f'people/{filename}', image)
+            archive.writestr('people/empty/', b'')
+        return source
+
+    def test_iter_images(self):
+        """ Only image files are picked up, named after the file, from a folder or an archive. """
+        for source in (self.write_directory(), self.write_archive()):
+            images = {username: read() for username, read in iter_enrollment_images(source)}
+            self.assertEqual(images, {'alice': b'face 1', 'bob': b'face 2', 'carol': b'nobody'})
+
+        with self.assertRaises(ValueError):
+            list(iter_enrollment_images(self.base_path / 'upload' / 'notes.txt'))
+
+    async def test_unsafe_names(self):
+        """ Usernames are made safe to use as a folder name, and files that make none are skipped. """
+        self.images = {'Jane Doe.jpg': b'face 1', '...jpg': b'face 2', '.._.png': b'face 3', '日本.jpg': b'face 4'}
+        for source in (self.write_directory(), self.write_archive()):
+            self.assertEqual(
+                sorted((name, read is None) for name, read in iter_enrollment_images(source)),
+                [('...jpg', True), ('.._.png', True), ('Jane_Doe', False), ('日本.jpg', True)]
+            )
+
+        summary = await bulk_enroll(self.base_path / 'upload.zip', self.storage)
+        self.assertEqual(summary['enrolled'], 1)
+        self.assertEqual(summary['images'], 1)
+        self.assertEqual(sorted(summary['skipped']), ['...jpg', '.._.png', '日本.jpg'])
+        await self.assertEnrolled({'Jane_Doe': 1})
+        # Nothing was written outside the users' own folders
+        self.assertEqual(os.listdir(self.base_path / 'known_users'), ['Jane_Doe'])
+        self.assertFalse((self.base_path / 'img.jpg').exists())
+
+    async def test_directory(self):
+        summary = await bulk_enroll(self.write_directory(), self.storage)
+        self.assertEqual(summary['images'], 3)
+        self.assertEqual(summary['enrolled'], 2)
+        self.assertEqual(summary['failed'], {'carol': "No face found"})
+        await self.assertEnrolled({'alice': 1, 'bob': 2})
+        self.assertEqual(sorted(await self.storage.read()), ['alice', 'bob', 'carol'])
+
+    async def test_archive(self):
+        """ Failures only cost their own user, and images wait for room in the pool. """
+        busy = [EncodingQueueFull(), EncodingQueueFull()]
+
+        async def encode_image(img_path):
+            if busy:
+                raise busy.pop()
+            return await self.encode_image(img_path)
+        self.storage.encode_image = encode_image
+        self.images = dict(self.images, **{'dave.jpg': b'broken'})
+
+        summary = await bulk_enroll(self.write_archive(), self.storage, max_in_flight=2, queue_full_delay=0)
+        self.assertEqual(summary['enrolled'], 2)
+        self.assertEqual(summary['failed'], {'carol': "No face found", 'dave': "Corrupt image"})
+        await self.assertEnrolled({'alice': 1, 'bob': 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
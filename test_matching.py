@@ -0,0 +1,138 @@
+import unittest
+
+import numpy as np
+
+from matching import FaceMatcher, Int8Matcher, IVFIndex, PCAIndex
+
+
+def brute_force(names, gallery, probes, threshold=0.6):
+    """ The closest name and distance for every probe, one probe at a time. """
+    results = []
+    for probe in probes:
+        distances = np.linalg.norm(gallery - probe, axis=1)
+        row = int(np.argmin(distances))
+        results.append((names[row] if distances[row] < threshold else "Unknown", float(distances[row])))
+    return results
+
+
+class MatcherTestCase(unittest.TestCase):
+    """
+    A gallery of random encodings, and probes that are either a noisy copy of a known face
+    or nobody in the gallery.
+    """
+    size = 2000
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.gallery = rng.normal(0, 0.1, (self.size, 128)).astype(np.float32)
+        self.names = [f'user{row}' for row in range(self.size)]
+        known = self.gallery[rng.integers(0, self.size, 40)] + rng.normal(0, 0.02, (40, 128))
+        strangers = rng.normal(0, 0.1, (10, 128))
+        self.probes = np.concatenate([known, strangers]).astype(np.float32)
+
+    def assertMatchesBruteForce(self, matcher, names, gallery, exact_distances=True):
+        expected = brute_force(names, gallery, self.probes)
+        matches = matcher.match(self.probes)
+        self.assertEqual([match.name for match in matches], [name for name, _ in expected])
+        for match, (name, distance) in zip(matches, expected):
+            if exact_distances or name != "Unknown":
+                self.assertAlmostEqual(match.distance, distance, places=4)
+
+
+class TestFaceMatcher(MatcherTestCase):
+
+    def test_exact(self):
+        matcher = FaceMatcher(self.names, self.gallery)
+        self.assertMatchesBruteForce(matcher, self.names, self.gallery)
+        np.testing.assert_allclose(
+            matcher.distances(self.probes[:3]),
+            np.linalg.norm(self.gallery[None, :, :] - self.probes[:3, None, :], axis=2), atol=1e-4
+        )
+
+    def test_extend_and_remove(self):
+        """ Adding, replacing and removing users gives the same matches as the gallery they leave. """
+        matcher = FaceMatcher(self.names[:1000], self.gallery[:1000], capacity=1)
+        matcher.extend(self.names[1000:], self.gallery[1000:])
+        replaced = self.gallery[5] + 0.5
+        matcher.add('user5', replaced)
+        for row in range(0, self.size, 7):
+            matcher.remove(f'user{row}')
+        self.assertFalse(matcher.remove('nobody'))
+
+        names = [name for row, name in enumerate(self.names) if row % 7]
+        gallery = np.array([replaced if name == 'user5' else self.gallery[int(name[4:])] for name in names])
+        self.assertEqual(sorted(matcher.names), sorted(names))
+        self.assertMatchesBruteForce(matcher, names, gallery)
+
+    def test_empty(self):
+        matches = FaceMatcher().match(self.probes[:2])
+        self.assertEqual([match.name for match in matches], ["Unknown", "Unknown"])
+
+
+class TestIVFIndex(MatcherTestCase):
+
+    def test_every_list(self):
+        """ Probing every cluster is an exact search. """
+        index = IVFIndex(n_lists=16, n_probe=16)
+        matcher = FaceMatcher(self.names, self.gallery, index=index, exact_below=0)
+        self.assertTrue(matcher.indexed)
+        self.assertMatchesBruteForce(matcher, self.names, self.gallery, exact_distances=False)
+
+    def test_recall(self):
+        """ With the default probes, known faces are still found. """
+        matcher = FaceMatcher(self.names, self.gallery, index=IVFIndex(), exact_below=0)
+        expected = brute_force(self.names, self.gallery, self.probes)
+        found = sum(match.name == name for match, (name, _) in zip(matcher.match(self.probes), expected))
+        self.assertGreaterEqual(found / len(expected), 0.95)
+
+    def test_retrain(self):
+        """ The index asks to be retrained once the gallery has doubled, unless told not to. """
+        matcher = FaceMatcher(self.names[:500], self.gallery[:500], index=IVFIndex(), exact_below=0)
+        matcher.extend(self.names[500:], self.gallery[500:], train=False)
+        self.assertTrue(matcher.needs_training)
+        self.assertEqual(matcher.index.trained_size, 500)
+
+        matcher.extend(self.names[:1], self.gallery[:1])
+        self.assertFalse(matcher.needs_training)
+        self.assertEqual(matcher.index.trained_size, self.size)
+
+
+class TestPCAIndex(MatcherTestCase):
+
+    def test_exact(self):
+        """ Pruning by the projection never loses a match within the threshold. """
+        matcher = FaceMatcher(self.names, self.gallery, index=PCAIndex(), exact_below=0)
+        self.assertTrue(matcher.indexed)
+        self.assertMatchesBruteForce(matcher, self.names, self.gallery, exact_distances=False)
+
+    def test_saved_projection(self):
+        """ A matcher reusing a saved projection matches the same as the one that fitted it. """
+        fitted = PCAIndex()
+        FaceMatcher(self.names, self.gallery, index=fitted, exact_below=0)
+        index = PCAIndex()
+        index.load_projection(fitted.projection)
+        matcher = FaceMatcher(self.names, self.gallery, index=index, exact_below=0)
+        np.testing.assert_array_equal(index.components, fitted.components)
+        self.assertMatchesBruteForce(matcher, self.names, self.gallery, exact_distances=False)
+
+
+class TestInt8Matcher(MatcherTestCase):
+
+    def test_matches(self):
+        """ Decisions are the same as at full precision, with exact distances for matches. """
+        matcher = Int8Matcher(self.names, self.gallery)
+        self.assertEqual(matcher.matrix.dtype, np.int8)
+        self.assertMatchesBruteForce(matcher, self.names, self.gallery, exact_distances=False)
+
+    def test_extend_and_remove(self):
+        matcher = Int8Matcher(self.names[:1500], self.gallery[:1500], block_rows=256)
+        matcher.extend(self.names[1500:], self.gallery[1500:])
+        for row in range(0, self.size, 5):
+            matcher.remove(f'user{row}')
+
+        rows = [row for row in range(self.size) if row % 5]
+        self.assertMatchesBruteForce(matcher, [self.names[row] for row in rows], self.gallery[rows], exact_distances=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+import numpy as np
+
+from motion import MotionGate
+
+
+class TestMotionGate(unittest.TestCase):
+    """
+    Tests that detection is skipped on a static scene but runs when something moves.
+    """
+    def setUp(self):
+        self.scene = np.random.default_rng(0).integers(0, 40, (240, 320, 3), dtype=np.uint8)
+        self.gate = MotionGate(force_interval=2.0)
+
+    def moved(self):
+        frame = self.scene.copy()
+        frame[60:180, 100:220] = 255
+        return frame
+
+    def test_static_scene(self):
+        """ The first frame is let through, then identical frames are gated. """
+        self.assertTrue(self.gate.check(self.scene, now=0.0))
+        for i in range(1, 10):
+            self.assertFalse(self.gate.check(self.scene, now=i * 0.1))
+        self.assertEqual(self.gate.motion, 0.0)
+        self.assertEqual((self.gate.frames_seen, self.gate.frames_gated), (10, 9))
+        self.assertAlmostEqual(self.gate.gated_fraction, 0.9)
+
+    def test_motion(self):
+        self.gate.check(self.scene, now=0.0)
+        self.assertTrue(self.gate.check(self.moved(), now=0.1))
+        self.assertGreater(self.gate.motion, 0.1)
+
+    def test_small_change(self):
+        """ Changes below the sensitivity don't count as motion. """
+        self.gate.check(self.scene, now=0.0)
+        frame = self.scene.copy()
+        frame[0:4, 0:4] = 255
+        self.assertFalse(self.gate.check(frame, now=0.1))
+
+    def test_forced(self):
+        """ A static scene is still let through every `force_interval` seconds. """
+        self.gate.check(self.scene, now=0.0)
+        self.assertFalse(self.gate.check(self.scene, now=1.9))
+        self.assertTrue(self.gate.check(self.scene, now=2.0))
+        self.assertFalse(self.gate.check(self.scene, now=2.1))
+
+    def test_background_catches_up(self):
+        """ Something that arrives and stays put stops counting as motion. """
+        self.gate.check(self.scene, now=0.0)
+        frame = self.moved()
+        passed = [self.gate.check(frame, now=i * 0.01) for i in range(1, 100)]
+        self.assertTrue(passed[0])
+        self.assertFalse(passed[-1])
+
+    def test_resolution_change(self):
+        """ A frame of a different size starts a new background rather than failing. """
+        self.gate.check(self.scene, now=0.0)
+        self.assertTrue(self.gate.check(np.zeros((480, 640, 3), dtype=np.uint8)[:, :320], now=0.1))
+
+
+if __name__ == '__main__':
+    unittest.main()
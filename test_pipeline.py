@@ -0,0 +1,52 @@
+import threading
+import time
+import unittest
+
+from pipeline import DropOldestQueue
+
+
+class TestDropOldestQueue(unittest.TestCase):
+    """
+    Tests the queue between pipeline stages, which drops the oldest items rather than block.
+    """
+    def test_latest_only(self):
+        """ With maxsize=1 the consumer only ever gets the newest item. """
+        items = DropOldestQueue(maxsize=1)
+        for item in range(5):
+            items.put(item)
+        self.assertEqual(len(items), 1)
+        self.assertEqual(items.dropped, 4)
+        self.assertEqual(items.get_nowait(), 4)
+        self.assertIsNone(items.get_nowait())
+
+    def test_order(self):
+        """ Items come out oldest first, after the oldest ones were dropped to make room. """
+        items = DropOldestQueue(maxsize=3)
+        for item in range(5):
+            items.put(item)
+        self.assertEqual([items.get_nowait() for _ in range(3)], [2, 3, 4])
+        self.assertEqual(items.dropped, 2)
+
+    def test_get_timeout(self):
+        items = DropOldestQueue()
+        started = time.monotonic()
+        self.assertIsNone(items.get(timeout=0.05))
+        self.assertGreaterEqual(time.monotonic() - started, 0.04)
+
+    def test_get_waits_for_put(self):
+        items = DropOldestQueue()
+        threading.Timer(0.05, items.put, args=('frame',)).start()
+        self.assertEqual(items.get(timeout=5), 'frame')
+
+    def test_wait_until_empty(self):
+        """ A producer can wait for the consumer to take the last item. """
+        items = DropOldestQueue()
+        self.assertTrue(items.wait_until_empty(timeout=0))
+        items.put('frame')
+        self.assertFalse(items.wait_until_empty(timeout=0.05))
+        threading.Timer(0.05, items.get_nowait).start()
+        self.assertTrue(items.wait_until_empty(timeout=5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import tempfile
+import unittest
+import uuid
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import numpy as np
+
+from shared_gallery import SharedGallery
+
+
+class TestSharedGallery(unittest.TestCase):
+    """
+    Tests publishing the gallery to shared memory and attaching to it.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        name = f"test_gallery_{uuid.uuid4().hex[:8]}"
+        self.shared = SharedGallery(name, lock_path=Path(self.directory.name, "shared.lock"))
+        self.encodings = np.random.default_rng(0).normal(0, 0.1, (3, 128))
+
+    def tearDown(self):
+        self.shared.unlink()
+        self.directory.cleanup()
+
+    def assertUnlinked(self, name):
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(name)
+
+    def test_nothing_published(self):
+        self.assertIsNone(self.shared.read_header())
+        self.assertIsNone(self.shared.version())
+        self.assertIsNone(self.shared.attach())
+
+    def test_publish_and_attach(self):
+        """ An attached view holds the published gallery at float32, with its norms. """
+        self.assertEqual(self.shared.publish(['a', 'b', 'c'], self.encodings, generation=5, compactions=1), 1)
+        view = self.shared.attach()
+        try:
+            self.assertEqual(view.names, ['a', 'b', 'c'])
+            self.assertEqual((view.version, view.generation, view.compactions), (1, 5, 1))
+            self.assertEqual(view.matrix.dtype, np.float32)
+            np.testing.assert_allclose(view.matrix, self.encodings, atol=1e-6)
+            np.testing.assert_allclose(view.norms, (self.encodings ** 2).sum(axis=1), rtol=1e-5)
+            self.assertFalse(view.matrix.flags.writeable)
+        finally:
+            view.close()
+
+    def test_republish(self):
+        """ A new version replaces the old one, whose segment is unlinked while still attached. """
+        self.shared.publish(['a', 'b'], self.encodings[:2], generation=1, compactions=0)
+        old = self.shared.attach()
+        old_segment = self.shared.read_header()[5]
+
+        self.assertEqual(self.shared.publish(['c'], self.encodings[2:], generation=2, compactions=0), 2)
+        self.assertUnlinked(old_segment)
+        # The old mapping stays readable until it is closed
+        self.assertEqual(old.names, ['a', 'b'])
+        np.testing.assert_allclose(old.matrix, self.encodings[:2], atol=1e-6)
+        old.close()
+
+        view = self.shared.attach()
+        self.assertEqual((view.version, view.names), (2, ['c']))
+        view.close()
+
+    def test_empty_gallery(self):
+        self.shared.publish([], np.empty((0, 128)), generation=0, compactions=0)
+        view = self.shared.attach()
+        self.assertEqual((view.names, view.matrix.shape), ([], (0, 128)))
+        view.close()
+
+    def test_unlink(self):
+        """ Unlinking removes both the header and the current version. """
+        self.shared.publish(['a'], self.encodings[:1], generation=1, compactions=0)
+        segment_name = self.shared.read_header()[5]
+        self.shared.unlink()
+        self.assertUnlinked(segment_name)
+        self.assertUnlinked(self.shared.name)
+        self.assertIsNone(self.shared.attach())
+
+
+if __name__ == '__main__':
+    unittest.main()
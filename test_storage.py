@@ -0,0 +1,255 @@
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+from cryptography.fernet import Fernet
+
+from storage import GalleryStore, JournaledStorage, PickleStorage
+
+
+class CachedStore(PickleStorage):
+    default_id = "cache_test.dat"
+    default_value = {}
+    read_cache = True
+
+
+class JournalStore(JournaledStorage):
+    default_id = "journal_test.dat"
+
+
+class TestReadCache(unittest.IsolatedAsyncioTestCase):
+    """
+    Tests that reads are served from memory until the file changes.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = CachedStore(base_path=Path(self.directory.name))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    async def test_hits(self):
+        """ Reading an unchanged file again is a hit returning the same object. """
+        await self.store.write({'a': 1})
+        first = await self.store.read()
+        self.assertIs(await self.store.read(), first)
+        self.assertEqual(self.store.cache_info(), {'hits': 1, 'misses': 1})
+
+    async def test_own_write(self):
+        """ A write from any instance drops the cached copy. """
+        await self.store.write({'a': 1})
+        await self.store.read()
+        await CachedStore(base_path=Path(self.directory.name)).write({'a': 2})
+        self.assertEqual(await self.store.read(), {'a': 2})
+        self.assertEqual(self.store.cache_info(), {'hits': 0, 'misses': 2})
+
+    async def test_changed_on_disk(self):
+        """ A file rewritten behind the cache's back is read again. """
+        await self.store.write({'a': 1})
+        await self.store.read()
+        with self.store.get_path_to_cache().open('wb') as f:
+            pickle.dump({'a': 1, 'b': 2}, f)
+        self.assertEqual(await self.store.read(), {'a': 1, 'b': 2})
+        self.assertEqual(self.store.cache_misses, 2)
+
+    async def test_disabled(self):
+        store = CachedStore(base_path=Path(self.directory.name), read_cache=False)
+        await store.write({'a': 1})
+        first = await store.read()
+        self.assertIsNot(await store.read(), first)
+        self.assertEqual(store.cache_info(), {'hits': 0, 'misses': 0})
+
+
+class TestJournaledStorage(unittest.IsolatedAsyncioTestCase):
+    """
+    Tests that changes appended to the journal are replayed over the snapshot.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = JournalStore(base_path=Path(self.directory.name))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    async def test_replay(self):
+        """ Sets and deletes reach the journal and read back in order. """
+        await self.store.set_item('a', 1)
+        await self.store.set_items({'b': 2, 'c': 3})
+        await self.store.delete_item('a')
+        await self.store.set_item('b', 4)
+
+        self.assertTrue(self.store.get_journal_path().exists())
+        self.assertEqual(await self.store.read(), {'b': 4, 'c': 3})
+        # A new instance has nothing cached and replays the journal from scratch
+        fresh = JournalStore(base_path=Path(self.directory.name))
+        self.assertEqual(await fresh.read(), {'b': 4, 'c': 3})
+
+    async def test_torn_record(self):
+        """ A record cut short by a crash is ignored, and every record before it still applies. """
+        await self.store.set_items({'a': 1, 'b': 2})
+        record = pickle.dumps(('set', 'c', 3))
+        with self.store.get_journal_path().open('ab') as f:
+            f.write(JournaledStorage._record_header.pack(len(record)) + record[:len(record) // 2])
+
+        fresh = JournalStore(base_path=Path(self.directory.name))
+        self.assertEqual(await fresh.read(), {'a': 1, 'b': 2})
+
+        # The next write replaces the torn record rather than landing after it
+        await fresh.set_item('d', 4)
+        self.assertEqual(await fresh.read(), {'a': 1, 'b': 2, 'd': 4})
+        self.assertEqual(await JournalStore(base_path=Path(self.directory.name)).read(), {'a': 1, 'b': 2, 'd': 4})
+        await self.store.set_item('e', 5)
+        self.assertEqual(await self.store.read(), {'a': 1, 'b': 2, 'd': 4, 'e': 5})
+
+    async def test_compaction(self):
+        """ Compacting folds the journal into the snapshot and removes it. """
+        await self.store.set_items({'a': 1, 'b': 2})
+        await self.store.delete_item('a')
+        await self.store.compact()
+
+        self.assertFalse(self.store.get_journal_path().exists())
+        with self.store.get_path_to_cache().open('rb') as f:
+            self.assertEqual(pickle.load(f), {'b': 2})
+        self.assertEqual(await self.store.read(), {'b': 2})
+
+    async def test_compaction_threshold(self):
+        """ The journal is compacted by itself once it grows past the threshold. """
+        self.store.compact_threshold = 256
+        for i in range(20):
+            await self.store.set_item(f'user{i}', i)
+
+        journal_path = self.store.get_journal_path()
+        self.assertLessEqual(journal_path.stat().st_size if journal_path.exists() else 0, 256)
+        self.assertEqual(await self.store.read(), {f'user{i}': i for i in range(20)})
+
+
+class TestGalleryStore(unittest.IsolatedAsyncioTestCase):
+    """
+    Tests the encrypted gallery matrix and its index.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.gallery = GalleryStore(base_path=Path(self.directory.name), key=Fernet.generate_key())
+        self.encodings = np.random.default_rng(0).normal(0, 0.1, (4, 128))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    async def test_append(self):
+        """ Appended encodings load back in order, and re-enrolling replaces a user's row. """
+        rows = await self.gallery.extend(['a', 'b', 'c'], self.encodings[:3])
+        self.assertEqual(rows, [0, 1, 2])
+        self.assertEqual(await self.gallery.append('a', self.encodings[3]), 3)
+
+        names, matrix = await self.gallery.load()
+        self.assertEqual(names, ['b', 'c', 'a'])
+        np.testing.assert_array_equal(np.asarray(matrix), self.encodings[[1, 2, 3]])
+        np.testing.assert_array_equal(matrix[2], self.encodings[3])
+        index = await self.gallery.read_index()
+        np.testing.assert_array_equal(await self.gallery.read_encodings(index, ['c']), self.encodings[[2]])
+
+    async def test_encrypted_at_rest(self):
+        """ No encoding appears in the matrix file, and a tampered row fails to load. """
+        await self.gallery.extend(['a', 'b'], self.encodings[:2])
+        matrix_path = self.gallery.get_matrix_path()
+        data = bytearray(matrix_path.read_bytes())
+        for encoding in self.encodings[:2]:
+            self.assertNotIn(encoding.tobytes()[:16], data)
+
+        data[GalleryStore.nonce_size] ^= 1
+        matrix_path.write_bytes(bytes(data))
+        _, matrix = await self.gallery.load()
+        with self.assertRaises(ValueError):
+            matrix[0]
+        np.testing.assert_array_equal(matrix[1], self.encodings[1])
+
+    async def test_remove(self):
+        """ Removed users are left out of the gallery. """
+        await self.gallery.extend(['a', 'b', 'c'], self.encodings[:3])
+        await self.gallery.remove_many(['b', 'missing'])
+
+        names, matrix = await self.gallery.load()
+        self.assertEqual(names, ['a', 'c'])
+        np.testing.assert_array_equal(np.asarray(matrix), self.encodings[[0, 2]])
+
+    async def test_compact(self):
+        """ Compacting drops the dead rows and keeps every live encoding. """
+        await self.gallery.extend(['a', 'b', 'c'], self.encodings[:3])
+        await self.gallery.append('a', self.encodings[3])
+        await self.gallery.remove('b')
+        await self.gallery.compact()
+
+        index = await self.gallery.read_index()
+        self.assertEqual(index['names'], ['c', 'a'])
+        self.assertEqual(index['compactions'], 1)
+        self.assertEqual(self.gallery.get_matrix_path().stat().st_size, 2 * self.gallery.record_bytes(index))
+        names, matrix = await self.gallery.load()
+        self.assertEqual(names, ['c', 'a'])
+        np.testing.assert_array_equal(np.asarray(matrix), self.encodings[[2, 3]])
+
+    async def test_automatic_compaction(self):
+        """ The gallery compacts itself once enough of it is dead rows. """
+        self.gallery.compact_min_dead_rows = 2
+        await self.gallery.extend(['a', 'b', 'c', 'd'], self.encodings)
+        await self.gallery.remove('a')
+        self.assertEqual((await self.gallery.read_index())['compactions'], 0)
+        await self.gallery.remove('b')
+
+        index = await self.gallery.read_index()
+        self.assertEqual(index['compactions'], 1)
+        self.assertEqual(index['names'], ['c', 'd'])
+
+    async def test_rows_after_compaction(self):
+        """ The rows returned by an append that compacted are the ones the users ended up in. """
+        self.gallery.compact_min_dead_rows = 2
+        await self.gallery.extend(['a', 'b', 'c', 'd'], self.encodings)
+        await self.gallery.remove('a')
+        rows = await self.gallery.extend(['b', 'c', 'e'], self.encodings[:3])
+
+        index = await self.gallery.read_index()
+        self.assertEqual(index['compactions'], 1)
+        self.assertEqual(rows, [index['rows'][name] for name in ('b', 'c', 'e')])
+        self.assertEqual(rows, [1, 2, 3])
+
+    async def test_plaintext_gallery(self):
+        """ A gallery written before rows were encrypted is encrypted when first read. """
+        self.encodings.tofile(self.gallery.get_matrix_path())
+        with self.gallery.get_path_to_cache().open('wb') as f:
+            pickle.dump({
+                'names': ['a', None, 'c', 'd'], 'rows': {'a': 0, 'c': 2, 'd': 3},
+                'generation': 2, 'compactions': 0, 'dtype': 'float64'
+            }, f)
+
+        names, matrix = await self.gallery.load()
+        self.assertEqual(names, ['a', 'c', 'd'])
+        np.testing.assert_array_equal(np.asarray(matrix), self.encodings[[0, 2, 3]])
+        self.assertNotIn(self.encodings[0].tobytes()[:16], self.gallery.get_matrix_path().read_bytes())
+
+
+class TestEncodingStorageDtype(unittest.TestCase):
+
+    def test_environment(self):
+        """ Every process storing encodings picks up the precision from the environment. """
+        script = (
+            "import asyncio, sys, numpy as np\n"
+            "from cryptography.fernet import Fernet\n"
+            "from storage import GalleryStore, UserStorage\n"
+            "gallery = GalleryStore(base_path=sys.argv[1], key=Fernet.generate_key())\n"
+            "asyncio.run(gallery.extend(['a'], np.zeros((1, 128))))\n"
+            "print(UserStorage.encoding_dtype, asyncio.run(gallery.read_index())['dtype'])\n"
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            result = subprocess.run(
+                [sys.executable, "-c", script, directory], capture_output=True, text=True, check=True,
+                cwd=Path(__file__).parent, env=dict(os.environ, ENCODING_STORAGE_DTYPE="float32")
+            )
+        self.assertEqual(result.stdout.split(), ["float32", "float32"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+
+from tracking import FaceTracker, box_iou
+
+
+class TestBoxIou(unittest.TestCase):
+
+    def test_overlap(self):
+        box = (0, 10, 10, 0)
+        self.assertEqual(box_iou(box, box), 1.0)
+        self.assertAlmostEqual(box_iou(box, (0, 15, 10, 5)), 50 / 150)
+        self.assertEqual(box_iou(box, (20, 30, 30, 20)), 0.0)
+        self.assertEqual(box_iou(box, (0, 20, 10, 10)), 0.0)
+
+
+class TestFaceTracker(unittest.TestCase):
+    """
+    Tests that faces keep their track across frames, and are only encoded again when needed.
+    """
+    def setUp(self):
+        self.tracker = FaceTracker(threshold=0.6, refresh_interval=2.0, confidence_margin=0.1, max_age=1.0)
+
+    def test_follows_moving_face(self):
+        """ A box that moves a little between frames stays on the same track. """
+        first, = self.tracker.update([(0, 100, 100, 0)], now=0.0)
+        moved, = self.tracker.update([(10, 110, 110, 10)], now=0.1)
+        self.assertIs(moved, first)
+        self.assertEqual(moved.box, (10, 110, 110, 10))
+
+        other, again = self.tracker.update([(300, 400, 400, 300), (10, 110, 110, 10)], now=0.2)
+        self.assertIs(again, first)
+        self.assertNotEqual(other.track_id, first.track_id)
+        self.assertEqual(len(self.tracker.tracks), 2)
+
+    def test_one_box_per_track(self):
+        """ Two boxes over the same track don't both claim it. """
+        track, = self.tracker.update([(0, 100, 100, 0)], now=0.0)
+        closer, further = self.tracker.update([(0, 100, 100, 5), (0, 100, 100, 40)], now=0.1)
+        self.assertIs(closer, track)
+        self.assertIsNot(further, track)
+
+    def test_expiry(self):
+        """ A track not seen for `max_age` is dropped, and the face comes back as a new track. """
+        track, = self.tracker.update([(0, 100, 100, 0)], now=0.0)
+        self.tracker.update([], now=1.5)
+        self.assertEqual(self.tracker.tracks, [])
+        returned, = self.tracker.update([(0, 100, 100, 0)], now=1.6)
+        self.assertNotEqual(returned.track_id, track.track_id)
+
+    def test_needs_encoding(self):
+        """ Only a confident, recent match is reused. """
+        track, = self.tracker.update([(0, 100, 100, 0)], now=0.0)
+        self.assertTrue(self.tracker.needs_encoding(track, now=0.0))
+
+        track.identify('alice', 0.3, now=0.0)
+        self.assertFalse(self.tracker.needs_encoding(track, now=1.0))
+        self.assertEqual(self.tracker.skip_boxes(now=1.0), [track.box])
+        self.assertTrue(self.tracker.needs_encoding(track, now=2.5))
+
+        # Too close to the threshold to trust, on either side of it
+        for distance in (0.55, 0.65):
+            track.identify('alice', distance, now=0.0)
+            self.assertTrue(self.tracker.needs_encoding(track, now=0.1))
+        self.assertEqual(self.tracker.skip_boxes(now=0.1), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+import functools
+import http.server
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from time import monotonic
+from unittest import mock
+
+import cv2 as cv
+import numpy as np
+
+from video_sources import (
+    CaptureSource, ImageDirectorySource, SyntheticSource, VideoFileSource, open_source
+)
+
+
+def frame(value, size=(64, 48)):
+    return np.full((size[1], size[0], 3), value, dtype=np.uint8)
+
+
+def read_all(source, limit=100):
+    frames = []
+    while len(frames) < limit:
+        ok, image = source.read()
+        if not ok:
+            break
+        frames.append(image)
+    return frames
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+class SourceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_video(self, name="clip.avi", frames=12, fps=10):
+        path = self.path / name
+        writer = cv.VideoWriter(str(path), cv.VideoWriter_fourcc(*"MJPG"), fps, (64, 48))
+        for i in range(frames):
+            writer.write(frame(i * 20))
+        writer.release()
+        return path
+
+
+class TestVideoFileSource(SourceTestCase):
+
+    def test_read(self):
+        """ Every frame is read, in order, and then the source is finished. """
+        source = VideoFileSource(self.write_video(), pacing="fast")
+        self.assertTrue(source.isOpened())
+        self.assertEqual(source.fps, 10)
+        frames = read_all(source)
+        source.release()
+        self.assertEqual(len(frames), 12)
+        self.assertTrue(source.finished)
+        self.assertEqual(source.read(), (False, None))
+        self.assertLess(abs(int(frames[5][24, 32, 0]) - 100), 10)
+
+    def test_realtime(self):
+        """ Realtime pacing hands frames out no faster than the video was recorded at. """
+        source = VideoFileSource(self.write_video(frames=6, fps=50))
+        started = monotonic()
+        self.assertEqual(len(read_all(source)), 6)
+        self.assertGreaterEqual(monotonic() - started, 5 / 50)
+        source.release()
+
+
+class TestImageDirectorySource(SourceTestCase):
+
+    def test_read(self):
+        """ Images are read in name order, skipping files that aren't readable images. """
+        for name, value in (("b.png", 20), ("a.jpg", 10), ("c.png", 30)):
+            cv.imwrite(str(self.path / name), frame(value))
+        (self.path / "broken.jpg").write_bytes(b"not an image")
+        (self.path / "notes.txt").write_text("not an image either")
+
+        source = ImageDirectorySource(self.path)
+        self.assertEqual(source.pacing, "fast")
+        self.assertEqual([int(image[0, 0, 0]) for image in read_all(source)], [10, 20, 30])
+        self.assertTrue(source.finished)
+
+    def test_empty(self):
+        self.assertFalse(ImageDirectorySource(self.path).isOpened())
+
+
+class TestSyntheticSource(unittest.TestCase):
+
+    def test_frames(self):
+        """ Frames are reproducible, differ from one to the next and stop after `frames`. """
+        frames = read_all(SyntheticSource(width=160, height=120, frames=5, seed=3))
+        again = read_all(SyntheticSource(width=160, height=120, frames=5, seed=3))
+        self.assertEqual(len(frames), 5)
+        self.assertEqual(frames[0].shape, (120, 160, 3))
+        for image, same in zip(frames, again):
+            np.testing.assert_array_equal(image, same)
+        self.assertFalse(np.array_equal(frames[0], frames[1]))
+
+    def test_pacing(self):
+        started = monotonic()
+        read_all(SyntheticSource(fps=50, frames=6, pacing="realtime"))
+        self.assertGreaterEqual(monotonic() - started, 5 / 50)
+
+        started = monotonic()
+        read_all(SyntheticSource(fps=1, frames=6))
+        self.assertLess(monotonic() - started, 1)
+
+    def test_unknown_pacing(self):
+        with self.assertRaises(ValueError):
+            SyntheticSource(pacing="slow")
+
+
+class TestCaptureSource(SourceTestCase):
+    """
+    Reads a network stream from a local HTTP server standing in for a camera.
+    """
+    def setUp(self):
+        super().setUp()
+        self.write_video(frames=8)
+        handler = functools.partial(QuietHandler, directory=str(self.path))
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/clip.avi"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+    def test_stream(self):
+        source = open_source(self.url)
+        self.assertIsInstance(source, CaptureSource)
+        self.assertTrue(source.isOpened())
+        self.assertEqual(len(read_all(source)), 8)
+        source.release()
+
+    def test_reconnect(self):
+        """ A stream that drops is reopened rather than finishing the source. """
+        source = CaptureSource(self.url, reconnect_delay=0)
+        self.assertEqual(len(read_all(source)), 8)
+        self.assertFalse(source.finished)
+        self.assertEqual(len(read_all(source)), 8)
+        source.release()
+
+
+class TestOpenSource(SourceTestCase):
+
+    def test_specs(self):
+        self.assertIsInstance(open_source(str(self.write_video())), VideoFileSource)
+        self.assertIsInstance(open_source(str(self.path), pacing="realtime"), ImageDirectorySource)
+        self.assertEqual(open_source(str(self.path), pacing="realtime").pacing, "realtime")
+
+        synthetic = open_source("synthetic:320x240@15")
+        self.assertIsInstance(synthetic, SyntheticSource)
+        self.assertEqual((synthetic.background.shape, synthetic.fps), ((240, 320, 3), 15.0))
+        self.assertEqual(open_source("synthetic").background.shape, (480, 640, 3))
+
+    def test_camera(self):
+        with mock.patch("video_sources.cv.VideoCapture") as capture:
+            for spec in (1, "1"):
+                source = open_source(spec)
+                self.assertIsInstance(source, CaptureSource)
+                capture.assert_called_with(1)
+
+
+if __name__ == '__main__':
+    unittest.main()
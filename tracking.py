@@ -0,0 +1,98 @@
+import itertools
+
+
+def box_iou(a, b) -> float:
+	""" Intersection over union of two (top, right, bottom, left) boxes. """
+	top, right = max(a[0], b[0]), min(a[1], b[1])
+	bottom, left = min(a[2], b[2]), max(a[3], b[3])
+	intersection = max(0, right - left) * max(0, bottom - top)
+	if not intersection:
+		return 0.0
+	area_a = (a[1] - a[3]) * (a[2] - a[0])
+	area_b = (b[1] - b[3]) * (b[2] - b[0])
+	return intersection / float(area_a + area_b - intersection)
+
+
+class Track:
+	""" A face followed across frames, along with the identity it was last matched to. """
+	__slots__ = ('track_id', 'box', 'name', 'distance', 'encoded_at', 'last_seen')
+
+	def __init__(self, track_id: int, box, now: float):
+		self.track_id = track_id
+		self.box = box
+		self.name = None
+		self.distance = None
+		self.encoded_at = None
+		self.last_seen = now
+
+	def identify(self, name: str, distance: float, now: float) -> None:
+		self.name = name
+		self.distance = distance
+		self.encoded_at = now
+
+
+class FaceTracker:
+	""" Gives the faces detected in consecutive frames stable track ids by matching each box
+	to the track it overlaps most (IoU), so that a face that stays in view doesn't have to be
+	encoded and matched against the gallery again on every frame.
+
+	A track needs a fresh encoding when it is new, when its last match was within
+	`confidence_margin` of the recognition threshold either way, or when it was last encoded
+	more than `refresh_interval` seconds ago. Tracks not seen for `max_age` seconds are
+	dropped. """
+
+	def __init__(self, threshold: float=0.6, refresh_interval: float=2.0, confidence_margin: float=0.1,
+			iou_threshold: float=0.3, max_age: float=1.0):
+		self.threshold = threshold
+		self.refresh_interval = refresh_interval
+		self.confidence_margin = confidence_margin
+		self.iou_threshold = iou_threshold
+		self.max_age = max_age
+		self.tracks = []
+		self._ids = itertools.count(1)
+		self.encodings_skipped = 0
+		self.encodings_needed = 0
+
+	def needs_encoding(self, track: Track, now: float) -> bool:
+		if track.encoded_at is None or now - track.encoded_at > self.refresh_interval:
+			return True
+		return abs(track.distance - self.threshold) < self.confidence_margin
+
+	def skip_boxes(self, now: float) -> list:
+		""" The boxes of tracks that don't need a new encoding. A face detected over one of
+		these can reuse the track's identity instead of being encoded. """
+		return [track.box for track in self.tracks if not self.needs_encoding(track, now)]
+
+	def update(self, face_locations, now: float) -> list:
+		""" Associates this frame's face boxes with existing tracks, starting new tracks for
+		boxes that overlap none of them. Returns the track for each box, in the same order. """
+		self.tracks = [track for track in self.tracks if now - track.last_seen <= self.max_age]
+
+		# Greedily pair up the most overlapping box/track combinations first
+		pairs = sorted(
+			(
+				(box_iou(box, track.box), box_index, track_index)
+				for box_index, box in enumerate(face_locations)
+				for track_index, track in enumerate(self.tracks)
+			),
+			reverse=True
+		)
+		assigned, used_tracks = {}, set()
+		for iou, box_index, track_index in pairs:
+			if iou < self.iou_threshold:
+				break
+			if box_index in assigned or track_index in used_tracks:
+				continue
+			assigned[box_index] = self.tracks[track_index]
+			used_tracks.add(track_index)
+
+		frame_tracks = []
+		for box_index, box in enumerate(face_locations):
+			track = assigned.get(box_index)
+			if track is None:
+				track = Track(next(self._ids), box, now)
+				self.tracks.append(track)
+			track.box = box
+			track.last_seen = now
+			frame_tracks.append(track)
+		return frame_tracks
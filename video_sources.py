@@ -0,0 +1,182 @@
+import abc
+from pathlib import Path
+from time import monotonic, sleep
+
+import cv2 as cv
+import numpy as np
+
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tif', '.tiff'}
+PACINGS = ("realtime", "fast")
+
+
+class VideoSource(abc.ABC):
+	""" Somewhere frames come from, read like a cv.VideoCapture: `read()` returns (ok, image)
+	with image a BGR frame.
+
+	With "realtime" pacing, `read()` hands out frames no faster than `fps`, as a camera would.
+	With "fast" pacing, frames come as fast as they can be decoded, and capture waits for
+	recognition to take each one instead of dropping it. Sources that run out of frames set
+	`finished` once they have. """
+
+	default_pacing = "realtime"
+
+	def __init__(self, pacing: str=None, fps: float=None):
+		pacing = pacing or self.default_pacing
+		if pacing not in PACINGS:
+			raise ValueError(f"Unknown pacing '{pacing}', expected one of {', '.join(PACINGS)}")
+		self.pacing = pacing
+		self.fps = fps
+		self.finished = False
+		self._started = None
+		self._frames_read = 0
+
+	def isOpened(self) -> bool:
+		return True
+
+	@abc.abstractmethod
+	def _read(self):
+		""" Returns the next (ok, image) pair, without any pacing. """
+
+	def read(self):
+		if self.finished:
+			return False, None
+		ok, image = self._read()
+		if not ok:
+			return False, None
+		if self.pacing == "realtime" and self.fps:
+			# Schedule against the first frame, so time spent decoding doesn't add up into drift
+			if self._started is None:
+				self._started = monotonic()
+			delay = self._started + self._frames_read / self.fps - monotonic()
+			if delay > 0:
+				sleep(delay)
+		self._frames_read += 1
+		return True, image
+
+	def release(self) -> None:
+		pass
+
+
+class CaptureSource(VideoSource):
+	""" A camera, or a network stream such as RTSP or HTTP, opened through OpenCV. These
+	deliver frames at their own rate, so they are never paced here. A network stream that
+	drops is reopened after `reconnect_delay` seconds. """
+
+	def __init__(self, device, reconnect_delay: float=2.0):
+		super().__init__(pacing="realtime")
+		self.device = device
+		self.reconnect_delay = reconnect_delay
+		self.cap = cv.VideoCapture(device)
+
+	def isOpened(self) -> bool:
+		return self.cap.isOpened()
+
+	def _read(self):
+		ok, image = self.cap.read()
+		if not ok and isinstance(self.device, str):
+			self.cap.release()
+			sleep(self.reconnect_delay)
+			self.cap = cv.VideoCapture(self.device)
+		return ok, image
+
+	def release(self) -> None:
+		self.cap.release()
+
+
+class VideoFileSource(VideoSource):
+	""" A recorded video, played at the rate it was recorded at unless paced "fast". """
+
+	def __init__(self, path, pacing: str=None):
+		self.path = Path(path)
+		self.cap = cv.VideoCapture(str(self.path))
+		super().__init__(pacing, self.cap.get(cv.CAP_PROP_FPS) or 30.0)
+
+	def isOpened(self) -> bool:
+		return self.cap.isOpened()
+
+	def _read(self):
+		ok, image = self.cap.read()
+		if not ok:
+			self.finished = True
+		return ok, image
+
+	def release(self) -> None:
+		self.cap.release()
+
+
+class ImageDirectorySource(VideoSource):
+	""" Every image in a directory, in name order, as consecutive frames. """
+
+	default_pacing = "fast"
+
+	def __init__(self, directory, pacing: str=None, fps: float=10.0):
+		super().__init__(pacing, fps)
+		self.directory = Path(directory)
+		self.paths = sorted(path for path in self.directory.iterdir() if path.suffix.lower() in IMAGE_EXTENSIONS)
+		self._next = 0
+
+	def isOpened(self) -> bool:
+		return bool(self.paths)
+
+	def _read(self):
+		while self._next < len(self.paths):
+			path = self.paths[self._next]
+			self._next += 1
+			image = cv.imread(str(path))
+			if image is not None:
+				return True, image
+		self.finished = True
+		return False, None
+
+
+class SyntheticSource(VideoSource):
+	""" Reproducible generated frames, for running the pipeline without a camera: fixed noise
+	with a bright square moving across it, so the motion gate sees movement. There are no
+	faces in them. Runs forever unless limited to `frames`. """
+
+	default_pacing = "fast"
+
+	def __init__(self, width: int=640, height: int=480, fps: float=30.0, frames: int=None, seed: int=0,
+			pacing: str=None):
+		super().__init__(pacing, fps)
+		self.frames = frames
+		self.background = np.random.default_rng(seed).integers(0, 64, (height, width, 3), dtype=np.uint8)
+		self._index = 0
+
+	def _read(self):
+		if self.frames is not None and self._index >= self.frames:
+			self.finished = True
+			return False, None
+		height, width = self.background.shape[:2]
+		size = max(8, min(width, height) // 6)
+		x = (self._index * 4) % max(1, width - size)
+		y = (height - size) // 2
+		# A new array every frame, as later stages hold on to the frames they are given
+		image = self.background.copy()
+		image[y:y + size, x:x + size] = 255
+		self._index += 1
+		return True, image
+
+
+def open_source(spec=0, pacing: str=None) -> VideoSource:
+	""" Opens a source from a camera index, a video file, a directory of images, an RTSP or
+	HTTP URL, or "synthetic", optionally followed by ":<width>x<height>@<fps>", for
+	generated frames. `pacing` overrides the source's own default. """
+	if isinstance(spec, int) or (isinstance(spec, str) and spec.isdigit()):
+		return CaptureSource(int(spec))
+	spec = str(spec)
+	if spec == "synthetic" or spec.startswith("synthetic:"):
+		options = {}
+		if ":" in spec:
+			size, _, fps = spec.split(":", 1)[1].partition("@")
+			if size:
+				options['width'], options['height'] = (int(value) for value in size.split("x"))
+			if fps:
+				options['fps'] = float(fps)
+		return SyntheticSource(pacing=pacing, **options)
+	if "://" in spec:
+		return CaptureSource(spec)
+	if Path(spec).is_dir():
+		return ImageDirectorySource(spec, pacing)
+	return VideoFileSource(spec, pacing)